@@ -1,10 +1,19 @@
 #!/usr/bin/env python
 
 import web
+import clientWrapper as dbclient
 import ovsdb
 import simplejson as json
 import ofctrl
 
+# handlers return dicts, encoded once on their way out; ujson is used when
+# it is installed, it encodes large port lists several times faster
+try:
+    import ujson
+    encode = ujson.dumps
+except ImportError:
+    encode = json.dumps
+
 urls = (
     '/', 'Index',
 # All Bridges
@@ -13,11 +22,18 @@ urls = (
 # A single Bridge
     '/bridges/(\w+)', 'Bridge',
     '/bridges/(\w+)/(update|del)', 'Bridge',
+    '/bridges/(\w+)/changes', 'Changes',
+    '/bridges/(\w+)/batch', 'Batch',
 # Controllers
     '/bridges/(\w+)/controllers', 'Controller',
     '/bridges/(\w+)/controllers/(update|del|add)', 'Controller',
 # Normal Ports
     '/bridges/(\w+)/ports', 'Ports',
+    '/bridges/(\w+)/ports/rates', 'PortRates',
+    '/bridges/(\w+)/ports/stats', 'PortStats',
+    '/bridges/(\w+)/ports/top', 'TopPorts',
+    '/ports/top', 'TopPorts',
+    '/bridges/(\w+)/ports/(\w+)/history', 'PortHistory',
     '/bridges/(\w+)/ports/(\w+)/(update|del|add)', 'Ports',
 # Mirrors
     '/bridges/(\w+)/mirrors', 'Mirror',
@@ -36,12 +52,47 @@ urls = (
     '/bridges/(\w+)/qos', 'QoSes',
     '/bridges/(\w+)/qos/add', 'QoSes',
     '/bridges/(\w+)/qos/(\w{8})/(update|del)', 'QoS',
+# Replica
+    '/replica', 'Replica',
+    '/cache', 'Cache',
 # Flows
     '/bridges/([\w:.]+)/tables', 'Tables',
     '/bridges/([\w:.]+)/tables/(\d+)/flows', 'Flows',
     '/bridges/([\w:.]+)/tables/(\d+)/flows/(update|add|del)', 'Flows',
 )
 
+def minimal():
+    """
+    POST ...?response=minimal answers with only the row the change created,
+    changed or deleted, see ovsdb.py.
+    """
+    return web.input(_method="get", response=None).response == "minimal"
+
+def check_etag(tag):
+    """
+    Send tag as the ETag of the response and answer 304 Not Modified right
+    away if the client already holds it. tag None sends no ETag.
+    """
+    if tag is None:
+        return
+    web.header("ETag", tag)
+    held = [t.strip() for t in web.ctx.env.get("HTTP_IF_NONE_MATCH",
+        "").split(",")]
+    if tag in held or "*" in held:
+        raise web.notmodified()
+
+def tagged(get, *args, **kwargs):
+    """
+    Answer get(*args, **kwargs) under its ETag, see check_etag(). Endpoints
+    served from the cache are looked up by the tag as well, so the body is
+    never older than the tag.
+    """
+    tag = ovsdb.etag(get, *args, **kwargs)
+    check_etag(tag)
+    if getattr(get, "cached", False):
+        kwargs["etag"] = tag
+    return get(*args, **kwargs)
+
 class Index(object):
     def GET(self):
         # redirect to layout template
@@ -52,7 +103,7 @@ class Bridges(object):
         """
         GET /bridges
         """
-        return ovsdb.fast_get_bridges()
+        return tagged(ovsdb.fast_get_bridges)
 
     def POST(self):
         """
@@ -60,14 +111,14 @@ class Bridges(object):
         """
         getInput = web.input()
         # TODO, elaborate add_bridge
-        return ovsdb.add_bridge(str(getInput.name))
+        return ovsdb.add_bridge(str(getInput.name), minimal=minimal())
 
 class Bridge(object):
     def GET(self, name):
         """
         GET /bridges/br0
         """
-        return ovsdb.get_bridge(name)
+        return tagged(ovsdb.get_bridge, name)
 
     def POST(self, name, op):
         """
@@ -77,17 +128,41 @@ class Bridge(object):
         data = web.data()
         if op == "update":
             # TODO, elaborate update_bridge
-            return ovsdb.update_bridge(name, data)
+            return ovsdb.update_bridge(name, data, minimal=minimal())
         elif op == "del":
             # TODO, elaborate del_bridge
-            return ovsdb.del_bridge(name)
+            return ovsdb.del_bridge(name, minimal=minimal())
+
+class Changes(object):
+    def GET(self, name):
+        """
+        GET /bridges/br0/changes?since=42
+        GET /bridges/br0/changes?since=42&wait=25
+        """
+        params = web.input(since=None, wait=0)
+        try:
+            since = int(params.since) if params.since is not None else None
+        except ValueError:
+            since = None
+        try:
+            wait = max(float(params.wait), 0)
+        except ValueError:
+            wait = 0
+        return ovsdb.get_changes(name, since, wait)
+
+class Batch(object):
+    def POST(self, name):
+        """
+        POST /bridges/br0/batch
+        """
+        return ovsdb.batch(name, web.data())
 
 class Controller(object):
     def GET(self, name):
         """
         GET /bridges/br0/controllers
         """
-        return ovsdb.get_controllers(name)
+        return tagged(ovsdb.get_controllers, name)
 
     def POST(self, name, op):
         """
@@ -97,18 +172,26 @@ class Controller(object):
         """
         data = web.data()
         if op == "update":
-            return ovsdb.update_controller(name, data)
+            return ovsdb.update_controller(name, data, minimal=minimal())
         elif op == "del":
-            return ovsdb.del_controller(name, data)
+            return ovsdb.del_controller(name, data, minimal=minimal())
         elif op == "add":
-            return ovsdb.add_controller(name, data)
+            return ovsdb.add_controller(name, data, minimal=minimal())
 
 class Ports(object):
     def GET(self, brname):
         """
         GET /bridges/br0/Ports
+        GET /bridges/br0/ports?limit=50&name_prefix=ge-&sort=-ofport
+        GET /bridges/br0/ports?limit=50&cursor=<next of the previous page>
+
+        Also filters by type, vlan_mode, tag and link_state.
         """
-        return ovsdb.get_ports(brname)
+        params = web.input(_method="get")
+        query = dict((key, params[key]) for key in ("limit", "cursor",
+            "name_prefix", "type", "vlan_mode", "tag", "link_state", "sort") \
+            if key in params)
+        return tagged(ovsdb.get_ports, brname, **query)
 
     def POST(self, brname, portname, op):
         """
@@ -118,18 +201,52 @@ class Ports(object):
         """
         data = web.data()
         if op == "update":
-            return ovsdb.update_port(brname, data)
+            return ovsdb.update_port(brname, data, minimal=minimal())
         elif op == "del":
-            return ovsdb.del_port(brname, data)
+            return ovsdb.del_port(brname, data, minimal=minimal())
         elif op == "add":
-            return ovsdb.add_port(brname, data)
+            return ovsdb.add_port(brname, data, minimal=minimal())
+
+class PortStats(object):
+    def GET(self, brname):
+        """
+        GET /bridges/br0/ports/stats
+        """
+        return ovsdb.get_port_stats(brname)
+
+class PortRates(object):
+    def GET(self, brname):
+        """
+        GET /bridges/br0/ports/rates
+        """
+        return ovsdb.get_port_rates(brname)
+
+class TopPorts(object):
+    def GET(self, brname=None):
+        """
+        GET /bridges/br0/ports/top?metric=tx_bps&n=10
+        GET /ports/top?metric=rx_errors&n=10, over every bridge
+        """
+        params = web.input(_method="get", metric="tx_bps", n=10)
+        return ovsdb.get_top_ports(brname, params.metric, params.n)
+
+class PortHistory(object):
+    def GET(self, brname, portname):
+        """
+        GET /bridges/br0/ports/eth0/history?metric=rx_bytes&from=1700000000
+        GET /bridges/br0/ports/eth0/history?metric=rx_bytes&step=60
+        """
+        params = web.input(_method="get", metric="rx_bytes", to=None,
+                step=None, **{"from": None})
+        return ovsdb.get_port_history(brname, portname, params.metric,
+                params["from"], params.to, params.step)
 
 class Mirror(object):
     def GET(self, brname):
         """
         GET /bridges/br0/mirrors
         """
-        return ovsdb.get_mirrors(brname)
+        return tagged(ovsdb.get_mirrors, brname)
 
     def POST(self, brname, mirrorname, op):
         """
@@ -139,18 +256,18 @@ class Mirror(object):
         """
         data = web.data()
         if op == "update":
-            return ovsdb.update_mirror(brname, data)
+            return ovsdb.update_mirror(brname, data, minimal=minimal())
         elif op == "del":
-            return ovsdb.del_mirror(brname, data)
+            return ovsdb.del_mirror(brname, data, minimal=minimal())
         elif op == "add":
-            return ovsdb.add_mirror(brname, data)
+            return ovsdb.add_mirror(brname, data, minimal=minimal())
 
 class NetFlow(object):
     def GET(self, brname):
         """
         GET /bridges/br0/netflow
         """
-        return ovsdb.get_netflows(brname)
+        return tagged(ovsdb.get_netflow, brname)
 
     def POST(self, brname, op):
         """
@@ -160,18 +277,18 @@ class NetFlow(object):
         """
         data = web.data()
         if op == "update":
-            return ovsdb.update_netflow(brname, data)
+            return ovsdb.update_netflow(brname, data, minimal=minimal())
         elif op == "del":
-            return ovsdb.del_netflow(brname, data)
+            return ovsdb.del_netflow(brname, data, minimal=minimal())
         elif op == "add":
-            return ovsdb.add_netflow(brname, data)
+            return ovsdb.add_netflow(brname, data, minimal=minimal())
 
 class sFlow(object):
     def GET(self, brname):
         """
         GET /bridges/br0/sflow
         """
-        return ovsdb.get_sflow(brname)
+        return tagged(ovsdb.get_sflow, brname)
 
     def POST(self, brname, op):
         """
@@ -181,25 +298,25 @@ class sFlow(object):
         """
         data = web.data()
         if op == "update":
-            return ovsdb.update_sflow(brname, data)
+            return ovsdb.update_sflow(brname, data, minimal=minimal())
         elif op == "del":
-            return ovsdb.del_sflow(brname, data)
+            return ovsdb.del_sflow(brname, data, minimal=minimal())
         elif op == "add":
-            return ovsdb.add_sflow(brname, data)
+            return ovsdb.add_sflow(brname, data, minimal=minimal())
 
 class Queues(object):
     def GET(self, brname):
         """
         GET /bridges/br0/queues
         """
-        return ovsdb.get_queues()
+        return tagged(ovsdb.get_queues)
 
     def POST(self, brname):
         """
         POST /bridges/br0/queues/add
         """
         data = web.data()
-        return ovsdb.add_queue(data)
+        return ovsdb.add_queue(data, minimal=minimal())
 
 class Queue(object):
     def GET(self):
@@ -212,23 +329,23 @@ class Queue(object):
         """
         data = web.data()
         if op == "update":
-            return ovsdb.update_queue(data)
+            return ovsdb.update_queue(data, minimal=minimal())
         elif op == "del":
-            return ovsdb.del_queue(data)
+            return ovsdb.del_queue(data, minimal=minimal())
 
 class QoSes(object):
     def GET(self, brname):
         """
         GET /bridges/br0/qos
         """
-        return ovsdb.get_all_qos()
+        return tagged(ovsdb.get_all_qos)
 
     def POST(self, brname):
         """
         POST /bridges/br0/qos/add
         """
         data = web.data()
-        return ovsdb.add_qos(data)
+        return ovsdb.add_qos(data, minimal=minimal())
 
 class QoS(object):
     def GET(self):
@@ -241,9 +358,23 @@ class QoS(object):
         """
         data = web.data()
         if op == "update":
-            return ovsdb.update_qos(data)
+            return ovsdb.update_qos(data, minimal=minimal())
         elif op == "del":
-            return ovsdb.del_qos(data)
+            return ovsdb.del_qos(data, minimal=minimal())
+
+class Replica(object):
+    def GET(self):
+        """
+        GET /replica
+        """
+        return ovsdb.get_replica_status()
+
+class Cache(object):
+    def GET(self):
+        """
+        GET /cache
+        """
+        return ovsdb.get_cache_stats()
 
 class Tables():
     def GET(self, brname):
@@ -271,14 +402,39 @@ class Flows():
         ofctl_wrapper = ofctrl.SimpleCtrl(brname)
 
         if op == "update":
-            return ofctl_wrapper.mod_flow(data)
+            return ofctl_wrapper.mod_flow(data, minimal=minimal())
         elif op == "del":
-            return ofctl_wrapper.del_flow(data)
+            return ofctl_wrapper.del_flow(data, minimal=minimal())
         elif op == "add":
-            return ofctl_wrapper.add_flow(data)
+            return ofctl_wrapper.add_flow(data, minimal=minimal())
+
+def json_response(handle):
+    """
+    web.py processor turning the dict or list a handler returns into the
+    JSON response body.
+    """
+    result = handle()
+    if isinstance(result, (dict, list)):
+        web.header("Content-Type", "application/json")
+        return encode(result)
+    return result
+
+def request_memo(handle):
+    """
+    web.py processor letting each request send a given select only once.
+    """
+    dbclient.begin_request()
+    try:
+        return handle()
+    finally:
+        dbclient.end_request()
 
 if __name__ == "__main__":
+    ovsdb.start_replica()
+    ovsdb.start_sampler()
     app = web.application(urls, globals())
+    app.add_processor(json_response)
+    app.add_processor(request_memo)
     app.run()
         #if name:
             #bridge = json.loads(ovsdb.get_bridge(str(name)))
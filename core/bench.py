@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""
+Measure the read endpoints of ovsdb.py against the ovsdb-server at
+clientWrapper.database.
+
+For every endpoint print the bytes read from the server and the time per
+call, with whole-row selects and with column projection. "decode" times
+the schema-compiled row decoders against generic decoding of the same
+rows, and building bridge views from them. "memory" compares the size of
+whole rows in OVSDB notation with the records the replica keeps.
+
+usage: bench.py [calls]
+       bench.py decode [rounds]
+       bench.py memory
+"""
+import sys
+import time
+import simplejson as json
+import clientWrapper as dbclient
+import jsonrpc
+import ovsdb
+import records
+import schema
+from index import Index
+
+def endpoints():
+    bridges = ovsdb.fast_get_bridges()["bridges"]
+    if not bridges:
+        return [("fast_get_bridges", ovsdb.fast_get_bridges)]
+    brname = bridges[0]["name"]
+    calls = [
+        ("fast_get_bridges", ovsdb.fast_get_bridges),
+        ("get_bridges", ovsdb.get_bridges),
+        ("get_bridge", lambda: ovsdb.get_bridge(brname)),
+        ("get_ports", lambda: ovsdb.get_ports(brname)),
+        ("get_controllers", lambda: ovsdb.get_controllers(brname)),
+        ("get_mirrors", lambda: ovsdb.get_mirrors(brname)),
+        ("get_sflow", lambda: ovsdb.get_sflow(brname)),
+        ("get_netflow", lambda: ovsdb.get_netflow(brname)),
+        ("get_all_qos", ovsdb.get_all_qos),
+        ("get_queues", ovsdb.get_queues),
+        ]
+    ports = ovsdb.get_ports(brname)["ports"]
+    if ports:
+        portname = ports[0]["name"]
+        calls.append(("get_port", lambda: ovsdb.get_port(brname, portname)))
+    return calls
+
+def measure(call, n):
+    """
+    Return (bytes, seconds) per call.
+    """
+    call()
+    received = jsonrpc.received
+    start = time.time()
+    for i in xrange(n):
+        call()
+    return (jsonrpc.received - received) / n, (time.time() - start) / n
+
+def main(n):
+    # measure the reads, not the response cache
+    ovsdb._cache.ttl = 0
+    print "%-18s %12s %12s %7s %10s %10s" % ("endpoint", "full B",
+            "projected B", "saved", "full ms", "proj. ms")
+    for name, call in endpoints():
+        ovsdb.projection = False
+        full, full_time = measure(call, n)
+        ovsdb.projection = True
+        projected, projected_time = measure(call, n)
+        saved = 100.0 * (full - projected) / full if full else 0
+        print "%-18s %12d %12d %6.1f%% %10.2f %10.2f" % (name, full,
+                projected, saved, full_time * 1000, projected_time * 1000)
+
+def decode(n):
+    """
+    Decode the rows behind get_bridges n times.
+    """
+    s = dbclient.get_schema()
+    params = json.loads(ovsdb._bridge_transact([], ovsdb._bridge_columns,
+        ovsdb._bridge_joins))
+    session = jsonrpc.Session(dbclient.database)
+    results = session.transact(params)
+    session.close()
+    tables = [op["table"] for op in params[1:]]
+    rows = [(table, row) for table, result in zip(tables, results) \
+            for row in result["rows"]]
+
+    start = time.time()
+    for i in xrange(n):
+        for table, row in rows:
+            dict((column, schema.generic(value)) \
+                    for column, value in row.iteritems())
+    generic_time = (time.time() - start) / n / len(rows)
+
+    start = time.time()
+    for i in xrange(n):
+        for table, row in rows:
+            s.decode(table, dict(row))
+    compiled_time = (time.time() - start) / n / len(rows)
+
+    index = Index()
+    bridges = []
+    for table, row in rows:
+        row = index.add(table, [s.decode(table, dict(row))])[0]
+        if table == "Bridge":
+            bridges.append(row)
+    start = time.time()
+    for i in xrange(n):
+        for bridge in bridges:
+            ovsdb._get_bridge(bridge, index)
+    view_time = (time.time() - start) / n / max(len(bridges), 1)
+
+    print "%d rows, %d bridges" % (len(rows), len(bridges))
+    print "generic decode   %8.2f us/row" % (generic_time * 1e6)
+    print "compiled decode  %8.2f us/row" % (compiled_time * 1e6)
+    print "bridge view      %8.2f us/bridge" % (view_time * 1e6)
+
+def sizeof(obj, seen=None):
+    """
+    Bytes held by obj and everything it refers to, shared objects counted
+    once.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += sizeof(key, seen) + sizeof(value, seen)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            size += sizeof(value, seen)
+    elif isinstance(obj, records.Record):
+        for column in obj.columns + ("_uuid", "_version"):
+            size += sizeof(getattr(obj, column), seen)
+    return size
+
+def memory():
+    s = dbclient.get_schema()
+    session = jsonrpc.Session(dbclient.database)
+    print "%-12s %6s %12s %12s" % ("table", "rows", "row B", "record B")
+    for table, cls in sorted(records.classes.iteritems()):
+        rows = session.transact(["Open_vSwitch", {"op": "select",
+            "table": table, "where": []}])[0]["rows"]
+        if not rows:
+            continue
+        full = sum(sizeof(row) for row in rows) / len(rows)
+        kept = sum(sizeof(records.wrap(table, s.decode(table, row))) \
+                for row in json.loads(json.dumps(rows))) / len(rows)
+        print "%-12s %6d %12d %12d" % (table, len(rows), full, kept)
+    session.close()
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ["memory"]:
+        memory()
+    elif sys.argv[1:2] == ["decode"]:
+        decode(int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+import threading
+import time
+from collections import OrderedDict
+
+class Cache(object):
+    """
+    A bounded LRU cache whose entries expire ttl seconds after they were
+    stored. Every entry carries tags, and invalidate(tag) drops exactly the
+    entries stored with it.
+
+    cache = Cache(size=256, ttl=5)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.put(key, value, [("br0", "Port")])
+    cache.invalidate(("br0", "Port"))
+
+    generation counts invalidations. A value computed while an invalidation
+    happened may already be stale, so put(..., since=generation) read before
+    computing it does not store it.
+    """
+    def __init__(self, size=256, ttl=5):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # key -> (expires, value, tags), least recently used first
+        self.entries = OrderedDict()
+        # tag -> set of keys
+        self.tagged = {}
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """
+        Return the value stored for key, None if there is none or it
+        expired.
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.time():
+                self._untag(key, entry[2])
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, tags=(), since=None):
+        with self.lock:
+            if since is not None and since != self.generation:
+                return
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self._untag(key, old[2])
+            self.entries[key] = (time.time() + self.ttl, value, tuple(tags))
+            for tag in tags:
+                self.tagged.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.size:
+                oldest, entry = self.entries.popitem(last=False)
+                self._untag(oldest, entry[2])
+                self.evictions += 1
+
+    def invalidate(self, *tags):
+        """
+        Drop every entry stored with one of tags.
+        """
+        with self.lock:
+            self.generation += 1
+            for tag in tags:
+                for key in self.tagged.pop(tag, ()):
+                    entry = self.entries.pop(key, None)
+                    if entry is not None:
+                        self._untag(key, entry[2])
+                        self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.tagged.clear()
+
+    def _untag(self, key, tags):
+        for tag in tags:
+            keys = self.tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tagged[tag]
+
+    def stats(self):
+        with self.lock:
+            return dict(size=len(self.entries), capacity=self.size,
+                    ttl=self.ttl, hits=self.hits, misses=self.misses,
+                    evictions=self.evictions, expirations=self.expirations,
+                    invalidations=self.invalidations)
@@ -1,11 +1,22 @@
 #!/usr/bin/env python
-import os
-import subprocess
+import threading
+import time
+import simplejson as json
+import jsonrpc
+import records
+import schema
 
+# target used when none is given, looked up on every call
 database="tcp:127.0.0.1:6634"
 
-prefix = "/ovs/bin/" if os.path.isfile("/ovs/bin/ovs-vsctl") \
-        else "/usr/local/bin/"
+# seconds to wait on ovsdb-server before giving up on a request
+timeout = 10
+
+# sessions kept open per database target
+pool_size = 8
+
+# sessions idle longer than this are probed with echo before reuse
+idle_check = 5
 
 class Error(Exception):
     pass
@@ -25,58 +36,565 @@ class InterfaceError(Error):
         self.ret = ret
         self.msg = msg
 
+class Pool(object):
+    """
+    Process-wide pool of warm ovsdb-server sessions for one target.
+    """
+    def __init__(self, target, maxsize=pool_size):
+        self.target = target
+        self.maxsize = maxsize
+        self.idle = []
+        self.size = 0
+        self.cond = threading.Condition()
+        self.created = 0
+        self.evicted = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def get(self):
+        """
+        Hand out a live session, opening a new one if the pool is not full.
+        """
+        while True:
+            session = self._checkout()
+            if session is None:
+                try:
+                    session = jsonrpc.Session(self.target, timeout)
+                except jsonrpc.Error as e:
+                    self._release()
+                    raise DatabaseError(-1, e.msg)
+                with self.cond:
+                    self.created += 1
+                return session
+            if time.time() - session.last_used < idle_check:
+                return session
+            alive = False
+            try:
+                session.echo()
+                alive = True
+            except jsonrpc.ReplyError:
+                # an answer, even an error, proves the session alive
+                alive = True
+            except (jsonrpc.Error, ValueError):
+                pass
+            finally:
+                if not alive:
+                    self.put(session, broken=True)
+            if alive:
+                return session
+
+    def _checkout(self):
+        with self.cond:
+            start = None
+            while not self.idle and self.size >= self.maxsize:
+                if start is None:
+                    start = time.time()
+                    self.waits += 1
+                elif time.time() - start > timeout:
+                    self.wait_time += time.time() - start
+                    raise DatabaseError(-1, "%s: no free database session" \
+                            % self.target)
+                self.cond.wait(timeout)
+            if start is not None:
+                self.wait_time += time.time() - start
+            self.checkouts += 1
+            if self.idle:
+                return self.idle.pop()
+            self.size += 1
+            return None
+
+    def _release(self):
+        with self.cond:
+            self.size -= 1
+            self.cond.notify()
+
+    def put(self, session, broken=False):
+        """
+        Give a session back. Broken or closed sessions are evicted; a
+        session is broken when its transport failed, not when ovsdb-server
+        merely answered with an error, see jsonrpc.ReplyError.
+        """
+        if broken or not session.sock:
+            session.close()
+            with self.cond:
+                self.evicted += 1
+            self._release()
+        else:
+            with self.cond:
+                self.idle.append(session)
+                self.cond.notify()
+
+    def stats(self):
+        with self.cond:
+            return dict(target=self.target, size=self.size,
+                    idle=len(self.idle), maxsize=self.maxsize,
+                    created=self.created, evicted=self.evicted,
+                    checkouts=self.checkouts, waits=self.waits,
+                    wait_time=self.wait_time)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(target=None):
+    target = target or database
+    with _pools_lock:
+        if target not in _pools:
+            _pools[target] = Pool(target)
+        return _pools[target]
+
+def pool_stats():
+    with _pools_lock:
+        pools = _pools.values()
+    return [pool.stats() for pool in pools]
+
+_schemas = {}
+
+def get_schema(target=None, dbname="Open_vSwitch"):
+    """
+    schema.Schema of dbname, fetched once per target.
+    """
+    target = target or database
+    with _pools_lock:
+        if (target, dbname) in _schemas:
+            return _schemas[(target, dbname)]
+    pool = get_pool(target)
+    session = pool.get()
+    broken = True
+    try:
+        reply = session.request("get_schema", [dbname])
+        broken = False
+    except jsonrpc.ReplyError as e:
+        broken = False
+        raise InterfaceError(-3, e.msg)
+    except jsonrpc.Error as e:
+        raise InterfaceError(-3, e.msg)
+    except ValueError as e:
+        raise InterfaceError(-3, "%s: %s" % (target, e))
+    finally:
+        pool.put(session, broken=broken)
+    with _pools_lock:
+        return _schemas.setdefault((target, dbname), schema.Schema(reply))
+
+# a replica.Replica answering selects from memory, see attach_replica()
+replica = None
+
+def attach_replica(r):
+    global replica
+    replica = r
+
+def sync_replica():
+    """
+    Called after a write so that the next read sees it.
+    """
+    memo = _memo()
+    if memo:
+        memo.clear()
+    if replica is not None:
+        replica.sync()
+
+# result sets of the selects made while serving the current request of
+# each thread, see begin_request()
+_request = threading.local()
+
+def begin_request():
+    """
+    Remember the result sets of every transact this thread sends until
+    end_request(), so that one request sends the same select only once.
+    Writes through transaction.py forget them. A cursor still streams the
+    reply and remembers the rows as they are fetched, once all of them
+    were.
+    """
+    _request.memo = {}
+
+def end_request():
+    _request.memo = None
+
+def _memo():
+    return getattr(_request, "memo", None)
+
+def _recall(params, target):
+    memo = _memo()
+    if memo is None:
+        return None
+    return memo.get((target, json.dumps(params)))
+
+def _remember(params, target, cur):
+    """
+    Read every result set of cur into the request memo and return them.
+    """
+    sets = []
+    for i in xrange(len(params) - 1):
+        sets.append(cur.fetchall())
+        cur.nextset()
+    _memo()[(target, json.dumps(params))] = sets
+    return sets
+
+def _local(params, target):
+    if replica is None or replica.target != target:
+        return None
+    return replica.transact(params)
+
+def _merge(transact, seq_of_parameters):
+    """
+    Format transact with each item and join all operations into one
+    transact. Return None if seq_of_parameters is empty.
+    """
+    params = None
+    for parameters in seq_of_parameters:
+        try:
+            ops = json.loads(transact % parameters)
+        except (ValueError, TypeError) as e:
+            raise ProgrammingError(-2, "Malformed transact %s: %s" \
+                    % (transact, e))
+        if params is None:
+            params = ops
+        else:
+            params.extend(ops[1:])
+    return params
+
+_clients = {}
+
+def get_client(target=None):
+    """
+    Shared jsonrpc.Client for target, reopened if its connection died.
+    """
+    target = target or database
+    with _pools_lock:
+        client = _clients.get(target)
+        if client is None or client.closed:
+            try:
+                client = jsonrpc.Client(target)
+            except jsonrpc.Error as e:
+                raise DatabaseError(-1, e.msg)
+            _clients[target] = client
+        return client
+
+class Query(object):
+    """
+    A transact in flight, see submit(). Many queries can be outstanding at
+    once, ovsdb-server works on them while the caller prepares the next.
+    """
+    def __init__(self, target, params, pending=None, sets=None):
+        self.target = target
+        self.params = params
+        self.pending = pending
+        self.sets = sets
+
+    def cancel(self):
+        if self.pending is not None:
+            self.pending.cancel()
+
+    def cursor(self, wait=timeout):
+        """
+        Wait for the reply and return a Cursor over its result sets.
+        """
+        sets = self.sets
+        if sets is None:
+            try:
+                sets = self.pending.result(wait)
+            except jsonrpc.Error as e:
+                raise InterfaceError(-3, e.msg)
+            for result in sets:
+                if result and "error" in result:
+                    raise InterfaceError(-3, json.dumps(sets))
+            sets = [result.get("rows", []) for result in sets]
+        cur = Cursor(get_pool(self.target))
+        cur._load(sets, self.params)
+        if self.params is not None and _memo() is not None:
+            cur._load(_remember(self.params, self.target, cur))
+        return cur
+
+def submit(transact, target=None):
+    """
+    Start a transact without waiting for it, the non-blocking counterpart
+    of Cursor.execute().
+
+    a = submit(transact_a)
+    b = submit(transact_b)
+    rows_a = a.cursor().fetchall()
+    rows_b = b.cursor().fetchall()
+    """
+    try:
+        params = json.loads(transact)
+    except ValueError as e:
+        raise ProgrammingError(-2, "Malformed transact %s: %s" % (transact, e))
+    return _submit(params, target)
+
+def submit_many(transact, seq_of_parameters, target=None):
+    """
+    Non-blocking counterpart of Cursor.executemany().
+    """
+    target = target or database
+    params = _merge(transact, seq_of_parameters)
+    if params is None:
+        return Query(target, None, sets=[])
+    return _submit(params, target)
+
+def _submit(params, target):
+    target = target or database
+    local = _local(params, target)
+    if local is None:
+        local = _recall(params, target)
+    if local is not None:
+        return Query(target, None, sets=local)
+    try:
+        return Query(target, params,
+                get_client(target).transact(params))
+    except jsonrpc.Error as e:
+        raise InterfaceError(-3, e.msg)
+
+def _parsed(row):
+    return row
+
 class Cursor(object):
-    def __init__(self):
+    """
+    Rows are returned decoded with the schema of the database, see
+    schema.Schema, and as records.Record for the tables records.py covers.
+    """
+    arraysize = 1
+
+    def __init__(self, pool):
         self.rowcount = -1
-        self.command = ["ovsdb-client", "transact", database]
+        self.pool = pool
+        self.session = None
+        self.scanner = None
+        # (memo key, rows fetched per result set) while the rows fetched
+        # are to be remembered, see begin_request()
+        self.memo = None
+        self.decode = json.loads
+        self.schema = None
+        self.tables = []
         self.rows = None
+        self.pending = None
+        self.ahead = None
+        self.nsets = 0
+        self.set = 0
         self.index = -1
-        pass
+
+    def __del__(self):
+        try:
+            self._release()
+        except Error:
+            pass
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
 
     def close(self):
-        pass
+        self._release()
 
     def execute(self, transact):
-        child = subprocess.Popen(self.command + [transact], stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE, env={"PATH":prefix})
-        ret, err = child.communicate()
-        if ret.find('"error"') >= 0:
-            raise InterfaceError(-3, ret)
+        """
+        Run a transact. Every operation in it produces one result set; the
+        cursor starts on the first, use nextset() to move on.
+        """
+        try:
+            params = json.loads(transact)
+        except ValueError as e:
+            raise ProgrammingError(-2, "Malformed transact %s: %s" % (transact, e))
+        self._send(params)
+
+    def executemany(self, transact, seq_of_parameters):
+        """
+        Format transact with each item of seq_of_parameters and send all the
+        operations together as a single transact, one result set per item.
+
+        cur.executemany('["Open_vSwitch", {"op":"select", "table":"Port",
+                "where":[["_uuid", "==", ["uuid", "%s"]]]}]', uuids)
+        """
+        params = _merge(transact, seq_of_parameters)
+        if params is None:
+            self._load([])
+            return
+        self._send(params)
+
+    def _send(self, params):
+        self._release()
+        self.ahead = None
+        self.nsets = len(params) - 1
+        self.set = 0
+        self.rowcount = -1
+        self.index = 0
+        local = _local(params, self.pool.target)
+        if local is None:
+            local = _recall(params, self.pool.target)
+        if local is not None:
+            # the replica and the memo hold decoded rows and records already
+            self._load(local)
+            return
+        self._tables(params)
+        session = self.pool.get()
+        try:
+            self.scanner = session.transact_rows(params)
+            self.session = session
+        except jsonrpc.Error as e:
+            raise InterfaceError(-3, e.msg)
+        finally:
+            # the cursor keeps the session once the transact is sent
+            if self.session is None:
+                self.pool.put(session, broken=True)
+        self.decode = json.loads
+        self.rows = iter(self.scanner)
+        if _memo() is not None:
+            self.memo = ((self.pool.target, json.dumps(params)),
+                    [[] for op in params[1:]])
+        self._advance()
+
+    def _tables(self, params):
+        self.schema = get_schema(self.pool.target, params[0])
+        self.tables = [op.get("table") for op in params[1:]]
+
+    def _load(self, sets, params=None):
+        """
+        Serve result sets already parsed, one list of rows per operation of
+        the transact params.
+        """
+        self._release()
+        if params is not None:
+            self._tables(params)
         else:
-            res = eval(ret, {"false":False, "true":True})
-            self.rows = res[0]["rows"]
-            self.rowcount = len(self.rows)
-            self.index = 0
+            self.schema = None
+        self.scanner = None
+        self.decode = _parsed
+        self.rows = ((index, row) for index, rows in enumerate(sets) \
+                for row in rows)
+        self.ahead = None
+        self.nsets = len(sets)
+        self.set = self.index = 0
+        self.rowcount = -1
+        self._advance()
+
+    def _advance(self):
+        """
+        Read ahead the next undecoded row of the current result set. The
+        session goes back to the pool as soon as the reply is exhausted, so
+        single-row selects never keep it checked out.
+        """
+        self.pending = None
+        if self.ahead is not None:
+            if self.ahead[0] == self.set:
+                self.pending = self.ahead[1]
+                self.ahead = None
+            else:
+                self.rowcount = self.index
+            return
+        try:
+            for index, text in self.rows:
+                if index == self.set:
+                    self.pending = text
+                    return
+                elif index > self.set:
+                    self.ahead = (index, text)
+                    self.rowcount = self.index
+                    return
+        except (jsonrpc.Error, ValueError) as e:
+            self.pool.put(self.session, broken=True)
+            self.session = None
+            self.memo = None
+            raise InterfaceError(-3, str(e))
+        self.rowcount = self.index
+        if self.session is None:
+            return
+        self.pool.put(self.session)
+        self.session = None
+        memo, self.memo = self.memo, None
+        reply = self.scanner.reply
+        if reply.get("error") is not None:
+            raise InterfaceError(-3, json.dumps(reply["error"]))
+        for result in reply["result"]:
+            if result and "error" in result:
+                raise InterfaceError(-3, json.dumps(reply["result"]))
+        if memo is not None and _memo() is not None:
+            # every row was fetched, the rest of the sets is empty
+            key, sets = memo
+            _memo()[key] = sets
+
+    def nextset(self):
+        """
+        Skip the rest of the current result set. Return True if there is
+        another one, None otherwise.
+        """
+        if self.rows is None:
+            raise ProgrammingError(-3, "Previous call to .execute*() did not produce" + 
+                    " any result set or no call was issued yet.")
+        if self.pending is not None:
+            # rows skipped can not be remembered
+            self.memo = None
+        while self.pending is not None:
+            self._advance()
+        if self.set + 1 >= self.nsets:
+            return None
+        self.set += 1
+        self.index = 0
+        self.rowcount = -1
+        self._advance()
+        return True
+
+    def _release(self):
+        """
+        Skip whatever is left of the current reply and free the session.
+        """
+        self.memo = None
+        if self.session is None:
+            return
+        self.pending = self.ahead = None
+        try:
+            for index, text in self.rows:
+                pass
+        except (jsonrpc.Error, ValueError):
+            self.pool.put(self.session, broken=True)
+        else:
+            self.pool.put(self.session)
+        self.session = None
 
     def fetchone(self):
         if self.rows is None:
             raise ProgrammingError(-3, "Previous call to .execute*() did not produce" + 
                     "any result set or no call was issued yet.")
         else:
-            if self.index < self.rowcount:
+            if self.pending is not None:
+                row = self.decode(self.pending)
+                if self.schema is not None:
+                    table = self.tables[self.set]
+                    row = records.wrap(table, self.schema.decode(table, row))
+                if self.memo is not None:
+                    self.memo[1][self.set].append(row)
                 self.index += 1
-                return self.rows[self.index - 1]
+                self._advance()
+                return row
             else:
                 # No more data is available
                 return None
 
+    def fetchmany(self, size=None):
+        """
+        Return at most size rows, never decoding more than that.
+        """
+        if size is None:
+            size = self.arraysize
+        rows = []
+        while len(rows) < size:
+            row = self.fetchone()
+            if row is None:
+                break
+            rows.append(row)
+        return rows
+
     def fetchall(self):
         if self.rows is None:
             raise ProgrammingError(-3, "Previous call to .execute*() did not produce" + 
                     " any result set or no call was issued yet.")
         else:
-            return self.rows
+            return list(self)
 
 class Connection(object):
     def __init__(self, target):
         self.cursors = []
         self.target = target
-        command = ["ovs-vsctl", "--db=%s" % self.target, "-v", "show"]
-        child = subprocess.Popen(command, stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE, env={"PATH":prefix})
-        ret, err = child.communicate()
-        if err.find("database connection failed") >= 0:
-            raise DatabaseError(-1, err)
+        self.pool = get_pool(target)
+        # fails with DatabaseError when the database is unreachable
+        self.pool.put(self.pool.get())
 
     def close(self):
         for cur in self.cursors:
@@ -86,12 +604,12 @@ class Connection(object):
         pass
 
     def cursor(self):
-        cur = Cursor()
+        cur = Cursor(self.pool)
         self.cursors.append(cur)
         return cur
 
-def connect(target=database):
-    return Connection(target)
+def connect(target=None):
+    return Connection(target or database)
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+import threading
+from array import array
+
+# (seconds per slot, slots) of every tier, finest first: 5 minutes at 1s,
+# 6 hours at 1m and a week at 1h
+tiers = [(1, 300), (60, 360), (3600, 168)]
+
+def tiers_for(interval):
+    """
+    tiers with the finest one holding its 5 minutes at one slot per sample
+    taken every interval seconds.
+    """
+    step, size = tiers[0]
+    return [(interval, step * size // interval)] + tiers[1:]
+
+# the counters _get_port reports, Interface.statistics and the STP counters
+# of Port.statistics
+metrics = ["rx_packets", "rx_bytes", "tx_packets", "tx_bytes", "rx_dropped",
+        "rx_frame_err", "rx_over_err", "rx_crc_err", "rx_errors",
+        "tx_dropped", "collisions", "tx_errors", "stp_tx_count",
+        "stp_rx_count", "stp_error_count"]
+
+_nan = float("nan")
+
+class Ring(object):
+    """
+    Fixed-size ring of slots of step seconds, one column per metric, kept in
+    a single array of doubles, metric after metric. A slot holds the last
+    value seen in its period, which is how cumulative counters roll up; NaN
+    marks slots without a sample.
+    """
+    def __init__(self, step, size, width):
+        self.step = step
+        self.size = size
+        self.values = array("d", [_nan]) * (size * width)
+        # number of the newest slot, time // step
+        self.head = None
+
+    def put(self, now, row):
+        slot = int(now // self.step)
+        if self.head is not None:
+            if slot < self.head:
+                return
+            # slots skipped since the last sample have no value
+            for skipped in xrange(self.head + 1,
+                    min(slot, self.head + self.size + 1)):
+                self._set(skipped, [_nan] * len(row))
+        self.head = slot
+        self._set(slot, row)
+
+    def _set(self, slot, row):
+        position = slot % self.size
+        for column, value in enumerate(row):
+            self.values[column * self.size + position] = value
+
+    def held(self):
+        """
+        (first, last) slot still held, None before the first sample.
+        """
+        if self.head is None:
+            return None
+        return self.head - self.size + 1, self.head
+
+    def slots(self, column, first, last):
+        """
+        Values of column for slots first to last, both included and held,
+        None where there is no sample.
+        """
+        base = column * self.size
+        start = base + first % self.size
+        end = base + last % self.size + 1
+        if start < end:
+            chunk = self.values[start:end]
+        else:
+            chunk = self.values[start:base + self.size] \
+                    + self.values[base:end]
+        return [value if value == value else None \
+                for value in chunk.tolist()]
+
+class History(object):
+    """
+    Counter history of every port, one Ring per tier. Each port takes
+    sum(size for step, size in tiers) * len(metrics) * 8 bytes, 99 KB with
+    the defaults, whatever the sample rate. Ports missing from a sample are
+    dropped with their history.
+
+    history.add(now, {brname: {portname: counters}})
+    step, start, values = history.query("br0", "eth0", "rx_bytes", since)
+    """
+    def __init__(self, tiers=tiers, metrics=metrics):
+        self.tiers = tiers
+        self.metrics = metrics
+        self.columns = dict((metric, column) for column, metric \
+                in enumerate(metrics))
+        self.lock = threading.Lock()
+        # (brname, portname) -> [Ring per tier]
+        self.ports = {}
+
+    def add(self, now, data):
+        with self.lock:
+            seen = set()
+            for brname, ports in data.iteritems():
+                for name, counters in ports.iteritems():
+                    key = (brname, name)
+                    seen.add(key)
+                    rings = self.ports.get(key)
+                    if rings is None:
+                        rings = self.ports[key] = [Ring(step, size,
+                            len(self.metrics)) for step, size in self.tiers]
+                    row = [float(counters[metric]) if metric in counters \
+                            else _nan for metric in self.metrics]
+                    for ring in rings:
+                        ring.put(now, row)
+            for key in set(self.ports) - seen:
+                del self.ports[key]
+
+    def query(self, brname, portname, metric, start, end, step=None):
+        """
+        Return (step, time of the first slot, values) for metric of a port
+        from start to end, seconds since the epoch, None where there is no
+        sample. The range is cut to the slots the tier holds, values is
+        empty if none of them is in it. Without step the finest tier still
+        holding start answers. Return None for an unknown port; KeyError
+        for an unknown metric or step.
+        """
+        column = self.columns[metric]
+        with self.lock:
+            rings = self.ports.get((brname, portname))
+            if rings is None:
+                return None
+            if step is not None:
+                ring = [r for r in rings if r.step == step][0:1]
+                if not ring:
+                    raise KeyError(step)
+                ring = ring[0]
+            else:
+                ring = rings[-1]
+                for r in rings:
+                    if r.head is not None \
+                            and start // r.step > r.head - r.size:
+                        ring = r
+                        break
+            held_first, held_last = ring.held()
+            first = max(int(start // ring.step), held_first)
+            last = min(int(end // ring.step), held_last)
+            if last < first:
+                return ring.step, None, []
+            return ring.step, first * ring.step, ring.slots(column, first,
+                    last)
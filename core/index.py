@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+from records import refs, wrap, Record
+
+class Index(object):
+    """
+    Rows of several tables by uuid, so that references between them are
+    followed in memory instead of with one query per row.
+
+    index = Index()
+    index.add("Port", port_rows)
+    index.add("Interface", iface_rows)
+    for port in index.resolve("Port", bridge, "ports"):
+        iface = index.resolve("Interface", port, "interfaces")[0]
+    """
+    def __init__(self):
+        self.tables = {}
+
+    def add(self, table, rows):
+        """
+        rows must carry their _uuid column. Rows of tables with a record
+        class are kept as records that resolve their references here;
+        return what was stored.
+        """
+        rows_by_uuid = self.tables.setdefault(table, {})
+        stored = []
+        for row in rows:
+            row = wrap(table, row, self)
+            if isinstance(row, Record) and row._index is None:
+                row._index = self
+            rows_by_uuid[row["_uuid"]] = row
+            stored.append(row)
+        return stored
+
+    def get(self, table, uuid):
+        return self.tables.get(table, {}).get(uuid)
+
+    def resolve(self, table, row, column):
+        """
+        Rows of table that row refers to in column, in reference order.
+        References to rows missing from the index are skipped.
+        """
+        rows_by_uuid = self.tables.get(table, {})
+        return [rows_by_uuid[uuid] for uuid in refs(row[column]) \
+                if uuid in rows_by_uuid]
+
+    def column(self, table, column):
+        """
+        uuid -> value of column for every row of table.
+        """
+        return dict((uuid, row[column]) for uuid, row \
+                in self.tables.get(table, {}).iteritems())
@@ -0,0 +1,493 @@
+#!/usr/bin/env python
+import re
+import socket
+import threading
+import time
+import traceback
+import simplejson as json
+
+# bytes read from ovsdb-server by all sessions, approximate when several
+# threads read at once
+received = 0
+
+class Error(Exception):
+    def __init__(self, msg):
+        Exception.__init__(self, msg)
+        self.msg = msg
+
+class Timeout(Error):
+    """
+    Nothing arrived within the session timeout. The session stays usable
+    unless the timeout cut a streamed reply short, see ReplyScanner.
+    """
+    pass
+
+class ReplyError(Error):
+    """
+    The peer answered the request with an error. The session stays usable.
+    """
+    pass
+
+def open_socket(target, timeout=None):
+    """
+    expect 'tcp:127.0.0.1:6634' or 'unix:/var/run/openvswitch/db.sock'
+    """
+    protocol, sep, address = target.partition(":")
+    try:
+        if protocol == "tcp":
+            host, sep, port = address.rpartition(":")
+            sock = socket.create_connection((host, int(port)), timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        elif protocol == "unix":
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(timeout)
+            sock.connect(address)
+        else:
+            raise Error("%s: unsupported connection method" % target)
+    except (socket.error, ValueError) as e:
+        raise Error("%s: database connection failed (%s)" % (target, e))
+    return sock
+
+_STRUCT = re.compile(r'[{}\[\]"]')
+_STRING = re.compile(r'["\\]')
+
+class Parser(object):
+    """
+    Split the byte stream of a JSON-RPC connection into complete messages.
+
+    OVSDB does not delimit its messages, so the parser tracks nesting depth
+    outside of strings and cuts a message once its outermost object closes.
+    """
+    def __init__(self):
+        self.chunks = []
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+
+    def feed(self, data):
+        """
+        Return (text, rest) once a message is complete, text is None if more
+        data is needed. rest holds the bytes that belong to the next message.
+        """
+        pos = 0
+        end = len(data)
+        if self.escape:
+            self.escape = False
+            pos = 1
+        while pos < end:
+            if self.in_string:
+                m = _STRING.search(data, pos)
+                if not m:
+                    break
+                pos = m.end()
+                if m.group() == '\\':
+                    if pos == end:
+                        self.escape = True
+                    pos += 1
+                else:
+                    self.in_string = False
+                continue
+            m = _STRUCT.search(data, pos)
+            if not m:
+                break
+            pos = m.end()
+            c = m.group()
+            if c == '"':
+                self.in_string = True
+            elif c in "{[":
+                self.depth += 1
+            else:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.chunks.append(data[:pos])
+                    text = "".join(self.chunks)
+                    self.chunks = []
+                    return text, data[pos:]
+        self.chunks.append(data)
+        return None, ""
+
+_TOKEN = re.compile(r'[{}\[\]",:]')
+_ROW_TOKEN = re.compile(r'[{}\[\]"]')
+_STRING_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"')
+
+class ReplyScanner(object):
+    """
+    Incrementally scan a transact reply read from a session.
+
+    Iterating yields (index, text) for every row of every result set as soon
+    as the row is complete, where index is the position of the operation in
+    the transact and text is the undecoded row. Only the current row is held
+    in memory; everything else in the reply is kept as a small skeleton that
+    is decoded into self.reply once the reply ends.
+
+    ovsdb-server sends the id of a reply after its rows, so rows are only
+    yielded while rid is the oldest request of the session still waiting
+    for its reply; replies to requests given up on earlier are read and
+    dropped. A reply that turns out to carry another id closes the session
+    and raises Error, as does a Timeout in the middle of a reply.
+    """
+    def __init__(self, session, rid):
+        self.session = session
+        self.rid = rid
+        self.reply = None
+
+    def __iter__(self):
+        # on a Timeout here nothing was read, the next request drops the
+        # reply when it arrives
+        buf = self.session.read()
+        try:
+            for row in self._scan(buf):
+                yield row
+        except Timeout:
+            # the rest of the reply would be taken for the next one
+            self.session.close()
+            raise
+
+    def _scan(self, buf):
+        unanswered = self.session.unanswered
+        while True:
+            stale = unanswered[:1] != [self.rid]
+            skel = []
+            # per open container: [is_object, key, index, expect_key]
+            stack = []
+            pos = 0
+            copied = 0
+            start = None
+            while True:
+                m = (_ROW_TOKEN if start is not None else _TOKEN).search(buf, pos)
+                if m is None:
+                    pos = len(buf)
+                    keep = start if start is not None else pos
+                    skel.append(buf[copied:keep])
+                    buf = buf[keep:] + self.session.read()
+                    pos -= keep
+                    copied = 0
+                    if start is not None:
+                        start = 0
+                    continue
+                c = m.group()
+                if c == '"':
+                    s = _STRING_TOKEN.match(buf, m.start())
+                    if s is None:
+                        # string continues in the next chunk
+                        keep = start if start is not None else m.start()
+                        skel.append(buf[copied:keep])
+                        buf = buf[keep:] + self.session.read()
+                        pos = m.start() - keep
+                        copied = 0
+                        if start is not None:
+                            start = 0
+                        continue
+                    pos = s.end()
+                    if start is None and stack and stack[-1][0] and stack[-1][3]:
+                        stack[-1][1] = json.loads(s.group())
+                        stack[-1][3] = False
+                    continue
+                pos = m.end()
+                if start is not None:
+                    if c in "{[":
+                        depth += 1
+                    else:
+                        depth -= 1
+                        if depth == 0:
+                            skel.append(buf[copied:start])
+                            skel.append("0")
+                            if not stale:
+                                yield stack[1][2], buf[start:pos]
+                            copied = pos
+                            start = None
+                elif c == "{":
+                    if len(stack) == 4 and stack[0][1] == "result" \
+                            and stack[2][1] == "rows" and not stack[3][0]:
+                        start = m.start()
+                        depth = 1
+                    else:
+                        stack.append([True, None, 0, True])
+                elif c == "[":
+                    stack.append([False, None, 0, False])
+                elif c == ",":
+                    if stack[-1][0]:
+                        stack[-1][3] = True
+                    else:
+                        stack[-1][2] += 1
+                elif c in "}]":
+                    stack.pop()
+                    if not stack:
+                        break
+            skel.append(buf[copied:pos])
+            buf = buf[pos:]
+            msg = json.loads("".join(skel))
+            if msg.get("method") == "echo":
+                self.session._reply_echo(msg)
+                if not buf:
+                    buf = self.session.read()
+                continue
+            if msg.get("id") in unanswered:
+                unanswered.remove(msg.get("id"))
+            if msg.get("id") != self.rid or stale:
+                if stale and msg.get("id") != self.rid:
+                    if not buf:
+                        buf = self.session.read()
+                    continue
+                self.session.close()
+                raise Error("%s: reply to request %s while waiting for %s" \
+                        % (self.session.target, msg.get("id"), self.rid))
+            self.session.buf = buf
+            self.session.last_used = time.time()
+            self.reply = msg
+            return
+
+class Session(object):
+    """
+    A long-lived JSON-RPC connection to ovsdb-server.
+    """
+    bufsize = 65536
+
+    def __init__(self, target, timeout=None):
+        self.target = target
+        self.sock = open_socket(target, timeout)
+        self.parser = Parser()
+        self.buf = ""
+        self.next_id = 0
+        # ids of the requests sent whose reply was not read yet, oldest
+        # first; ovsdb-server answers the requests of a session in order
+        self.unanswered = []
+        self.last_used = time.time()
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def shutdown(self):
+        """
+        Wake up a thread blocked reading this session, making it fail.
+        """
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except (socket.error, AttributeError):
+            pass
+
+    def send(self, msg):
+        if not self.sock:
+            raise Error("%s: connection closed" % self.target)
+        try:
+            self.sock.sendall(json.dumps(msg))
+        except socket.error as e:
+            self.close()
+            raise Error("%s: send failed (%s)" % (self.target, e))
+
+    def read(self):
+        """
+        Return the next chunk of raw bytes from the connection.
+        """
+        if self.buf:
+            data, self.buf = self.buf, ""
+            return data
+        if not self.sock:
+            raise Error("%s: connection closed" % self.target)
+        try:
+            data = self.sock.recv(self.bufsize)
+        except socket.timeout:
+            raise Timeout("%s: timed out" % self.target)
+        except socket.error as e:
+            self.close()
+            raise Error("%s: receive failed (%s)" % (self.target, e))
+        if not data:
+            self.close()
+            raise Error("%s: connection closed by peer" % self.target)
+        global received
+        received += len(data)
+        return data
+
+    def recv(self):
+        """
+        Return the next complete message as a dict.
+        """
+        while True:
+            text, self.buf = self.parser.feed(self.read())
+            if text is not None:
+                return json.loads(text)
+
+    def _reply_echo(self, msg):
+        # ovsdb-server probes idle clients with echo requests
+        self.send({"id": msg["id"], "result": msg["params"], "error": None})
+
+    def _request(self, method, params):
+        self.next_id += 1
+        rid = self.next_id
+        self.send({"method": method, "params": params, "id": rid})
+        self.unanswered.append(rid)
+        return rid
+
+    def request(self, method, params):
+        """
+        Send a request and wait for the reply carrying the same id; replies
+        to requests given up on earlier are dropped.
+        """
+        rid = self._request(method, params)
+        while True:
+            msg = self.recv()
+            if msg.get("method") == "echo":
+                self._reply_echo(msg)
+            elif "method" not in msg:
+                if msg.get("id") in self.unanswered:
+                    self.unanswered.remove(msg.get("id"))
+                if msg.get("id") != rid:
+                    continue
+                self.last_used = time.time()
+                if msg.get("error") is not None:
+                    raise ReplyError(json.dumps(msg["error"]))
+                return msg.get("result")
+
+    def transact(self, params):
+        """
+        params is the full transact parameter list,
+        ["Open_vSwitch", {"op":"select", ...}, ...]
+        """
+        return self.request("transact", params)
+
+    def transact_rows(self, params):
+        """
+        Like transact, but return a ReplyScanner streaming the result rows.
+        The session must not be used for anything else until the scanner is
+        exhausted.
+        """
+        return ReplyScanner(self, self._request("transact", params))
+
+    def echo(self):
+        return self.request("echo", [])
+
+class Pending(object):
+    """
+    An outstanding request of a Client.
+    """
+    def __init__(self, client, rid):
+        self.client = client
+        self.id = rid
+        self.event = threading.Event()
+        self.reply = None
+        self.error = None
+
+    def done(self):
+        return self.event.is_set()
+
+    def _finish(self, reply=None, error=None):
+        self.reply = reply
+        self.error = error
+        self.event.set()
+
+    def cancel(self):
+        """
+        Stop waiting for the reply; it is dropped when it arrives.
+        """
+        if self.client._forget(self.id):
+            self._finish(error=Error("request %s cancelled" % self.id))
+
+    def result(self, timeout=None):
+        """
+        Block until the reply arrives. On timeout the request is cancelled
+        and Timeout is raised.
+        """
+        if not self.event.wait(timeout):
+            self.cancel()
+            if not self.reply:
+                raise Timeout("%s: request %s timed out" \
+                        % (self.client.target, self.id))
+        if self.error is not None:
+            raise self.error
+        if self.reply.get("error") is not None:
+            raise ReplyError(json.dumps(self.reply["error"]))
+        return self.reply.get("result")
+
+class Client(object):
+    """
+    Multiplex any number of outstanding requests over one session.
+
+    request() returns at once with a Pending; a reader thread matches each
+    reply to its request by id, answers echo probes and passes notifications
+    such as "update" to handlers[method](params).
+    """
+    def __init__(self, target):
+        self.target = target
+        self.session = Session(target)
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.handlers = {}
+        self.next_id = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self._run,
+                name="jsonrpc-%s" % target)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def request(self, method, params):
+        with self.lock:
+            if self.closed:
+                raise Error("%s: connection closed" % self.target)
+            self.next_id += 1
+            pending = Pending(self, self.next_id)
+            self.pending[pending.id] = pending
+            try:
+                self.session.send({"method": method, "params": params,
+                    "id": pending.id})
+            except Error:
+                del self.pending[pending.id]
+                raise
+        return pending
+
+    def transact(self, params):
+        return self.request("transact", params)
+
+    def call(self, method, params, timeout=None):
+        """
+        Synchronous request.
+        """
+        return self.request(method, params).result(timeout)
+
+    def _forget(self, rid):
+        with self.lock:
+            return self.pending.pop(rid, None) is not None
+
+    def close(self):
+        self.closed = True
+        self.session.shutdown()
+
+    def _run(self):
+        error = None
+        try:
+            while True:
+                msg = self.session.recv()
+                method = msg.get("method")
+                if method == "echo":
+                    with self.lock:
+                        self.session._reply_echo(msg)
+                elif method is not None:
+                    handler = self.handlers.get(method)
+                    if handler:
+                        # a failing handler must not stop the reader
+                        try:
+                            handler(msg.get("params"))
+                        except Exception:
+                            traceback.print_exc()
+                else:
+                    with self.lock:
+                        pending = self.pending.pop(msg.get("id"), None)
+                    if pending:
+                        pending._finish(reply=msg)
+        except Error as e:
+            error = e
+        except Exception as e:
+            # e.g. a malformed message, the session can not be trusted anymore
+            error = Error("%s: %s" % (self.target, e))
+        with self.lock:
+            self.closed = True
+            pending, self.pending = self.pending.values(), {}
+        self.session.close()
+        for p in pending:
+            p._finish(error=error)
+
+if __name__ == '__main__':
+    session = Session("tcp:127.0.0.1:6634")
+    print session.transact(["Open_vSwitch",
+        {"op":"select", "table":"Bridge", "where":[], "columns":["name"]}])
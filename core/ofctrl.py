@@ -4,6 +4,7 @@ import os
 import subprocess
 import simplejson as json
 import re
+import openflow
 
 prefix = "/ovs/bin/" if os.path.isfile("/ovs/bin/ovs-vsctl") \
         else "/usr/local/bin/"
@@ -145,52 +146,52 @@ class SimpleCtrl(object):
         self.switch = sw
 
     def get_tables(self):
+        """
+        Flow stats of every table over the switch's OpenFlow connection,
+        see openflow.py.
+        """
         response = {}
         tmp = [{"id":i, "flows":[]} for i in range(0, 256)]
 
-        command = ['ovs-ofctl', 'dump-flows', self.switch]
-        child = subprocess.Popen(command, stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE, env={"PATH":prefix})
-        ret, err = child.communicate()
-        if err:
+        try:
+            flows = openflow.get_connection(self.switch).dump_flows()
+        except openflow.Error as e:
             response["ret"] = -1
-            response["msg"] = err.partition(":")[2]
+            response["msg"] = e.msg
         else:
             response["ret"] = 0
-            for raw_flow in ret.splitlines()[1:]:
-                json_flow = self._string_to_json(raw_flow)
+            for json_flow in flows:
                 table_index = int(json_flow["table"])
                 tmp[table_index]["flows"].append(json_flow)
             response["tables"] = filter(lambda item: True if item["flows"] else False, tmp)
 
-        return json.dumps(response)
+        return response
 
     def get_flows(self, tableid):
         """
-        ovs-ofctl dump-flows switch
+        Flow stats of table tableid, like ovs-ofctl dump-flows switch
+        table=tableid
         """
         response = {}
-        command = ['ovs-ofctl', 'dump-flows', self.switch]
-        command.append('table=%d' % tableid)
-        child = subprocess.Popen(command, stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE, env={"PATH":prefix})
-        ret, err = child.communicate()
-        if err:
+        try:
+            flows = openflow.get_connection(self.switch).dump_flows(tableid)
+        except openflow.Error as e:
             response["ret"] = -1
-            response["msg"] = err.partition(":")[2]
+            response["msg"] = e.msg
         else:
             response["ret"] = 0
             response["table"] = {}
             response["table"]["id"] = tableid
-            response["table"]["flows"] = []
-            for raw_flow in ret.splitlines()[1:]:
-                response["table"]["flows"].append(self._string_to_json(raw_flow))
+            response["table"]["flows"] = flows
 
-        return json.dumps(response)
+        return response
 
-    def add_flow(self, data):
+    def add_flow(self, data, minimal=False):
         """
         ovs-ofctl add-flow switch flow
+
+        Return the flow table, or with minimal only the flow as it was sent;
+        its counters are not read back.
         """
         flow = json.loads(data)
         response = {}
@@ -205,10 +206,12 @@ class SimpleCtrl(object):
             response["ret"] = -1
             response["msg"] = err.partition(":")[2]
             return response
+        elif minimal:
+            return dict(ret=0, flow=flow)
         else:
             return self.get_flows(int(flow["table"]))
 
-    def mod_flow(self, data):
+    def mod_flow(self, data, minimal=False):
         """
         ovs-ofctl --strict mod-flows switch flow
         """
@@ -225,10 +228,12 @@ class SimpleCtrl(object):
             response["ret"] = -1
             response["msg"] = err.partition(":")[2]
             return response
+        elif minimal:
+            return dict(ret=0, flow=flow)
         else:
             return self.get_flows(int(flow["table"]))
 
-    def del_flow(self, data):
+    def del_flow(self, data, minimal=False):
         """
         ovs-ofctl --strict del-flows switch flow
         """
@@ -243,6 +248,8 @@ class SimpleCtrl(object):
             response["ret"] = -1
             response["msg"] = err.partition(":")[2]
             return response
+        elif minimal:
+            return dict(ret=0, flow=flow)
         else:
             return self.get_flows(int(flow["table"]))
 
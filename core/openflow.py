@@ -0,0 +1,655 @@
+#!/usr/bin/env python
+"""
+A minimal OpenFlow client for reading flow tables, speaking OpenFlow 1.0
+or 1.3, whichever the switch offers, over a persistent connection to its
+management endpoint.
+
+Replies are received into one reusable buffer and decoded in place with
+struct.unpack_from. Flows come out as ofctrl.ofctlParser makes them of
+ovs-ofctl dump-flows lines, so either can serve the GUI. Like ovs-ofctl,
+flows are read with the Nicira NXST_FLOW extension, the only flow stats
+carrying idle_age and hard_age; switches refusing it are asked for
+standard flow stats, without ages.
+
+conn = get_connection("tcp:127.0.0.1:6633")
+flows = conn.dump_flows()
+"""
+import os
+import socket
+import struct
+import threading
+
+# where bare bridge names find their management socket, as ovs-ofctl does
+rundir = "/ovs/var/run/openvswitch" \
+        if os.path.isdir("/ovs/var/run/openvswitch") \
+        else "/usr/local/var/run/openvswitch"
+
+# seconds to wait on the switch before giving up on a request
+timeout = 10
+
+OFP10 = 0x01
+OFP13 = 0x04
+
+OFPT_HELLO = 0
+OFPT_ERROR = 1
+OFPT_ECHO_REQUEST = 2
+OFPT_ECHO_REPLY = 3
+# OFPT_STATS_* in OpenFlow 1.0, OFPT_MULTIPART_* in 1.3
+_stats_request = {OFP10: 16, OFP13: 18}
+_stats_reply = {OFP10: 17, OFP13: 19}
+OFPST_FLOW = 1
+# OFPST_VENDOR in OpenFlow 1.0, OFPMP_EXPERIMENTER in 1.3
+OFPST_VENDOR = 0xffff
+OFPSF_REPLY_MORE = 1
+NX_VENDOR_ID = 0x00002320
+NXST_FLOW = 0
+
+_header = struct.Struct("!BBHI")
+# ofp_flow_stats without match and actions, OpenFlow 1.0
+_flow10 = struct.Struct("!HBx40xIIHHH6xQQQ")
+# ofp_flow_stats without match and instructions, OpenFlow 1.3
+_flow13 = struct.Struct("!HBxIIHHHH4xQQQ")
+_match10 = struct.Struct("!IH6s6sHBxHBB2xIIHH")
+# nx_flow_stats without match and actions
+_nx_flow = struct.Struct("!HBxIIHHHHHHQQQ")
+
+class Error(Exception):
+    def __init__(self, msg):
+        Exception.__init__(self, msg)
+        self.msg = msg
+
+class ErrorReply(Error):
+    """
+    The switch answered the request with an OpenFlow error message.
+    """
+    pass
+
+def _hello():
+    # versions bitmap offering 1.0 and 1.3
+    return struct.pack("!BBHIHHI", OFP13, OFPT_HELLO, 16, 0, 1, 8,
+            (1 << OFP10) | (1 << OFP13))
+
+def _flow_stats_request(version, xid, table=0xff):
+    """
+    Ask for every flow of table, 0xff for all tables.
+    """
+    if version == OFP10:
+        # match everything, any out_port
+        return struct.pack("!BBHIHHI36xBxH", version,
+                _stats_request[version], 56, xid, OFPST_FLOW, 0,
+                (1 << 22) - 1, table, 0xffff)
+    # match everything: an empty OXM match; any out_port and out_group
+    return struct.pack("!BBHIHH4xB3xII4xQQHH4x", version,
+            _stats_request[version], 56, xid, OFPST_FLOW, 0, table,
+            0xffffffff, 0xffffffff, 0, 0, 1, 4)
+
+def _nx_flow_stats_request(version, xid, table=0xff):
+    """
+    NXST_FLOW request for every flow of table, 0xff for all tables: any
+    out_port and an empty match.
+    """
+    if version == OFP10:
+        head = struct.pack("!BBHIHHII4x", version, _stats_request[version],
+                32, xid, OFPST_VENDOR, 0, NX_VENDOR_ID, NXST_FLOW)
+    else:
+        head = struct.pack("!BBHIHH4xII", version, _stats_request[version],
+                32, xid, OFPST_VENDOR, 0, NX_VENDOR_ID, NXST_FLOW)
+    return head + struct.pack("!HHB3x", 0xffff, 0, table)
+
+def _negotiate(buf, start, length):
+    """
+    Highest version both sides speak, from the switch's hello.
+    """
+    version = buf[start]
+    offset = start + 8
+    while offset + 4 <= start + length:
+        type, elength = struct.unpack_from("!HH", buf, offset)
+        if elength < 4:
+            break
+        if type == 1 and elength >= 8:
+            bitmap = struct.unpack_from("!I", buf, offset + 4)[0]
+            for v in (OFP13, OFP10):
+                if bitmap & (1 << v):
+                    return v
+            return None
+        offset += (elength + 7) // 8 * 8
+    if version >= OFP13:
+        return OFP13
+    return OFP10 if version == OFP10 else None
+
+class Connection(object):
+    """
+    One OpenFlow session to a switch, used by one request at a time.
+
+    Management connections are dropped by the switch when they idle too
+    long; a request that finds its connection gone reconnects once.
+    """
+    def __init__(self, target, timeout=timeout):
+        self.target = target
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.sock = None
+        self.version = None
+        # whether the switch answers NXST_FLOW, None until asked
+        self.nicira = None
+        self.xid = 0
+        self.buf = bytearray(65536)
+        # received data waiting to be decoded is buf[start:end]
+        self.start = 0
+        self.end = 0
+
+    def _open(self):
+        kind, sep, address = self.target.partition(":")
+        if kind == "tcp":
+            host, sep, port = address.rpartition(":")
+            sock = socket.create_connection((host, int(port)),
+                    self.timeout)
+        else:
+            path = address if kind == "unix" \
+                    else "%s/%s.mgmt" % (rundir, self.target)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(path)
+        sock.settimeout(self.timeout)
+        return sock
+
+    def connect(self):
+        self.close()
+        self.sock = self._open()
+        self.start = self.end = 0
+        self.sock.sendall(_hello())
+        version, type, length, xid, start = self._recv()
+        if type != OFPT_HELLO:
+            raise Error("%s: expected hello" % self.target)
+        self.version = _negotiate(self.buf, start, length)
+        if self.version is None:
+            raise Error("%s: no common OpenFlow version" % self.target)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def _recv(self):
+        """
+        Receive one message into buf and return (version, type, length,
+        xid, offset of the message in buf). It stays there until the next
+        _recv().
+        """
+        self._fill(8)
+        version, type, length, xid = _header.unpack_from(self.buf,
+                self.start)
+        if length < 8:
+            raise Error("%s: bad message length" % self.target)
+        self._fill(length)
+        start = self.start
+        self.start += length
+        return version, type, length, xid, start
+
+    def _fill(self, n):
+        """
+        Read until buf holds n bytes from start on.
+        """
+        if self.end - self.start >= n:
+            return
+        if self.start == self.end:
+            self.start = self.end = 0
+        if len(self.buf) - self.start < n:
+            # move the partial message to the front, growing buf if needed
+            pending = self.buf[self.start:self.end]
+            if len(self.buf) < n:
+                self.buf = bytearray(max(n, 2 * len(self.buf)))
+            self.buf[:len(pending)] = pending
+            self.start, self.end = 0, len(pending)
+        view = memoryview(self.buf)
+        while self.end - self.start < n:
+            received = self.sock.recv_into(view[self.end:])
+            if not received:
+                raise socket.error("%s: connection closed" % self.target)
+            self.end += received
+
+    def _request(self, build, decode):
+        """
+        Send build(version, xid) and pass the body offset and end of every
+        part of the reply to decode(version, buf, offset, end).
+        """
+        self.xid = (self.xid + 1) & 0xffffffff
+        xid = self.xid
+        self.sock.sendall(build(self.version, xid))
+        while True:
+            version, type, length, rxid, start = self._recv()
+            if type == OFPT_ECHO_REQUEST:
+                reply = bytearray(self.buf[start:start + length])
+                reply[1] = OFPT_ECHO_REPLY
+                self.sock.sendall(reply)
+                continue
+            if rxid != xid:
+                continue
+            if type == OFPT_ERROR:
+                etype, code = struct.unpack_from("!HH", self.buf, start + 8)
+                raise ErrorReply("%s: OpenFlow error type %d code %d" \
+                        % (self.target, etype, code))
+            if type != _stats_reply[self.version]:
+                raise Error("%s: unexpected message type %d" \
+                        % (self.target, type))
+            flags = struct.unpack_from("!H", self.buf, start + 10)[0]
+            body = start + (12 if self.version == OFP10 else 16)
+            decode(self.version, self.buf, body, start + length)
+            if not flags & OFPSF_REPLY_MORE:
+                return
+
+    def _dump(self, table, flows):
+        if self.nicira is not False:
+            def decode(version, buf, offset, end):
+                # past the vendor id and subtype, and the padding in 1.0
+                flows.extend(_decode_flows(version, buf,
+                    offset + (12 if version == OFP10 else 8), end, True))
+            try:
+                self._request(lambda version, xid: _nx_flow_stats_request(
+                    version, xid, table), decode)
+                self.nicira = True
+                return
+            except ErrorReply:
+                if self.nicira:
+                    raise
+                self.nicira = False
+                del flows[:]
+        def decode(version, buf, offset, end):
+            flows.extend(_decode_flows(version, buf, offset, end))
+        self._request(lambda version, xid: _flow_stats_request(version, xid,
+            table), decode)
+
+    def dump_flows(self, table=None):
+        """
+        Every flow of the switch, or of table only, in ofctlParser form.
+        """
+        flows = []
+        with self.lock:
+            for attempt in (0, 1):
+                try:
+                    if self.sock is None:
+                        self.connect()
+                    del flows[:]
+                    self._dump(0xff if table is None else table, flows)
+                    break
+                except (socket.error, struct.error) as e:
+                    self.close()
+                    if attempt:
+                        raise Error("%s: %s" % (self.target, e))
+                except Error:
+                    self.close()
+                    raise
+        return flows
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+def get_connection(target):
+    """
+    The process-wide Connection to target: "tcp:host:port", "unix:path" or
+    a bridge name.
+    """
+    with _connections_lock:
+        conn = _connections.get(target)
+        if conn is None:
+            conn = _connections[target] = Connection(target)
+        return conn
+
+# Decoding. Values are formatted the way ovs-ofctl prints them.
+
+_ports10 = {0xfff8: "IN_PORT", 0xfff9: "TABLE", 0xfffa: "NORMAL",
+        0xfffb: "FLOOD", 0xfffc: "ALL", 0xfffd: "CONTROLLER",
+        0xfffe: "LOCAL", 0xffff: "NONE"}
+_ports13 = dict((port | 0xffff0000, name) for port, name \
+        in _ports10.iteritems())
+_ports13[0xffffffff] = "ANY"
+
+def _port(port, version):
+    return (_ports10 if version == OFP10 else _ports13).get(port, str(port))
+
+def _mac(buf, offset):
+    return "%02x:%02x:%02x:%02x:%02x:%02x" % struct.unpack_from("!6B", buf,
+            offset)
+
+def _ip(buf, offset):
+    return "%d.%d.%d.%d" % struct.unpack_from("!4B", buf, offset)
+
+def _ip6(buf, offset):
+    return socket.inet_ntop(socket.AF_INET6, str(buf[offset:offset + 16]))
+
+def _uint(buf, offset, n):
+    if n == 1:
+        return buf[offset]
+    return struct.unpack_from({2: "!H", 4: "!I", 8: "!Q"}[n], buf,
+            offset)[0]
+
+def _decode_flows(version, buf, offset, end, nicira=False):
+    flows = []
+    while offset + 4 <= end:
+        length = struct.unpack_from("!H", buf, offset)[0]
+        if length < 4 or offset + length > end:
+            break
+        if nicira:
+            flows.append(_decode_nx_flow(version, buf, offset,
+                offset + length))
+        elif version == OFP10:
+            flows.append(_decode_flow10(buf, offset, offset + length))
+        else:
+            flows.append(_decode_flow13(buf, offset, offset + length))
+        offset += length
+    return flows
+
+def _flow(table, sec, nsec, priority, idle_timeout, hard_timeout, cookie,
+        packets, bytes, match_fields, actions):
+    flow = {}
+    flow["match_fields"] = match_fields
+    flow["counters"] = dict(packets=str(packets), bytes=str(bytes))
+    flow["priority"] = priority
+    flow["cookie"] = "0x%x" % cookie
+    flow["table"] = str(table)
+    flow["duration"] = "%d.%03ds" % (sec, nsec // 1000000)
+    flow["actions"] = ",".join(actions) or "drop"
+    # ovs-ofctl prints timeouts among the match fields
+    if idle_timeout:
+        match_fields["idle_timeout"] = str(idle_timeout)
+    if hard_timeout:
+        match_fields["hard_timeout"] = str(hard_timeout)
+    return flow
+
+def _decode_flow10(buf, offset, end):
+    (length, table, sec, nsec, priority, idle_timeout, hard_timeout, cookie,
+            packets, bytes) = _flow10.unpack_from(buf, offset)
+    match_fields = _decode_match10(buf, offset + 4)
+    actions = _decode_actions10(buf, offset + _flow10.size, end)
+    return _flow(table, sec, nsec, priority, idle_timeout, hard_timeout,
+            cookie, packets, bytes, match_fields, actions)
+
+def _prefix(address, wildcarded):
+    if wildcarded >= 32:
+        return None
+    return address if not wildcarded else "%s/%d" % (address,
+            32 - wildcarded)
+
+def _decode_match10(buf, offset):
+    (wildcards, in_port, dl_src, dl_dst, dl_vlan, dl_vlan_pcp, dl_type,
+            nw_tos, nw_proto, nw_src, nw_dst, tp_src,
+            tp_dst) = _match10.unpack_from(buf, offset)
+    fields = {}
+    if not wildcards & (1 << 0):
+        fields["in_port"] = _port(in_port, OFP10)
+    if not wildcards & (1 << 1):
+        fields["vlan_vid"] = "0xffff" if dl_vlan == 0xffff else str(dl_vlan)
+    if not wildcards & (1 << 2):
+        fields["eth_src"] = _mac(buf, offset + 6)
+    if not wildcards & (1 << 3):
+        fields["eth_dst"] = _mac(buf, offset + 12)
+    if not wildcards & (1 << 4):
+        fields["eth_type"] = "0x%04x" % dl_type
+    if not wildcards & (1 << 5):
+        fields["ip_proto"] = str(nw_proto)
+    if not wildcards & (1 << 6):
+        fields["tp_src"] = str(tp_src)
+    if not wildcards & (1 << 7):
+        fields["tp_dst"] = str(tp_dst)
+    nw_src = _prefix(_ip(buf, offset + 28), (wildcards >> 8) & 0x3f)
+    if nw_src:
+        fields["ipv4_src"] = nw_src
+    nw_dst = _prefix(_ip(buf, offset + 32), (wildcards >> 14) & 0x3f)
+    if nw_dst:
+        fields["ipv4_dst"] = nw_dst
+    if not wildcards & (1 << 20):
+        fields["vlan_pcp"] = str(dl_vlan_pcp)
+    if not wildcards & (1 << 21):
+        fields["ip_dsctp"] = str(nw_tos)
+    return fields
+
+def _decode_actions10(buf, offset, end):
+    actions = []
+    while offset + 4 <= end:
+        type, length = struct.unpack_from("!HH", buf, offset)
+        if length < 8 or offset + length > end:
+            break
+        if type == 0:
+            port, max_len = struct.unpack_from("!HH", buf, offset + 4)
+            if port == 0xfffd:
+                actions.append("CONTROLLER:%d" % max_len)
+            elif port >= 0xfff8:
+                actions.append(_ports10[port])
+            else:
+                actions.append("output:%d" % port)
+        elif type == 1:
+            actions.append("mod_vlan_vid:%d" % _uint(buf, offset + 4, 2))
+        elif type == 2:
+            actions.append("mod_vlan_pcp:%d" % buf[offset + 4])
+        elif type == 3:
+            actions.append("strip_vlan")
+        elif type in (4, 5):
+            actions.append("mod_dl_%s:%s" % ("src" if type == 4 else "dst",
+                _mac(buf, offset + 4)))
+        elif type in (6, 7):
+            actions.append("mod_nw_%s:%s" % ("src" if type == 6 else "dst",
+                _ip(buf, offset + 4)))
+        elif type == 8:
+            actions.append("mod_nw_tos:%d" % buf[offset + 4])
+        elif type in (9, 10):
+            actions.append("mod_tp_%s:%d" % ("src" if type == 9 else "dst",
+                _uint(buf, offset + 4, 2)))
+        elif type == 11:
+            port, queue = struct.unpack_from("!H6xI", buf, offset + 4)
+            actions.append("enqueue:%s:%d" % (_port(port, OFP10), queue))
+        else:
+            actions.append("unknown_action(%d)" % type)
+        offset += length
+    return actions
+
+def _decode_flow13(buf, offset, end):
+    (length, table, sec, nsec, priority, idle_timeout, hard_timeout, flags,
+            cookie, packets, bytes) = _flow13.unpack_from(buf, offset)
+    match = offset + _flow13.size
+    mlength = struct.unpack_from("!H", buf, match + 2)[0]
+    match_fields = {}
+    for name, value in _decode_oxms(buf, match + 4, match + mlength):
+        match_fields[name] = value
+    actions = _decode_instructions(buf, match + (mlength + 7) // 8 * 8, end)
+    return _flow(table, sec, nsec, priority, idle_timeout, hard_timeout,
+            cookie, packets, bytes, match_fields, actions)
+
+def _decode_nx_flow(version, buf, offset, end):
+    (length, table, sec, nsec, priority, idle_timeout, hard_timeout,
+            match_len, idle_age, hard_age, cookie, packets,
+            bytes) = _nx_flow.unpack_from(buf, offset)
+    match = offset + _nx_flow.size
+    match_fields = {}
+    for name, value in _decode_oxms(buf, match, match + match_len):
+        if name == "vlan_tci":
+            match_fields.update(_tci_fields(value))
+        else:
+            match_fields[name] = value
+    start = match + (match_len + 7) // 8 * 8
+    # actions in the format of the version spoken, never instructions
+    if version == OFP10:
+        actions = _decode_actions10(buf, start, end)
+    else:
+        actions = _decode_actions13(buf, start, end)
+    flow = _flow(table, sec, nsec, priority, idle_timeout, hard_timeout,
+            cookie, packets, bytes, match_fields, actions)
+    # ages are sent plus one, 0 when unknown; ovs-ofctl leaves out a
+    # hard_age equal to the duration
+    if idle_age:
+        flow["idle_age"] = str(idle_age - 1)
+    if hard_age and hard_age - 1 != sec:
+        flow["hard_age"] = str(hard_age - 1)
+    return flow
+
+def _tci_fields(value):
+    """
+    NXM_OF_VLAN_TCI as the vlan_vid and vlan_pcp fields it stands for,
+    untagged as vlan_vid 0xffff like OpenFlow 1.0; as vlan_tci otherwise.
+    """
+    tci, sep, mask = value.partition("/")
+    tci = int(tci, 16)
+    mask = int(mask, 16) if mask else 0xffff
+    if tci & 0x1000 and mask & 0x1fff == 0x1fff:
+        fields = {"vlan_vid": str(tci & 0xfff)}
+        if mask & 0xe000 == 0xe000:
+            fields["vlan_pcp"] = str(tci >> 13)
+        return fields
+    if not tci & 0x1000 and mask & 0x1000:
+        return {"vlan_vid": "0xffff"}
+    return {"vlan_tci": value}
+
+def _int(buf, offset, n):
+    return str(_uint(buf, offset, n))
+
+def _hex(buf, offset, n):
+    return "0x%x" % _uint(buf, offset, n)
+
+def _vid(buf, offset, n):
+    # without OFPVID_PRESENT the field matches untagged packets, which
+    # OpenFlow 1.0 spells 0xffff
+    vid = _uint(buf, offset, n)
+    return str(vid & 0xfff) if vid & 0x1000 else "0xffff"
+
+# OXM field of class OFPXMC_OPENFLOW_BASIC -> (name, format)
+_oxm_fields = {
+        0: ("in_port", lambda buf, offset, n: _port(_uint(buf, offset, n),
+            OFP13)),
+        1: ("in_phy_port", _int), 2: ("metadata", _hex),
+        3: ("eth_dst", lambda buf, offset, n: _mac(buf, offset)),
+        4: ("eth_src", lambda buf, offset, n: _mac(buf, offset)),
+        5: ("eth_type", lambda buf, offset, n: "0x%04x" % _uint(buf,
+            offset, n)),
+        6: ("vlan_vid", _vid), 7: ("vlan_pcp", _int), 8: ("ip_dscp", _int),
+        9: ("ip_ecn", _int), 10: ("ip_proto", _int),
+        11: ("ipv4_src", lambda buf, offset, n: _ip(buf, offset)),
+        12: ("ipv4_dst", lambda buf, offset, n: _ip(buf, offset)),
+        13: ("tcp_src", _int), 14: ("tcp_dst", _int), 15: ("udp_src", _int),
+        16: ("udp_dst", _int), 17: ("sctp_src", _int),
+        18: ("sctp_dst", _int), 19: ("icmpv4_type", _int),
+        20: ("icmpv4_code", _int), 21: ("arp_op", _int),
+        22: ("arp_spa", lambda buf, offset, n: _ip(buf, offset)),
+        23: ("arp_tpa", lambda buf, offset, n: _ip(buf, offset)),
+        24: ("arp_sha", lambda buf, offset, n: _mac(buf, offset)),
+        25: ("arp_tha", lambda buf, offset, n: _mac(buf, offset)),
+        26: ("ipv6_src", lambda buf, offset, n: _ip6(buf, offset)),
+        27: ("ipv6_dst", lambda buf, offset, n: _ip6(buf, offset)),
+        28: ("ipv6_flabel", _hex), 29: ("icmpv6_type", _int),
+        30: ("icmpv6_code", _int),
+        31: ("ipv6_nd_target", lambda buf, offset, n: _ip6(buf, offset)),
+        32: ("ipv6_nd_sll", lambda buf, offset, n: _mac(buf, offset)),
+        33: ("ipv6_nd_tll", lambda buf, offset, n: _mac(buf, offset)),
+        34: ("mpls_label", _int), 35: ("mpls_tc", _int),
+        36: ("mpls_bos", _int), 37: ("pbb_isid", _int),
+        38: ("tunnel_id", _hex), 39: ("ipv6_exthdr", _hex),
+        }
+
+# NXM field (class, field) -> the OXM field it matches, or (name, format)
+_nxm_fields = {(0, 0): ("in_port", lambda buf, offset, n: _port(_uint(buf,
+            offset, n), OFP10)),
+        (0, 4): ("vlan_tci", _hex),
+        (0, 5): ("ip_dscp", lambda buf, offset, n: str(buf[offset] >> 2)),
+        (1, 26): ("ip_frag", _hex), (1, 29): ("nw_ttl", _int)}
+_nxm_fields.update(((1, reg), ("reg%d" % reg, _hex)) for reg in xrange(8))
+_nxm_fields.update((nxm, _oxm_fields[oxm]) for nxm, oxm in {(0, 1): 3,
+        (0, 2): 4, (0, 3): 5, (0, 6): 10, (0, 7): 11, (0, 8): 12,
+        (0, 9): 13, (0, 10): 14, (0, 11): 15, (0, 12): 16, (0, 13): 19,
+        (0, 14): 20, (0, 15): 21, (0, 16): 22, (0, 17): 23, (1, 16): 38,
+        (1, 17): 24, (1, 18): 25, (1, 19): 26, (1, 20): 27, (1, 21): 29,
+        (1, 22): 30, (1, 23): 31, (1, 24): 32, (1, 25): 33, (1, 27): 28,
+        (1, 28): 9}.iteritems())
+
+# fields whose masks cover bits their format drops, printed raw when masked;
+# vlan_vid=0x1000/0x1000 matches any tagged packet
+_masked_formats = {6: _hex}
+
+def _decode_oxms(buf, offset, end):
+    """
+    (name, value) of every OXM or NXM TLV, masked values as value/mask.
+    """
+    fields = []
+    while offset + 4 <= end:
+        header = struct.unpack_from("!I", buf, offset)[0]
+        oxm_class, field = header >> 16, (header >> 9) & 0x7f
+        hasmask, length = (header >> 8) & 1, header & 0xff
+        n = length // 2 if hasmask else length
+        if oxm_class == 0x8000:
+            known = _oxm_fields.get(field)
+        else:
+            known = _nxm_fields.get((oxm_class, field))
+        if known and n in (1, 2, 4, 6, 8, 16):
+            name, format = known
+            if hasmask and oxm_class == 0x8000:
+                format = _masked_formats.get(field, format)
+            value = format(buf, offset + 4, n)
+            if hasmask:
+                value += "/" + format(buf, offset + 4 + n, n)
+        else:
+            name = "oxm_%04x_%d" % (oxm_class, field)
+            value = "0x" + "".join("%02x" % b \
+                    for b in buf[offset + 4:offset + 4 + length])
+        fields.append((name, value))
+        offset += 4 + length
+    return fields
+
+def _decode_actions13(buf, offset, end):
+    actions = []
+    while offset + 4 <= end:
+        type, length = struct.unpack_from("!HH", buf, offset)
+        if length < 8 or offset + length > end:
+            break
+        if type == 0:
+            port, max_len = struct.unpack_from("!IH", buf, offset + 4)
+            if port == 0xfffffffd:
+                actions.append("CONTROLLER:%d" % max_len)
+            elif port >= 0xfffffff8:
+                actions.append(_ports13[port])
+            else:
+                actions.append("output:%d" % port)
+        elif type == 17:
+            actions.append("push_vlan:0x%04x" % _uint(buf, offset + 4, 2))
+        elif type == 18:
+            actions.append("pop_vlan")
+        elif type == 21:
+            actions.append("set_queue:%d" % _uint(buf, offset + 4, 4))
+        elif type == 22:
+            actions.append("group:%d" % _uint(buf, offset + 4, 4))
+        elif type == 23:
+            actions.append("mod_nw_ttl:%d" % buf[offset + 4])
+        elif type == 24:
+            actions.append("dec_ttl")
+        elif type == 25:
+            # one OXM, then padding
+            oxm_length = struct.unpack_from("!I", buf, offset + 4)[0] & 0xff
+            for name, value in _decode_oxms(buf, offset + 4,
+                    offset + 8 + oxm_length):
+                actions.append("set_field:%s->%s" % (value, name))
+        else:
+            actions.append("unknown_action(%d)" % type)
+        offset += length
+    return actions
+
+def _decode_instructions(buf, offset, end):
+    actions = []
+    while offset + 4 <= end:
+        type, length = struct.unpack_from("!HH", buf, offset)
+        if length < 8 or offset + length > end:
+            break
+        if type == 1:
+            actions.append("goto_table:%d" % buf[offset + 4])
+        elif type == 2:
+            metadata, mask = struct.unpack_from("!QQ", buf, offset + 8)
+            actions.append("write_metadata:0x%x/0x%x" % (metadata, mask))
+        elif type == 3:
+            actions.append("write_actions(%s)" % ",".join(
+                _decode_actions13(buf, offset + 8, offset + length)))
+        elif type == 4:
+            actions.extend(_decode_actions13(buf, offset + 8,
+                offset + length))
+        elif type == 5:
+            actions.append("clear_actions")
+        elif type == 6:
+            actions.append("meter:%d" % _uint(buf, offset + 4, 4))
+        else:
+            actions.append("unknown_instruction(%d)" % type)
+        offset += length
+    return actions
@@ -1,54 +1,19 @@
 #!/usr/bin/python
 import simplejson as json
+import base64
+import bisect
+import functools
+import hashlib
+import history
 import subprocess
+import time
+import cache
 import clientWrapper as dbclient
-import ctlWrapper as vsctl
-
-class ovsdb_uuid:
-    """
-    expect ['uuid', 'af749e9c-464a-4af1-a381-7bdd2ac6be45']
-    """
-    def __init__(self, notation):
-        self.uuid = notation[1]
-
-    @property
-    def uuid(self):
-        return self.uuid
-
-class ovsdb_set:
-    """
-    expect ['set', []]
-    """
-    def __init__(self, notation):
-        self.elements = []
-        if _is_type_set(notation):
-            for ele in notation[1]:
-                if _is_type_uuid(ele):
-                    self.elements.append(ovsdb_uuid(ele).uuid)
-                else:
-                    self.elements.append(ele)
-        else:
-            if _is_type_uuid(notation):
-                self.elements.append(ovsdb_uuid(notation).uuid)
-            else:
-                self.elements.append(notation)
-
-    @property
-    def elements(self):
-        return self.elements
-
-class ovsdb_map:
-    """
-    expect ['map', []]
-    """
-    def __init__(self, notation):
-        self.pairs = {}
-        for pair in notation[1]:
-            self.pairs[pair[0]] = pair[1][1] if _is_type_uuid(pair[1]) else pair[1]
-
-    @property
-    def pairs(self):
-        return self.pairs
+import replica
+import sampler
+import transaction
+from index import Index, refs
+from transaction import ref, oset, omap
 
 class target:
     """
@@ -79,45 +44,643 @@ class target:
     def protocol(self):
         return self._protocol
 
-def _is_type_set(column):
-    return isinstance(column, list) and column[0] == 'set'
+_replica = None
+
+def start_replica():
+    """
+    Serve every select from an in-memory replica of the database instead of
+    reading it again for each request.
+    """
+    global _replica
+    if _replica is None:
+        _replica = replica.Replica(dbclient.database)
+        dbclient.attach_replica(_replica)
+        _replica.start()
+    return _replica
+
+def get_replica_status():
+    """
+    generation grows with every change applied to the replica.
+    """
+    response = {}
+    response["ret"] = 0
+    response["replica"] = _replica.status() if _replica else None
+    return response
 
-def _is_type_map(column):
-    return isinstance(column, list) and column[0] == 'map'
+_sampler = None
 
-def _is_type_uuid(column):
-    return isinstance(column, list) and column[0] == 'uuid'
+def start_sampler():
+    """
+    Sample the statistics of all interfaces in the background, see
+    get_port_rates().
+    """
+    global _sampler
+    if _sampler is None:
+        _sampler = sampler.Sampler(dbclient.database,
+                history=history.History(history.tiers_for(sampler.interval)))
+        _sampler.start()
+    return _sampler
+
+def get_port_rates(brname):
+    """
+    Packet, bit, drop and error rates per second of every port of bridge
+    brname, computed from the last two samples. ports is empty until two
+    samples were taken.
+    """
+    response = {}
+    response["ret"] = 0
+    response["time"] = None
+    response["interval"] = None
+    response["ports"] = []
+    rates = _sampler.rates(brname) if _sampler else None
+    if rates is not None:
+        now, interval, ports = rates
+        response["time"] = now
+        response["interval"] = interval
+        for name in sorted(ports):
+            port = dict(ports[name])
+            port["name"] = name
+            response["ports"].append(port)
+    return response
 
-def _record_to_response(record, column):
-    if _is_type_set(record[column]):
-        if record[column][1]:
-            return record[column][1]
-        else:
-            return None
-    else:
-        if _is_type_uuid(record[column]):
-            return record[column][1]
-        else:
-            return record[column]
+def get_port_history(brname, portname, metric, start=None, end=None,
+        step=None):
+    """
+    Sampled values of counter metric of a port from start to end, seconds
+    since the epoch, by default the last 5 minutes. step, the sampling
+    interval, 60 or 3600 seconds, picks the tier, by default the finest one
+    reaching back to start. values has one item per step seconds from start
+    on, null where no sample was taken, and covers only the part of the
+    range the tier still holds.
+    """
+    try:
+        end = float(end) if end is not None else time.time()
+        start = float(start) if start is not None else end - 300
+        step = int(step) if step is not None else None
+        found = _sampler.history.query(brname, portname, metric, start,
+                end, step) if _sampler else None
+    except (KeyError, ValueError, OverflowError) as e:
+        return dict(ret=-2, msg="Malformed history query: %s" % e)
+    response = {}
+    response["ret"] = 0
+    response["metric"] = metric
+    response["step"] = None
+    response["start"] = None
+    response["values"] = []
+    if found is not None:
+        response["step"], response["start"], response["values"] = found
+    return response
 
-def _iface_record_helper(uuid):
-    con = dbclient.connect()
-    cur = con.cursor()
-    transact = '["Open_vSwitch", {"op":"select", "table":"Port", \
-            "where":[["_uuid", "==", ["uuid", "%s"]]]}]'\
-            % uuid
-    cur.execute(transact)
-    port_record = cur.fetchone()
+def get_top_ports(brname, metric, n=10):
+    """
+    The n ports of bridge brname, or of every bridge if brname is None,
+    with the largest value of metric, a rate get_port_rates() reports or a
+    counter the history keeps, from the latest samples.
+    """
+    try:
+        n = int(n)
+        if n < 1:
+            raise ValueError("n must be positive")
+        if metric not in history.metrics \
+                and metric not in [rate for c, rate, f in sampler.rates]:
+            raise ValueError("unknown metric %s" % metric)
+    except ValueError as e:
+        return dict(ret=-2, msg="Malformed top query: %s" % e)
+    now, top = _sampler.top(metric, n, brname) if _sampler else (None, [])
+    response = {}
+    response["ret"] = 0
+    response["metric"] = metric
+    response["time"] = now
+    response["ports"] = [dict(bridge=bridge, name=name, value=value) \
+            for value, bridge, name in top]
+    return response
+
+# longest a changes request may wait for something to change, in seconds
+changes_wait = 30
+
+def get_changes(brname, since=None, wait=0):
+    """
+    What changed in the ports, mirrors and controllers of a bridge and in
+    the queues and QoS rows after replica generation since:
+
+    {"ret": 0, "generation": 42, "resync": false,
+     "ports": {"inserted": {"ports": [], "lags": [], "tunnels": []},
+               "modified": {...}, "deleted": ["eth1"]},
+     "mirrors": {"inserted": [], "modified": [], "deleted": ["M1"]},
+     "controllers": ..., "queues": ..., "qoses": {... "deleted": [uuid]}}
+
+    Inserted and modified rows come as the other endpoints show them, a
+    port also counts as modified when its interface changed. Counter
+    refreshes of statistics columns are not changes, see
+    /bridges/<br>/ports/rates for those. Deleted ports
+    and mirrors are named, the rest given by uuid; deletions are not
+    limited to the bridge. Pass the generation of the answer as since the
+    next time. "resync" true, with no changes, means since is too old or
+    missing, or the replica is not running: read everything again and go
+    on from the generation of this answer.
+
+    With wait, block up to that many seconds, at most changes_wait, until
+    something changes, so that clients can long-poll. Waiting clients only
+    look at the replica, however many there are.
+    """
+    deadline = time.time() + min(wait, changes_wait)
+    while True:
+        response = _get_changes(brname, since)
+        remaining = deadline - time.time()
+        if response["resync"] or remaining <= 0 or _any_change(response):
+            return response
+        _replica.wait(response["generation"], remaining)
+
+def _any_change(response):
+    ports = response["ports"]
+    if ports["deleted"] or any(ports["inserted"].itervalues()) \
+            or any(ports["modified"].itervalues()):
+        return True
+    return any(any(response[key].itervalues())
+            for key in ("mirrors", "controllers", "queues", "qoses"))
+
+def _get_changes(brname, since):
+    response = {}
+    response["ret"] = 0
+    response["resync"] = True
+    response["generation"] = _replica.generation if _replica else None
+    changes = _replica.changes(since) \
+            if _replica is not None and since is not None else None
+    if changes is None:
+        return response
+    generation, changed = changes
+    # straight from the replica, whose records resolve references in it
+    bridges = _replica.transact(["Open_vSwitch", {"op": "select",
+        "table": "Bridge", "where": [["name", "==", brname]],
+        "columns": _bridge_columns}])
+    if not bridges or not bridges[0]:
+        return response
+    bridge = bridges[0][0]
+    response["resync"] = False
+    response["generation"] = generation
+
+    ports = bridge.resolve("ports")
+    pairs = _port_pairs(ports)
+    port_ops = _changed_rows(changed, "Port", _uuids(ports))
+    for port, iface in pairs:
+        if iface["_uuid"] in changed.get("Interface", {}) \
+                and port["_uuid"] not in port_ops:
+            port_ops[port["_uuid"]] = ("modify", None)
+    response["ports"] = {}
+    for key, op in (("inserted", "insert"), ("modified", "modify")):
+        chosen = [pair for pair in pairs if port_ops.get(pair[0]["_uuid"],
+            (None,))[0] == op]
+        response["ports"][key] = _get_all_ports(
+                _uuids(port for port, iface in chosen), chosen)
+    response["ports"]["deleted"] = _deleted(port_ops, "name")
+
+    mirrors = bridge.resolve("mirrors")
+    names = dict((port["_uuid"], port["name"]) for port in ports)
+    response["mirrors"] = _changes(_changed_rows(changed, "Mirror",
+        _uuids(mirrors)), mirrors, "name",
+        lambda chosen: _get_mirrors(_uuids(chosen), chosen, names))
+
+    controllers = bridge.resolve("controller")
+    response["controllers"] = _changes(_changed_rows(changed, "Controller",
+        _uuids(controllers)), controllers, "_uuid",
+        lambda chosen: _get_controllers(_uuids(chosen), chosen))
+
+    for key, table, view in (("queues", "Queue", _get_queue),
+            ("qoses", "QoS", _get_qos)):
+        ops = changed.get(table, {})
+        rows = filter(None, (_replica.get(table, uuid) for uuid in ops))
+        response[key] = _changes(ops, rows, "_uuid",
+                lambda chosen: [view(row) for row in chosen])
+    return response
+
+def _changed_rows(changed, table, uuids):
+    """
+    Changes of table limited to the rows in uuids, plus all deletions.
+    """
+    uuids = set(uuids)
+    return dict((uuid, change) for uuid, change \
+            in changed.get(table, {}).iteritems() \
+            if uuid in uuids or change[0] == "delete")
+
+def _changes(ops, rows, key, views):
+    response = {}
+    for name, op in (("inserted", "insert"), ("modified", "modify")):
+        response[name] = views([row for row in rows \
+                if ops.get(row["_uuid"], (None,))[0] == op])
+    response["deleted"] = _deleted(ops, key)
+    return response
+
+def _deleted(ops, key):
+    return [row[key] for op, row in ops.itervalues() if op == "delete"]
+
+# responses of the read endpoints are kept for cache_ttl seconds, or until a
+# mutation through this module changes a table they were built from
+cache_size = 256
+cache_ttl = 5
+_cache = cache.Cache(cache_size, cache_ttl)
+
+_bridge_tables = ("Bridge", "Port", "Controller", "Mirror", "sFlow",
+        "NetFlow")
+
+def cached(*tables):
+    """
+    Serve a read endpoint from _cache. Its responses are tagged
+    (brname, table) for every table they are built from, brname is None for
+    endpoints that take no bridge name. Cached responses are shared, callers
+    must not modify them.
+
+    A response sent under an ETag is looked up with etag=etag(get, ...): it
+    is then only served from an entry built under the same tag, never from
+    one built before a change another client made within cache_ttl.
+    """
+    def decorate(get):
+        @functools.wraps(get)
+        def cached_get(*args, **kwargs):
+            version = kwargs.pop("etag", None)
+            key = (get.__name__, version) + args \
+                    + tuple(sorted(kwargs.iteritems()))
+            response = _cache.get(key)
+            if response is None:
+                since = _cache.generation
+                response = get(*args, **kwargs)
+                if response["ret"] == 0:
+                    brname = args[0] if args else None
+                    _cache.put(key, response,
+                            [(brname, table) for table in tables], since)
+            return response
+        cached_get.cached = True
+        return cached_get
+    return decorate
+
+def _invalidate(brname, *tables):
+    _cache.invalidate(*[(brname, table) for table in tables])
+
+# tables every read endpoint builds its response from; for endpoints taking
+# a bridge name only the Bridge row of that bridge counts
+_reads = {
+    "fast_get_bridges": ("Bridge",),
+    "get_bridges": ("Bridge", "Controller", "Port", "Interface", "sFlow",
+        "NetFlow", "Mirror"),
+    "get_bridge": ("Bridge", "Controller", "Port", "Interface", "sFlow",
+        "NetFlow", "Mirror"),
+    "get_ports": ("Bridge", "Port", "Interface"),
+    "get_controllers": ("Bridge", "Controller"),
+    "get_mirrors": ("Bridge", "Mirror", "Port"),
+    "get_sflow": ("Bridge", "sFlow"),
+    "get_netflow": ("Bridge", "NetFlow"),
+    "get_all_qos": ("QoS",),
+    "get_queues": ("Queue",),
+    }
+
+def etag(get, *args, **kwargs):
+    """
+    Strong ETag for what get(*args) answers now, hashed from the _version of
+    every row it reads. Rows of other bridges in the same tables count too,
+    so the tag may change while the response does not, never the reverse.
+
+    Take the tag before building the response: a change in between leaves
+    the client with a newer body under an older tag, which only costs it
+    one more full response. Return None if the versions cannot be read.
+    """
+    tables = _reads[get.__name__]
+    brname = args[0] if args else None
+    ops = []
+    for table in tables:
+        where = [["name", "==", brname]] \
+                if table == "Bridge" and brname is not None else []
+        ops.append(_select_op(table, ["_uuid", "_version"], where))
+    versions = [get.__name__] + list(args) + sorted(kwargs.iteritems())
+    try:
+        cur = dbclient.connect().cursor()
+        cur.execute(json.dumps(["Open_vSwitch"] + ops))
+        for table in tables:
+            versions.append(sorted((row["_uuid"], row["_version"]) \
+                    for row in cur.fetchall()))
+            cur.nextset()
+    except dbclient.Error:
+        return None
+    return '"%s"' % hashlib.sha1(json.dumps(versions)).hexdigest()
+
+def get_cache_stats():
+    response = {}
+    response["ret"] = 0
+    response["cache"] = _cache.stats()
+    return response
+
+def _collapse(values):
+    """
+    Sets in responses are None when empty and a scalar when they hold one
+    element, the way the GUI has always received them.
+    """
+    if not values:
+        return None
+    return values[0] if len(values) == 1 else values
+
+# False sends whole-row selects, only for comparing with bench.py
+projection = True
+
+# columns read by each accessor, the only ones its selects ask for
+_bridge_columns = ["name", "datapath_id", "fail_mode", "protocols",
+        "flood_vlans", "controller", "ports", "sflow", "netflow", "mirrors",
+        "other_config", "stp_enable", "status"]
+_fast_bridge_columns = ["name", "datapath_id", "fail_mode", "protocols",
+        "stp_enable", "other_config"]
+_qos_columns = ["_uuid", "type", "other_config", "queues"]
+_queue_columns = ["_uuid", "dscp", "other_config"]
+_port_columns = ["_uuid", "name", "mac", "qos", "vlan_mode", "tag", "trunks",
+        "status", "statistics", "interfaces"]
+_logical_port_columns = ["_uuid", "name", "vlan_mode", "tag", "trunks",
+        "interfaces"]
+_iface_columns = ["_uuid", "type", "ofport", "admin_state", "link_state", "duplex",
+        "mtu", "options", "statistics"]
+_logical_iface_columns = ["_uuid", "type", "ofport", "options"]
+_sflow_columns = ["_uuid", "agent", "header", "polling", "sampling", "targets"]
+_netflow_columns = ["_uuid", "active_timeout", "targets"]
+_mirror_columns = ["_uuid", "name", "select_all", "select_src_port",
+        "select_dst_port", "select_vlan", "statistics", "output_port",
+        "output_vlan"]
+_controller_columns = ["_uuid", "target", "connection_mode", "max_backoff",
+        "inactivity_probe", "enable_async_messages", "controller_rate_limit",
+        "controller_burst_limit", "local_ip", "local_netmask",
+        "local_gateway", "is_connected", "role", "status"]
+
+# tables _bridge_index() fetches along with the bridge for each accessor
+_bridge_joins = [("Controller", _controller_columns),
+        ("Port", _port_columns), ("Interface", _iface_columns),
+        ("sFlow", _sflow_columns), ("NetFlow", _netflow_columns),
+        ("Mirror", _mirror_columns)]
+_port_joins = [("Port", _port_columns), ("Interface", _iface_columns)]
+_mirror_joins = [("Mirror", _mirror_columns), ("Port", ["_uuid", "name"])]
+
+_by_uuid = [["_uuid", "==", ["uuid", "%s"]]]
+
+def _select(table, columns, where=[]):
+    """
+    Build a transact selecting columns of the rows of table matching where.
+    "%s" in where is kept for executemany().
+    """
+    return _select_many(table, columns, [where])
+
+def _select_many(table, columns, wheres):
+    """
+    One select operation per item of wheres, all in a single transact.
+    """
+    return json.dumps(["Open_vSwitch"] + [_select_op(table, columns, where) \
+            for where in wheres])
+
+def _select_op(table, columns, where):
+    op = {"op": "select", "table": table, "where": where}
+    if projection:
+        op["columns"] = columns
+    return op
+
+def _bridge_index(cur, where, columns, joins):
+    """
+    Select the Bridge rows matching where together with the whole of every
+    table in joins, a list of (table, columns), in a single transact.
+    Return the bridge records and the Index they resolve ports, interfaces,
+    mirrors and the like in, so following them costs no further query.
+    """
+    cur.execute(_bridge_transact(where, columns, joins))
+    index = Index()
+    bridges = index.add("Bridge", cur.fetchall())
+    for table, table_columns in joins:
+        cur.nextset()
+        index.add(table, cur.fetchall())
+    return bridges, index
+
+def _bridge_transact(where, columns, joins):
+    return json.dumps(["Open_vSwitch", _select_op("Bridge", columns, where)] \
+            + [_select_op(table, table_columns, []) \
+            for table, table_columns in joins])
+
+def _port_pairs(ports):
+    """
+    (port_record, iface_record) for every Port record.
+    """
+    pairs = []
+    for port in ports:
+        # FIXME assuming one-to-one mapping between iface and port
+        ifaces = port.resolve("interfaces")
+        if ifaces:
+            pairs.append((port, ifaces[0]))
+    return pairs
+
+def _uuids(records):
+    return [record["_uuid"] for record in records]
+
+def _select_each(cur, transact, params):
+    """
+    Run transact once for every item of params in a single round trip.
+    Return the first row of each result set, None where it is empty.
+    """
+    if not params:
+        return []
+    cur.executemany(transact, params)
+    return _first_rows(cur)
+
+def _first_rows(cur):
+    records = []
+    while True:
+        records.append(cur.fetchone())
+        if not cur.nextset():
+            break
+    return records
+
+def _submit_each(table, uuids, columns):
+    """
+    Start selecting the rows of table with the given uuids in one transact
+    and return at once; _records() waits for them. Lookups submitted one
+    after the other are in flight together.
+    """
+    return dbclient.submit_many(_select(table, columns, _by_uuid), uuids)
+
+def _records(query):
+    """
+    Like _select_each, for a query started with _submit_each().
+    """
+    cur = query.cursor()
+    return _first_rows(cur) if cur.nsets else []
+
+def _iface_record_helper(uuid, logical=False):
+    records = _iface_records_helper([uuid], logical)
+    return records[0] if records else (None, None)
+
+def _iface_records_helper(uuids, logical=False):
+    """
+    Return (port_record, iface_record) for every port uuid still in the
+    database, in two round trips no matter how many ports are asked for.
+    logical records carry only the columns _get_logical_port reads.
+    """
+    columns = _logical_port_columns if logical else _port_columns
+    return _iface_records(_records(_submit_each("Port", uuids, columns)),
+            logical)
+
+def _iface_records(port_records, logical=False):
+    # uuids read from the cached port index may name ports deleted since
+    port_records = [record for record in port_records if record]
     # to get Interface record
     # FIXME assuming one-to-one mapping between iface and port
-    iface_uuid = ovsdb_uuid(port_record["interfaces"]).uuid
-    transact = '["Open_vSwitch", {"op":"select", "table":"Interface", \
-            "where":[["_uuid", "==", ["uuid", "%s"]]]}]'\
-            % iface_uuid
-    cur.execute(transact)
-    iface_record = cur.fetchone()
-    return port_record, iface_record
+    iface_uuids = [record["interfaces"][0] for record in port_records]
+    columns = _logical_iface_columns if logical else _iface_columns
+    iface_records = _records(_submit_each("Interface", iface_uuids, columns))
+    return [(port_record, iface_record) for port_record, iface_record \
+            in zip(port_records, iface_records) if iface_record]
+
+def _port_names(uuids):
+    """
+    Map port uuids to port names with a single transact.
+    """
+    con = dbclient.connect()
+    cur = con.cursor()
+    transact = _select("Port", ["name"], _by_uuid)
+    uuids = list(set(uuids))
+    records = _select_each(cur, transact, uuids)
+    return dict((uuid, record["name"]) for uuid, record \
+            in zip(uuids, records) if record)
  
+def _execute(build, *args):
+    """
+    Build a transaction with build(txn, *args) and commit it. Return None on
+    success and the error response otherwise.
+    """
+    result = _commit(build, *args)
+    if result["ret"]:
+        return result
+    return None
+
+def _commit(build, *args):
+    """
+    Like _execute, but return the result of the commit. When build returns
+    the reference to a row it inserts, "uuid" holds the uuid of that row.
+    """
+    txn = transaction.Transaction()
+    try:
+        new = build(txn, *args)
+    except dbclient.Error as e:
+        return dict(ret=e.ret, msg=e.msg)
+    result = txn.commit()
+    if not result["ret"] and isinstance(new, list) \
+            and new[0] == "named-uuid":
+        result["uuid"] = result["uuids"][new[1]]
+    return result
+
+# Mutations called with minimal=True answer with only the row they created
+# or changed, or the name or uuid of the row they deleted, and with the
+# replica generation that includes the change, instead of reading the whole
+# collection again.
+
+def _with_generation(response):
+    response = dict(response)
+    response["generation"] = _replica.generation if _replica else None
+    return response
+
+def _removed(key, deleted):
+    return _with_generation({"ret": 0, key: None, "deleted": deleted})
+
+def _one(key, table, columns, where, view):
+    """
+    {"ret": 0, key: view(row)} for the row of table matching where, key is
+    None if there is none.
+    """
+    response = {}
+    try:
+        cur = dbclient.connect().cursor()
+        cur.execute(_select(table, columns, where))
+        record = cur.fetchone()
+        # views may query the database themselves
+        row = view(record) if record else None
+    except dbclient.Error as e:
+        response["ret"] = e.ret
+        response["msg"] = e.msg
+        return response
+    response["ret"] = 0
+    response[key] = row
+    return _with_generation(response)
+
+def _one_bridge(brname):
+    return _one("bridge", "Bridge", _fast_bridge_columns,
+            [["name", "==", brname]], _fast_get_bridge)
+
+def _one_port(name):
+    return _one("port", "Port", ["_uuid"], [["name", "==", name]],
+            lambda record: _get_port(record["_uuid"]))
+
+def _one_mirror(name):
+    return _one("mirror", "Mirror", _mirror_columns, [["name", "==", name]],
+            lambda record: _get_mirror(record["_uuid"], record))
+
+def _one_controller(uuid):
+    return _one("controller", "Controller", _controller_columns,
+            [["_uuid", "==", ["uuid", uuid]]],
+            lambda record: _get_controller(uuid, record))
+
+def _one_queue(uuid):
+    return _one("queue", "Queue", _queue_columns,
+            [["_uuid", "==", ["uuid", uuid]]], _get_queue)
+
+def _one_qos(uuid):
+    return _one("qos", "QoS", _qos_columns,
+            [["_uuid", "==", ["uuid", uuid]]], _get_qos)
+
+def _lookup(table, names):
+    """
+    Map row names to uuids in a single round trip.
+    """
+    con = dbclient.connect()
+    cur = con.cursor()
+    names = list(set(names))
+    records = []
+    if names:
+        cur.execute(_select_many(table, ["_uuid"],
+            [[["name", "==", name]] for name in names]))
+        records = _first_rows(cur)
+    uuids = {}
+    for name, record in zip(names, records):
+        if not record:
+            raise transaction.TransactionError(-4,
+                    "%s: no row named %s" % (table, name))
+        uuids[name] = record["_uuid"]
+    return uuids
+
+def _bridge_ref(brname, column):
+    """
+    Return the uuid Bridge brname refers to in column, like the sflow or
+    netflow record.
+    """
+    con = dbclient.connect()
+    cur = con.cursor()
+    transact = _select("Bridge", [column], [["name", "==", brname]])
+    cur.execute(transact)
+    row = cur.fetchone()
+    uuids = refs(row[column]) if row else []
+    if not uuids:
+        raise transaction.TransactionError(-4,
+                "Bridge %s has no %s record" % (brname, column))
+    return uuids[0]
+
+def _names(value):
+    """
+    Lists of names come in as ["a", "b"] or "a,b".
+    """
+    if not value:
+        return []
+    if isinstance(value, basestring):
+        return [x for x in value.split(",") if x]
+    return list(value)
+
+def _int_set(value):
+    """
+    VLAN lists come in as [1, 2], 1 or "1,2".
+    """
+    if value is None or value == "":
+        return []
+    if isinstance(value, (int, long)):
+        return [value]
+    if isinstance(value, basestring):
+        value = value.strip("[]").split(",")
+    return [int(x) for x in value if str(x).strip()]
+
 def get_bridges():
     response = {}
     try:
@@ -125,24 +688,23 @@ def get_bridges():
     except dbclient.DatabaseError as e:
         response["ret"] = e.ret
         response["msg"] = e.msg
-        return json.dumps(response)
+        return response
     else:
         try:
             response["ret"] = 0
             response["bridges"] = []
             cur = con.cursor()
-            transact = '["Open_vSwitch", {"op":"select", "table":"Bridge", \
-                    "where":[]}]'
-            cur.execute(transact)
-            for record in cur.fetchall():
-                response["bridges"].append(json.loads(_get_bridge(record)))
+            bridges, index = _bridge_index(cur, [], _bridge_columns,
+                    _bridge_joins)
+            for record in bridges:
+                response["bridges"].append(_get_bridge(record, index))
         except dbclient.InterfaceError as e:
             response["ret"] = e.ret
             response["msg"] = e.msg
         except dbclient.ProgrammingError as e:
             response["ret"] = e.ret
             response["msg"] = e.msg
-        return json.dumps(response)
+        return response
 
 def fast_get_bridges():
     response = {}
@@ -151,24 +713,22 @@ def fast_get_bridges():
     except dbclient.DatabaseError as e:
         response["ret"] = e.ret
         response["msg"] = e.msg
-        return json.dumps(response)
+        return response
     else:
         try:
             response["ret"] = 0
             response["bridges"] = []
             cur = con.cursor()
-            transact = '["Open_vSwitch", {"op":"select", "table":"Bridge", \
-                    "where":[]}]'
-            cur.execute(transact)
+            cur.execute(_select("Bridge", _fast_bridge_columns))
             for record in cur.fetchall():
-                response["bridges"].append(json.loads(_fast_get_bridge(record)))
+                response["bridges"].append(_fast_get_bridge(record))
         except dbclient.InterfaceError as e:
             response["ret"] = e.ret
             response["msg"] = e.msg
         except dbclient.ProgrammingError as e:
             response["ret"] = e.ret
             response["msg"] = e.msg
-        return json.dumps(response)
+        return response
 
 def _fast_get_bridge(record):
     """
@@ -176,41 +736,35 @@ def _fast_get_bridge(record):
     """
     response = {}
     response["name"] = record["name"]
-    response["datapath_id"] = _record_to_response(record, "datapath_id")
-    response["fail_mode"] = _record_to_response(record, "fail_mode")
-    response["protocols"] = _record_to_response(record, "protocols")
+    response["datapath_id"] = record["datapath_id"]
+    response["fail_mode"] = record["fail_mode"]
+    response["protocols"] = _collapse(record["protocols"])
     response["stp_config"] = {}
-    other = ovsdb_map(record["other_config"]).pairs
-    response["stp_config"]["stp_enable"] = _record_to_response(record, \
-            "stp_enable")
+    other = record["other_config"]
+    response["stp_config"]["stp_enable"] = record["stp_enable"]
 
     if "datapath_id" in other:
         response["datapath_id"] = other["datapath_id"]
 
-    return json.dumps(response)
+    return response
 
-def update_bridge(brname, data):
+def update_bridge(brname, data, minimal=False):
     new_br = json.loads(data)
-    commands = ['--', 'set', 'Bridge', new_br['name']]
-    nullify = []
-
-    commands.extend(['other_config:datapath_id={id}'.format(id=new_br['datapath_id'])])
-
-    if new_br['fail_mode']:
-        commands.extend(['fail_mode={0}'.format(new_br['fail_mode'])])
-    else:
-        nullify.extend(['--', 'clear', 'Bridge', new_br['name'], 'fail_mode'])
-
-    if new_br['protocols']:
-        commands.extend(['protocols={0}'.format(new_br['protocols'])])
-    else:
-        nullify.extend(['--', 'clear', 'Bridge', new_br['name'], 'protocols'])
-
-    commands.extend(nullify)
-
-    ret, err = vsctl.execute(commands)
-    return get_bridge(brname)
-
+    error = _execute(_update_bridge_ops, new_br)
+    _invalidate(brname, "Bridge")
+    return error or (_one_bridge(brname) if minimal else get_bridge(brname))
+
+def _update_bridge_ops(txn, new_br):
+    where = [["name", "==", new_br['name']]]
+    txn.expect("Bridge", where)
+    row = {}
+    row["fail_mode"] = new_br['fail_mode'] or oset([])
+    row["protocols"] = oset(_names(new_br['protocols']))
+    txn.update("Bridge", where, row)
+    txn.set_keys("Bridge", where, "other_config",
+            {"datapath_id": new_br['datapath_id']})
+
+@cached("QoS")
 def get_all_qos():
     response = {}
     try:
@@ -218,98 +772,86 @@ def get_all_qos():
     except dbclient.DatabaseError as e:
         response["ret"] = e.ret
         response["msg"] = e.msg
-        return json.dumps(response)
+        return response
     else:
         try:
             response["ret"] = 0
             response["qoses"] = []
             cur = con.cursor()
-            transact = '["Open_vSwitch", {"op":"select", "table":"QoS", \
-                    "where":[]}]'
-            cur.execute(transact)
+            cur.execute(_select("QoS", _qos_columns))
             for record in cur.fetchall():
-                response["qoses"].append(json.loads(_get_qos(record)))
+                response["qoses"].append(_get_qos(record))
         except dbclient.InterfaceError as e:
             response["ret"] = e.ret
             response["msg"] = e.msg
         except dbclient.ProgrammingError as e:
             response["ret"] = e.ret
             response["msg"] = e.msg
-        return json.dumps(response)
+        return response
 
 def _get_qos(record):
     response = {}
 
-    response["type"] = _record_to_response(record, "type")
-    response["uuid"] = _record_to_response(record, "_uuid")
+    response["type"] = record["type"]
+    response["uuid"] = record["_uuid"]
     response["other_config"] = {}
 
-    config = ovsdb_map(record["other_config"]).pairs
+    config = record["other_config"]
     response["other_config"]["max-rate"] = int(config["max-rate"]) \
             if "max-rate" in config else None
 
-    queues = ovsdb_map(record["queues"]).pairs
+    queues = record["queues"]
     response["queues"] = queues.values()
 
-    return json.dumps(response)
-
-def add_qos(data):
-    new_qos = json.loads(data)
-    commands = ['create', 'QoS']
-
-    commands.extend(['type=%s' % new_qos['type']])
-
-    queues = ''
-    cnt = 0
-    for uuid in new_qos['queues']:
-        queues += '%d=%s,' % (cnt, uuid)
-        cnt += 1
-    if queues:
-        commands.extend(['queues=%s' % queues])
+    return response
 
+def add_qos(data, minimal=False):
+    qos = json.loads(data)
+    result = _commit(_add_qos_ops, qos)
+    _invalidate(None, "QoS")
+    if result["ret"]:
+        return result
+    return _one_qos(result["uuid"]) if minimal else get_all_qos()
+
+def _add_qos_ops(txn, new_qos):
+    row = {}
+    row["type"] = new_qos['type']
+    row["queues"] = omap(enumerate(ref(uuid) for uuid in new_qos['queues']))
     if new_qos['other_config']['max-rate']:
-        commands.extend(['other_config:max-rate=%d' % new_qos['other_config']['max-rate']])
+        row["other_config"] = omap({"max-rate":
+            str(new_qos['other_config']['max-rate'])})
+    return txn.insert("QoS", row)
 
-    ret, err = vsctl.execute(commands)
-    return get_all_qos()
-
-def update_qos(data):
+def update_qos(data, minimal=False):
     qos = json.loads(data)
-    commands = []
-    nullify = []
-
+    error = _execute(_update_qos_ops, qos)
+    _invalidate(None, "QoS")
+    return error or (_one_qos(qos["uuid"]) if minimal else get_all_qos())
+
+def _update_qos_ops(txn, qos):
+    where = [["_uuid", "==", ref(qos['uuid'])]]
+    txn.expect("QoS", where)
+    row = {}
     if qos['type']:
-        commands.extend(['type=%s' % qos['type']])
-    else:
-        nullify.extend(['--', 'clear', 'QoS', qos['uuid'], 'type'])
-
-    if qos['queues']:
-        queues = ''
-        index = 0
-        for uuid in qos['queues']:
-            queues += '%s=%s,' % (index, uuid)
-            index += 1
-        commands.extend(['queues=%s' % queues])
-    else:
-        nullify.extend(['--', 'clear', 'QoS', qos['uuid'], 'queues'])
-
-    if qos['other_config']['max-rate']:
-        commands.extend(['other_config:max-rate=%d' % qos['other_config']['max-rate']])
-    else:
-        nullify.extend(['--', 'remove', 'QoS', qos['uuid'], 'other_config', 'max-rate'])
-
-    if commands:
-        commands = ['--', 'set', 'QoS', qos['uuid']] + commands
-    commands.extend(nullify)
-    ret, err = vsctl.execute(commands)
-    return get_all_qos()
+        row["type"] = qos['type']
+    row["queues"] = omap(enumerate(ref(uuid) for uuid in qos['queues'] or []))
+    txn.update("QoS", where, row)
+    txn.set_keys("QoS", where, "other_config",
+            {"max-rate": qos['other_config']['max-rate']})
 
-def del_qos(data):
+def del_qos(data, minimal=False):
     qos = json.loads(data)
-    commands = ['destroy', 'QoS', qos['uuid']]
-    ret, err = vsctl.execute(commands)
-    return get_all_qos()
+    error = _execute(_del_qos_ops, qos)
+    _invalidate(None, "QoS")
+    return error or (_removed("qos", qos["uuid"]) \
+            if minimal else get_all_qos())
 
+def _del_qos_ops(txn, qos):
+    where = [["_uuid", "==", ref(qos['uuid'])]]
+    txn.expect("QoS", where)
+    txn.delete("QoS", where)
+
+@cached("Queue")
 def get_queues():
     response = {}
     try:
@@ -317,33 +859,31 @@ def get_queues():
     except dbclient.DatabaseError as e:
         response["ret"] = e.ret
         response["msg"] = e.msg
-        return json.dumps(response)
+        return response
     else:
         try:
             response["ret"] = 0
             response["queues"] = []
             cur = con.cursor()
-            transact = '["Open_vSwitch", {"op":"select", "table":"Queue", \
-                    "where":[]}]'
-            cur.execute(transact)
+            cur.execute(_select("Queue", _queue_columns))
             for record in cur.fetchall():
-                response["queues"].append(json.loads(_get_queue(record)))
+                response["queues"].append(_get_queue(record))
         except dbclient.InterfaceError as e:
             response["ret"] = e.ret
             response["msg"] = e.msg
         except dbclient.ProgrammingError as e:
             response["ret"] = e.ret
             response["msg"] = e.msg
-        return json.dumps(response)
+        return response
 
 def _get_queue(record):
     response = {}
 
-    response["dscp"] = _record_to_response(record, "dscp")
-    response["uuid"] = _record_to_response(record, "_uuid")
+    response["dscp"] = record["dscp"]
+    response["uuid"] = record["_uuid"]
     response["other_config"] = {}
 
-    config = ovsdb_map(record["other_config"]).pairs
+    config = record["other_config"]
     response["other_config"]["min-rate"] = int(config["min-rate"]) \
             if "min-rate" in config else None
     response["other_config"]["max-rate"] = int(config["max-rate"]) \
@@ -353,71 +893,53 @@ def _get_queue(record):
     response["other_config"]["priority"] = int(config["priority"]) \
             if "priority" in config else None
 
-    return json.dumps(response)
+    return response
 
-def update_queue(data):
+def update_queue(data, minimal=False):
     nq = json.loads(data)
-    commands = []
-    nullify = []
-
-    if nq['dscp']:
-        commands.extend(['dscp=%d' % nq['dscp']])
-    else:
-        nullify.extend(['--', 'clear', 'Queue', nq['uuid'], 'dscp'])
-
-    if nq['other_config']['min-rate']:
-        commands.extend(['other_config:min-rate=%d' % nq['other_config']['min-rate']])
-    else:
-        nullify.extend(['--', 'remove', 'Queue', nq['uuid'], 'other_config', 'min-rate'])
-
-    if nq['other_config']['max-rate']:
-        commands.extend(['other_config:max-rate=%d' % nq['other_config']['max-rate']])
-    else:
-        nullify.extend(['--', 'remove', 'Queue', nq['uuid'], 'other_config', 'max-rate'])
-
-    if nq['other_config']['burst']:
-        commands.extend(['other_config:burst=%d' % nq['other_config']['burst']])
-    else:
-        nullify.extend(['--', 'remove', 'Queue', nq['uuid'], 'other_config', 'burst'])
-
-    if nq['other_config']['priority']:
-        commands.extend(['other_config:priority=%d' % nq['other_config']['priority']])
-    else:
-        nullify.extend(['--', 'remove', 'Queue', nq['uuid'], 'other_config', 'priority'])
-
-    if commands:
-        commands = ['set', 'Queue', nq['uuid']] + commands
-    commands.extend(nullify)
-    ret, err = vsctl.execute(commands)
-    return get_queues()
-
-def add_queue(data):
+    error = _execute(_update_queue_ops, nq)
+    _invalidate(None, "Queue")
+    return error or (_one_queue(nq["uuid"]) if minimal else get_queues())
+
+def _update_queue_ops(txn, nq):
+    where = [["_uuid", "==", ref(nq['uuid'])]]
+    txn.expect("Queue", where)
+    txn.update("Queue", where, {"dscp": nq['dscp'] or oset([])})
+    txn.set_keys("Queue", where, "other_config", _queue_config(nq))
+
+def _queue_config(nq):
+    config = {}
+    for key in ("min-rate", "max-rate", "burst", "priority"):
+        config[key] = nq['other_config'][key]
+    return config
+
+def add_queue(data, minimal=False):
     nq = json.loads(data)
-    commands = ['create', 'Queue']
-
+    result = _commit(_add_queue_ops, nq)
+    _invalidate(None, "Queue")
+    if result["ret"]:
+        return result
+    return _one_queue(result["uuid"]) if minimal else get_queues()
+
+def _add_queue_ops(txn, nq):
+    row = {}
     if nq['dscp']:
-        commands.extend(['dscp=%d' % nq['dscp']])
-
-    if nq['other_config']['min-rate']:
-        commands.extend(['other_config:min-rate=%d' % nq['other_config']['min-rate']])
-
-    if nq['other_config']['max-rate']:
-        commands.extend(['other_config:max-rate=%d' % nq['other_config']['max-rate']])
-
-    if nq['other_config']['burst']:
-        commands.extend(['other_config:burst=%d' % nq['other_config']['burst']])
-
-    if nq['other_config']['priority']:
-        commands.extend(['other_config:priority=%d' % nq['other_config']['priority']])
+        row["dscp"] = nq['dscp']
+    row["other_config"] = omap((key, str(value)) for key, value \
+            in _queue_config(nq).iteritems() if value)
+    return txn.insert("Queue", row)
 
-    ret, err = vsctl.execute(commands)
-    return get_queues()
+def del_queue(data, minimal=False):
+    nq = json.loads(data)
+    error = _execute(_del_queue_ops, nq)
+    _invalidate(None, "Queue")
+    return error or (_removed("queue", nq["uuid"]) \
+            if minimal else get_queues())
 
-def del_queue(data):
-    q = json.loads(data)
-    commands = ['destroy', 'Queue', q['uuid']]
-    ret, err = vsctl.execute(commands)
-    return get_queues()
+def _del_queue_ops(txn, q):
+    where = [["_uuid", "==", ref(q['uuid'])]]
+    txn.expect("Queue", where)
+    txn.delete("Queue", where)
 
 def get_bonds(brname):
     response = {}
@@ -426,29 +948,26 @@ def get_bonds(brname):
     except dbclient.DatabaseError as e:
         response["ret"] = e.ret
         response["msg"] = e.msg
-        return json.dumps(response)
+        return response
     else:
         try:
             response["ret"] = 0
             response["bonds"] = []
-            transact = '["Open_vSwitch", {"op":"select", "table":"Bridge", \
-                    "where":[["name", "==", "%s"]], "columns":["ports"]}]'\
-                    % brname
+            transact = _select("Bridge", ["ports"], [["name", "==", brname]])
             cur = con.cursor()
             cur.execute(transact)
             row = cur.fetchone()
             if row:
                 records = row["ports"]
-                response["ports"] += json.loads(
-                        _get_logical_ports(ovsdb_set(records).elements, \
-                                "pica8_lag"))
+                response["ports"] += _get_logical_ports(records,
+                        "pica8_lag")
         except dbclient.InterfaceError as e:
             response["ret"] = e.ret
             response["msg"] = e.msg
         except dbclient.ProgrammingError as e:
             response["ret"] = e.ret
             response["msg"] = e.msg
-        return json.dumps(response)
+        return response
 
 def get_tunnels(brname):
     response = {}
@@ -457,30 +976,28 @@ def get_tunnels(brname):
     except dbclient.DatabaseError as e:
         response["ret"] = e.ret
         response["msg"] = e.msg
-        return json.dumps(response)
+        return response
     else:
         try:
             response["ret"] = 0
             response["bonds"] = []
-            transact = '["Open_vSwitch", {"op":"select", "table":"Bridge", \
-                    "where":[["name", "==", "%s"]], "columns":["ports"]}]'\
-                    % brname
+            transact = _select("Bridge", ["ports"], [["name", "==", brname]])
             cur = con.cursor()
             cur.execute(transact)
             row = cur.fetchone()
             if row:
                 records = row["ports"]
-                response["ports"] += json.loads(
-                        _get_logical_ports(ovsdb_set(records).elements, \
-                                "pica8_gre"))
+                response["ports"] += _get_logical_ports(records,
+                        "pica8_gre")
         except dbclient.InterfaceError as e:
             response["ret"] = e.ret
             response["msg"] = e.msg
         except dbclient.ProgrammingError as e:
             response["ret"] = e.ret
             response["msg"] = e.msg
-        return json.dumps(response)
+        return response
 
+@cached(*_bridge_tables)
 def get_bridge(brname):
     response = {}
     try:
@@ -488,25 +1005,23 @@ def get_bridge(brname):
     except dbclient.DatabaseError as e:
         response["ret"] = e.ret
         response["msg"] = e.msg
-        return json.dumps(response)
+        return response
     else:
         try:
             response["ret"] = 0
             response["bridge"] = None
             cur = con.cursor()
-            transact = '["Open_vSwitch", {"op":"select", "table":"Bridge", \
-                    "where":[["name", "==", "%s"]]}]' % brname
-            cur.execute(transact)
-            record = cur.fetchone()
-            if record:
-                response["bridge"] = json.loads(_get_bridge(record))
+            bridges, index = _bridge_index(cur, [["name", "==", brname]],
+                    _bridge_columns, _bridge_joins)
+            if bridges:
+                response["bridge"] = _get_bridge(bridges[0], index)
         except dbclient.InterfaceError as e:
             response["ret"] = e.ret
             response["msg"] = e.msg
         except dbclient.ProgrammingError as e:
             response["ret"] = e.ret
             response["msg"] = e.msg
-        return json.dumps(response)
+        return response
 
 def get_bond(brname, bondname):
     response = {}
@@ -515,29 +1030,24 @@ def get_bond(brname, bondname):
     except dbclient.DatabaseError as e:
         response["ret"] = e.ret
         response["msg"] = e.msg
-        return json.dumps(response)
+        return response
     else:
         try:
             response["ret"] = 0
             response["bond"] = None
-            transact = '["Open_vSwitch", {"op":"select", "table":"Bridge", \
-                    "where":[["name", "==", "%s"]], "columns":["ports"]}]' \
-                    % brname
+            transact = _select("Bridge", ["ports"], [["name", "==", brname]])
             cur = con.cursor()
             cur.execute(transact)
             row = cur.fetchone()
             if row:
                 records = row["ports"]
-                for uuid in ovsdb_set(records).elements:
-                    transact = '["Open_vSwitch", {"op":"select", \
-                            "table":"Port", \
-                            "where":[["_uuid", "==", ["uuid", "%s"]],\
-                            ["name", "==", "%s"]]}]' % (uuid, bondname)
-                    cur.execute(transact)
-                    record = cur.fetchone()
+                uuids = records
+                transact = _select("Port", ["_uuid"],
+                        _by_uuid + [["name", "==", "%s"]])
+                for uuid, record in zip(uuids, _select_each(cur, transact,
+                        [(uuid, bondname) for uuid in uuids])):
                     if record:
-                        response["bond"] = json.loads(
-                                _get_logical_port(uuid, "pica8_lag"))
+                        response["bond"] = _get_logical_port(uuid, "pica8_lag")
                         break
         except InterfaceError as e:
             response["ret"] = e.ret
@@ -546,7 +1056,7 @@ def get_bond(brname, bondname):
             response["ret"] = e.ret
             response["msg"] = e.msg
         #DEBUG
-        return json.dumps(response, indent=' '*2)
+        return response
 
 def get_tunnel(brname, tunnelname):
     response = {}
@@ -555,29 +1065,24 @@ def get_tunnel(brname, tunnelname):
     except dbclient.DatabaseError as e:
         response["ret"] = e.ret
         response["msg"] = e.msg
-        return json.dumps(response)
+        return response
     else:
         try:
             response["ret"] = 0
             response["tunnel"] = None
-            transact = '["Open_vSwitch", {"op":"select", "table":"Bridge", \
-                    "where":[["name", "==", "%s"]], "columns":["ports"]}]' \
-                    % brname
+            transact = _select("Bridge", ["ports"], [["name", "==", brname]])
             cur = con.cursor()
             cur.execute(transact)
             row = cur.fetchone()
             if row:
                 records = row["ports"]
-                for uuid in ovsdb_set(records).elements:
-                    transact = '["Open_vSwitch", {"op":"select", \
-                            "table":"Port", \
-                            "where":[["_uuid", "==", ["uuid", "%s"]],\
-                            ["name", "==", "%s"]]}]' % (uuid, tunnelname)
-                    cur.execute(transact)
-                    record = cur.fetchone()
+                uuids = records
+                transact = _select("Port", ["_uuid"],
+                        _by_uuid + [["name", "==", "%s"]])
+                for uuid, record in zip(uuids, _select_each(cur, transact,
+                        [(uuid, tunnelname) for uuid in uuids])):
                     if record:
-                        response["tunnel"] = json.loads(
-                                _get_logical_port(uuid, "pica8_gre"))
+                        response["tunnel"] = _get_logical_port(uuid, "pica8_gre")
                         break
         except InterfaceError as e:
             response["ret"] = e.ret
@@ -586,36 +1091,40 @@ def get_tunnel(brname, tunnelname):
             response["ret"] = e.ret
             response["msg"] = e.msg
         #DEBUG
-        return json.dumps(response, indent=' '*2)
+        return response
 
-def _get_bridge(record):
+def _get_bridge(record, index):
     """
-    Caller provides this function with a record. So always assumes this
-    function will succeed.
+    Caller provides this function with a record and the index of the rows
+    it refers to, see _bridge_index(). So always assumes this function will
+    succeed.
     """
     response = {}
-    controller_uuids = ovsdb_set(record["controller"])
-    port_uuids = ovsdb_set(record["ports"])
-    sflow_uuid = ovsdb_set(record["sflow"])
-    netflow_uuid = ovsdb_set(record["netflow"])
-    mirror_uuids = ovsdb_set(record["mirrors"])
     response["name"] = record["name"]
-    response["datapath_id"] = _record_to_response(record, "datapath_id")
-    response["fail_mode"] = _record_to_response(record, "fail_mode")
-    response["protocols"] = _record_to_response(record, "protocols")
-    response["flood_vlans"] = _record_to_response(record, "flood_vlans")
-    response["controller"] = json.loads(_get_controllers(controller_uuids.\
-            elements))
-
-    response.update(_get_all_ports(port_uuids.elements))
-
-    response["sFlow"] = json.loads(_get_sflow(sflow_uuid.elements))
-    response["NetFlow"] = json.loads(_get_netflow(netflow_uuid.elements))
-    response["Mirrors"] = json.loads(_get_mirrors(mirror_uuids.elements))
+    response["datapath_id"] = record["datapath_id"]
+    response["fail_mode"] = record["fail_mode"]
+    response["protocols"] = _collapse(record["protocols"])
+    response["flood_vlans"] = _collapse(record["flood_vlans"])
+
+    controllers = record.resolve("controller")
+    response["controller"] = _get_controllers(_uuids(controllers),
+        controllers)
+
+    ports = record.resolve("ports")
+    pairs = _port_pairs(ports)
+    response.update(_get_all_ports(_uuids(port for port, iface in pairs),
+        pairs))
+
+    sflows = record.resolve("sflow")
+    response["sFlow"] = _get_sflow(_uuids(sflows), sflows)
+    netflows = record.resolve("netflow")
+    response["NetFlow"] = _get_netflow(_uuids(netflows), netflows)
+    mirrors = record.resolve("mirrors")
+    response["Mirrors"] = _get_mirrors(_uuids(mirrors), mirrors,
+        index.column("Port", "name"))
     response["stp_config"] = {}
-    other = ovsdb_map(record["other_config"]).pairs
-    response["stp_config"]["stp_enable"] = _record_to_response(record, \
-            "stp_enable")
+    other = record["other_config"]
+    response["stp_config"]["stp_enable"] = record["stp_enable"]
     response["stp_config"]["stp-system-id"] = other["stp-system-id"] \
             if "stp-system-id" in other else None
     response["stp_config"]["stp-priority"] = other["stp-priority"] \
@@ -627,7 +1136,7 @@ def _get_bridge(record):
     response["stp_config"]["stp-forward-delay"] = other["stp-forward-delay"] \
             if "stp-forward-delay" in other else None
     response["status"] = {}
-    status = ovsdb_map(record["status"]).pairs
+    status = record["status"]
     response["status"]["stp_bridge_id"] = status["stp_bridge_id"] \
             if "stp_bridge_id" in status else None
     response["status"]["stp_designated_root"] = status["stp_designated_root"]\
@@ -641,97 +1150,94 @@ def _get_bridge(record):
     if "datapath_id" in other:
         response["datapath_id"] = other["datapath_id"]
 
-    return json.dumps(response)
+    return response
 
-def _get_sflow(uuids):
+def _get_sflow(uuids, records=None):
     response = {}
-    for uuid in uuids:
-        con = dbclient.connect()
-        cur = con.cursor()
-        transact = '["Open_vSwitch", {"op":"select", "table":"sFlow", \
-                "where":[["_uuid", "==", ["uuid", "%s"]]]}]'\
-                % uuid
-        cur.execute(transact)
-        record = cur.fetchone()
-        response["agent"] = _record_to_response(record, "agent")
-        response["header"] = _record_to_response(record, "header")
-        response["polling"] = _record_to_response(record, "polling")
-        response["sampling"] = _record_to_response(record, "sampling")
+    if records is None:
+        records = _records(_submit_each("sFlow", uuids, _sflow_columns))
+    for record in records:
+        response["agent"] = record["agent"]
+        response["header"] = record["header"]
+        response["polling"] = record["polling"]
+        response["sampling"] = record["sampling"]
         response["targets"] = []
-        for tar in record["targets"].split(","):
+        for tar in ",".join(record["targets"]).split(","):
             if tar:
                 t = target(tar)
                 response["targets"].append(dict(ip=t.ip, port=t.port))
-    return json.dumps(response)
+    return response
 
-def _get_netflow(uuids):
+def _get_netflow(uuids, records=None):
     response = {}
-    for uuid in uuids:
-        con = dbclient.connect()
-        cur = con.cursor()
-        transact = '["Open_vSwitch", {"op":"select", "table":"NetFlow", \
-                "where":[["_uuid", "==", ["uuid", "%s"]]]}]'\
-                % uuid
-        cur.execute(transact)
-        record = cur.fetchone()
-        response["active_timeout"] = _record_to_response(record, "active_timeout")
+    if records is None:
+        records = _records(_submit_each("NetFlow", uuids, _netflow_columns))
+    for record in records:
+        response["active_timeout"] = record["active_timeout"]
         response["targets"] = []
-        for tar in record["targets"].split(","):
+        for tar in ",".join(record["targets"]).split(","):
             if tar:
                 t = target(tar)
                 response["targets"].append(dict(ip=t.ip, port=t.port))
-    return json.dumps(response)
+    return response
 
-def _get_mirrors(uuids):
+def _get_mirrors(uuids, records=None, names=None):
+    """
+    names maps port uuids to names, ports missing from it are looked up.
+    """
     response = []
-    for uuid in uuids:
-        response.append(json.loads(_get_mirror(uuid)))
-    return json.dumps(response)
+    if records is None:
+        records = _records(_submit_each("Mirror", uuids, _mirror_columns))
+    ports = []
+    for record in records:
+        ports.extend(record["select_src_port"])
+        ports.extend(record["select_dst_port"])
+        ports.extend(refs(record["output_port"]))
+    names = dict(names or {})
+    missing = [uuid for uuid in ports if uuid not in names]
+    if missing:
+        names.update(_port_names(missing))
+    for uuid, record in zip(uuids, records):
+        response.append(_get_mirror(uuid, record, names))
+    return response
 
-def _get_mirror(uuid):
+def _get_mirror(uuid, record=None, names=None):
     response = {}
-    con = dbclient.connect()
-    cur = con.cursor()
-    transact = '["Open_vSwitch", {"op":"select", "table":"Mirror", \
-            "where":[["_uuid", "==", ["uuid", "%s"]]]}]'\
-            % uuid
-    cur.execute(transact)
-    for record in cur.fetchall():
-        response["name"] = _record_to_response(record, "name")
-        response["select_all"] = _record_to_response(record, "select_all")
-        response["select_src_port"] = []
-        for port in ovsdb_set(record["select_src_port"]).elements:
-            response["select_src_port"].append(port)
-        response["select_dst_port"] = []
-        for port in ovsdb_set(record["select_dst_port"]).elements:
-            response["select_dst_port"].append(port)
-        response["select_vlan"] = []
-        for vlan in ovsdb_set(record["select_vlan"]).elements:
-            response["select_vlan"].append(vlan)
+    if record is None:
+        con = dbclient.connect()
+        cur = con.cursor()
+        cur.execute(_select("Mirror", _mirror_columns, [["_uuid", "==",
+            ["uuid", uuid]]]))
+        record = cur.fetchone()
+    if record:
+        response["name"] = record["name"]
+        response["select_all"] = record["select_all"]
+        response["select_src_port"] = list(record["select_src_port"])
+        response["select_dst_port"] = list(record["select_dst_port"])
+        response["select_vlan"] = list(record["select_vlan"])
         response["statistics"] = {}
         response["statistics"]["tx_bytes"] = 0
         response["statistics"]["tx_packets"] = 0
-        for key, val in ovsdb_map(record["statistics"]).pairs.iteritems():
+        for key, val in record["statistics"].iteritems():
             response["statistics"][key] = val
-        response["output_port"] = _record_to_response(record, "output_port")
-        response["output_vlan"] = _record_to_response(record, "output_vlan")
+        response["output_port"] = record["output_port"]
+        response["output_vlan"] = record["output_vlan"]
 # replace port uuid with port name
-    tmp = []
-    for uuid in response["select_src_port"]:
-        tmp = [json.loads(_get_port(uuid))["name"] \
-                for uuid in response["select_src_port"]]
-    response["select_src_port"] = tmp
-    tmp = []
-    for uuid in response["select_dst_port"]:
-        tmp = [json.loads(_get_port(uuid))["name"]\
-                for uuid in response["select_dst_port"]]
-    response["select_dst_port"] = tmp
+    if names is None:
+        names = _port_names(response["select_src_port"] +
+                response["select_dst_port"] +
+                ([response["output_port"]] if response["output_port"] else []))
+    response["select_src_port"] = [names[uuid] \
+            for uuid in response["select_src_port"]]
+    response["select_dst_port"] = [names[uuid] \
+            for uuid in response["select_dst_port"]]
     tmp = []
     if response["output_port"]:
-        tmp = json.loads(_get_port(response["output_port"]))["name"]
+        tmp = names[response["output_port"]]
     response["output_port"] = tmp
-    return json.dumps(response)
+    return response
 
+@cached("Controller")
 def get_controllers(brname):
     response = {}
     try:
@@ -739,104 +1245,257 @@ def get_controllers(brname):
     except dbclient.DatabaseError as e:
         response["ret"] = e.ret
         response["msg"] = e.msg
-        return json.dumps(response)
+        return response
     else:
         try:
             response["ret"] = 0
             response["controllers"] = []
-            transact = '["Open_vSwitch", {"op":"select","table":"Bridge",\
-                    "where":[["name","==","%s"]],"columns":["controller"]}]'\
-                    % brname
+            transact = _select("Bridge", ["controller"], [["name", "==", brname]])
             cur = con.cursor()
             cur.execute(transact)
             row = cur.fetchone()
             if row:
                 records = row["controller"]
-                response["controllers"] += json.loads(
-                        _get_controllers(ovsdb_set(records).elements))
+                response["controllers"] += _get_controllers(records)
         except dbclient.InterfaceError as e:
             response["ret"] = e.ret
             response["msg"] = e.msg
         except dbclient.ProgrammingError as e:
             response["ret"] = e.ret
             response["msg"] = e.msg
-        return json.dumps(response)
+        return response
 
-def _get_controllers(uuids=[]):
+def _get_controllers(uuids=[], records=None):
     # caller should guarantee that bridge name is in the database
     response = []
-    for uuid in uuids:
-        response.append(_get_controller(uuid))
-    return json.dumps(response)
+    if records is None:
+        records = _records(_submit_each("Controller", uuids,
+                _controller_columns))
+    for uuid, record in zip(uuids, records):
+        response.append(_get_controller(uuid, record))
+    return response
    
-def _get_controller(uuid):
+def _get_controller(uuid, record=None):
     response = {}
 
-    con = dbclient.connect()
-    cur = con.cursor()
-    transact = '["Open_vSwitch", {"op":"select", "table":"Controller", \
-            "where":[["_uuid", "==", ["uuid", "%s"]]]}]'  % uuid
-    cur.execute(transact)
-    record = cur.fetchone()
+    if record is None:
+        con = dbclient.connect()
+        cur = con.cursor()
+        cur.execute(_select("Controller", _controller_columns, [["_uuid",
+            "==", ["uuid", uuid]]]))
+        record = cur.fetchone()
     # refer to documentation for the controller object JSON schema
     t = target(record["target"])
-    response["uuid"] = _record_to_response(record, "_uuid")
+    response["uuid"] = record["_uuid"]
     response["ip"] = t.ip
     response["port"] = t.port
     response["protocol"] = t.protocol
-    response["connection_mode"] = _record_to_response(record, \
-            "connection_mode")
-    response["max_backoff"] = _record_to_response(record, "max_backoff")
-    response["inactivity_probe"] = _record_to_response(record, \
-            "inactivity_probe")
-    response["enable_async_messages"] = _record_to_response(record, \
-            "enable_async_messages")
-    response["controller_rate_limit"] = _record_to_response(record, \
-            "controller_rate_limit")
-    response["controller_burst_limit"] = _record_to_response(record, \
-            "controller_burst_limit")
+    response["connection_mode"] = record["connection_mode"]
+    response["max_backoff"] = record["max_backoff"]
+    response["inactivity_probe"] = record["inactivity_probe"]
+    response["enable_async_messages"] = record["enable_async_messages"]
+    response["controller_rate_limit"] = record["controller_rate_limit"]
+    response["controller_burst_limit"] = record["controller_burst_limit"]
     response["in_band"] = {}
-    response["in_band"]["local_ip"] = _record_to_response(record, "local_ip")
-    response["in_band"]["local_netmask"] = _record_to_response(record, \
-            "local_netmask")
-    response["in_band"]["local_gateway"] = _record_to_response(record, \
-            "local_gateway")
+    response["in_band"]["local_ip"] = record["local_ip"]
+    response["in_band"]["local_netmask"] = record["local_netmask"]
+    response["in_band"]["local_gateway"] = record["local_gateway"]
     response["is_connected"] = record["is_connected"]
-    response["role"] = _record_to_response(record, "role")
+    response["role"] = record["role"]
     response["status"] = {}
-    status = ovsdb_map(record["status"])
-    response["status"]["state"] = status.pairs.get("state", None)
+    response["status"]["state"] = record["status"].get("state", None)
     return response
 
-def get_ports(brname):
+@cached("Port")
+def get_ports(brname, limit=None, cursor=None, name_prefix=None, type=None,
+        vlan_mode=None, tag=None, link_state=None, sort=None):
+    """
+    Every physical port of bridge brname, or with any of the other
+    arguments given, one page of the ports matching them, see
+    _get_port_page().
+    """
+    if any(arg is not None for arg in (limit, cursor, name_prefix, type,
+            vlan_mode, tag, link_state, sort)):
+        return _get_port_page(brname, limit, cursor, name_prefix, type,
+                vlan_mode, tag, link_state, sort)
     response = {}
     try:
         con = dbclient.connect()
     except dbclient.DatabaseError as e:
         response["ret"] = e.ret
         response["msg"] = e.msg
-        return json.dumps(response)
+        return response
     else:
         try:
             response["ret"] = 0
             response["ports"] = []
-            transact = '["Open_vSwitch", {"op":"select", "table":"Bridge", \
-                    "where":[["name", "==", "%s"]], "columns":["ports"]}]'\
-                    % brname
             cur = con.cursor()
-            cur.execute(transact)
-            row = cur.fetchone()
-            if row:
-                records = row["ports"]
-                response["ports"] += json.loads(
-                        _get_ports(ovsdb_set(records).elements))
+            bridges, index = _bridge_index(cur, [["name", "==", brname]],
+                    ["ports"], _port_joins)
+            if bridges:
+                pairs = _port_pairs(bridges[0].resolve("ports"))
+                response["ports"] += _get_ports(
+                    _uuids(port for port, iface in pairs), pairs)
         except dbclient.InterfaceError as e:
             response["ret"] = e.ret
             response["msg"] = e.msg
         except dbclient.ProgrammingError as e:
             response["ret"] = e.ret
             response["msg"] = e.msg
-        return json.dumps(response)
+        return response
+
+# the columns _port_index() sorts and filters on
+_port_index_joins = [("Port", ["_uuid", "name", "vlan_mode", "tag",
+    "interfaces"]), ("Interface", ["_uuid", "type", "ofport", "link_state"])]
+
+# type as get_ports() takes and answers it -> Interface types it stands for
+_port_types = {"phy": ("", "system"), "pica8_lag": ("pica8_lag",),
+        "pica8_gre": ("pica8_gre",)}
+
+_port_sorts = ("name", "ofport", "tag", "vlan_mode", "link_state")
+
+def _port_index(brname):
+    """
+    A small dict of the columns in _port_index_joins for every port of
+    bridge brname, sorted by name, None if there is no such bridge. Only
+    these columns are read and decoded, and the index is kept in _cache
+    along with the responses built from it.
+    """
+    key = ("_port_index", brname)
+    entries = _cache.get(key)
+    if entries is None:
+        since = _cache.generation
+        cur = dbclient.connect().cursor()
+        bridges, index = _bridge_index(cur, [["name", "==", brname]],
+                ["ports"], _port_index_joins)
+        if not bridges:
+            return None
+        entries = []
+        for port, iface in _port_pairs(bridges[0].resolve("ports")):
+            entries.append(dict(name=port["name"], uuid=port["_uuid"],
+                type=iface["type"], vlan_mode=port["vlan_mode"],
+                tag=port["tag"], link_state=iface["link_state"],
+                ofport=iface["ofport"]))
+        entries.sort(key=lambda entry: entry["name"])
+        _cache.put(key, entries, [(brname, "Port")], since)
+    return entries
+
+def _get_port_page(brname, limit, cursor, name_prefix, type, vlan_mode, tag,
+        link_state, sort):
+    """
+    The ports of bridge brname that are of type (default "phy", also
+    "pica8_lag" or "pica8_gre") and match every other filter given, sorted
+    by sort, one of _port_sorts, "-" in front for descending order.
+
+    Filtering, sorting and paging happen on _port_index(); only the limit
+    ports of the page are read in full and turned into views. Return
+    {"ret": 0, "ports": [...], "total": ports matched, "next": cursor of
+    the next page or None}. cursor is opaque and holds the sort key of the
+    last port of the previous page, so inserts and deletes do not make
+    pages skip or repeat ports.
+    """
+    response = {}
+    try:
+        kinds = _port_types[type or "phy"]
+        sort = sort or "name"
+        descending = sort.startswith("-")
+        column = sort.lstrip("-")
+        if column not in _port_sorts:
+            raise ValueError("cannot sort by %s" % column)
+        if limit is not None:
+            limit = int(limit)
+            if limit < 1:
+                raise ValueError("limit must be positive")
+        if tag is not None:
+            tag = int(tag)
+        if cursor is not None:
+            cursor = base64.urlsafe_b64decode(str(cursor))
+            cursor = tuple(json.loads(cursor))
+    except KeyError:
+        return dict(ret=-2, msg="Unknown port type %s" % type)
+    except (ValueError, TypeError, UnicodeError) as e:
+        return dict(ret=-2, msg="Malformed port query: %s" % e)
+    try:
+        entries = _port_index(brname)
+        if entries is None:
+            return dict(ret=0, ports=[], total=0, next=None)
+        if name_prefix:
+            # entries are sorted by name
+            names = [entry["name"] for entry in entries]
+            entries = entries[bisect.bisect_left(names, name_prefix):
+                    bisect.bisect_left(names, name_prefix + u"\uffff")]
+        entries = [entry for entry in entries \
+                if (entry["type"] or "") in kinds \
+                and (vlan_mode is None or entry["vlan_mode"] == vlan_mode) \
+                and (tag is None or entry["tag"] == tag) \
+                and (link_state is None \
+                or entry["link_state"] == link_state)]
+        keys = sorted((entry[column], entry["name"], entry["uuid"]) \
+                for entry in entries)
+        if descending:
+            if cursor is not None:
+                keys = keys[:bisect.bisect_left(keys, cursor)]
+            keys.reverse()
+        elif cursor is not None:
+            keys = keys[bisect.bisect_right(keys, cursor + (u"\uffff",)):]
+        page = keys[:limit]
+        uuids = [uuid for value, name, uuid in page]
+        if type in (None, "phy"):
+            ports = _get_ports(uuids)
+        else:
+            ports = _get_logical_ports(uuids, type)
+    except dbclient.Error as e:
+        response["ret"] = e.ret
+        response["msg"] = e.msg
+        return response
+    response["ret"] = 0
+    response["ports"] = ports
+    response["total"] = len(entries)
+    response["next"] = None
+    if limit is not None and len(keys) > limit:
+        response["next"] = base64.urlsafe_b64encode(
+                json.dumps(page[-1][:2]))
+    return response
+
+# the Interface counters get_port_stats() answers with, as _get_port
+# reports them
+_stats_counters = ["rx_packets", "rx_bytes", "tx_packets", "tx_bytes",
+        "rx_dropped", "rx_frame_err", "rx_over_err", "rx_crc_err",
+        "rx_errors", "tx_dropped", "collisions", "tx_errors"]
+
+_stats_joins = [("Port", ["_uuid", "name", "interfaces"]), ("Interface",
+    ["_uuid", "type", "ofport", "statistics"])]
+
+def get_port_stats(brname):
+    """
+    The counters of every physical port of bridge brname, in columns:
+    {"ret": 0, "names": [...], "ofports": [...], "counters": {"rx_bytes":
+    [...], ...}}, the i-th item of every list belonging to port names[i].
+
+    Only type, ofport and statistics are read from Interface, in the
+    transact that reads the bridge, and no port view is built, so a
+    periodic refresh costs one round trip and a small response. Counters
+    change without any write through this module, so it is never cached.
+    """
+    response = {}
+    try:
+        cur = dbclient.connect().cursor()
+        bridges, index = _bridge_index(cur, [["name", "==", brname]],
+                ["ports"], _stats_joins)
+    except dbclient.Error as e:
+        response["ret"] = e.ret
+        response["msg"] = e.msg
+        return response
+    pairs = [(port, iface) for port, iface \
+            in _port_pairs(bridges[0].resolve("ports") if bridges else []) \
+            if not iface["type"] or iface["type"] == "system"]
+    ifaces = [iface for port, iface in pairs]
+    response["ret"] = 0
+    response["names"] = [port["name"] for port, iface in pairs]
+    response["ofports"] = [iface["ofport"] for iface in ifaces]
+    response["counters"] = dict((counter, [iface["statistics"].get(counter) \
+            for iface in ifaces]) for counter in _stats_counters)
+    return response
 
 def get_port(brname, portname):
     response = {}
@@ -845,29 +1504,21 @@ def get_port(brname, portname):
     except dbclient.DatabaseError as e:
         response["ret"] = e.ret
         response["msg"] = e.msg
-        return json.dumps(response)
+        return response
     else:
         try:
             response["ret"] = 0
             response["port"] = None
-            transact = '["Open_vSwitch", {"op":"select", "table":"Bridge", \
-                    "where":[["name", "==", "%s"]], "columns":["ports"]}]'\
-                    % brname
             cur = con.cursor()
-            cur.execute(transact)
-            row = cur.fetchone()
-            if row:
-                records = row["ports"]
-                for uuid in ovsdb_set(records).elements:
-                    transact = '["Open_vSwitch", {"op":"select", \
-                            "table":"Port", \
-                            "where":[["_uuid", "==", ["uuid", "%s"]], \
-                            ["name", "==", "%s"]]}]' % (uuid, portname)
-                    cur.execute(transact)
-                    record = cur.fetchone()
-                    if record:
-                        response["port"] = json.loads(_get_port(uuid))
-                        break
+            bridges, index = _bridge_index(cur, [["name", "==", brname]],
+                    ["ports"], _port_joins)
+            if bridges:
+                ports = [port for port \
+                        in bridges[0].resolve("ports") \
+                        if port["name"] == portname]
+                for records in _port_pairs(ports[:1]):
+                    response["port"] = _get_port(
+                        records[0]["_uuid"], records)
         except InterfaceError as e:
             response["ret"] = e.ret
             response["msg"] = e.msg
@@ -875,38 +1526,42 @@ def get_port(brname, portname):
             response["ret"] = e.ret
             response["msg"] = e.msg
         #DEBUG
-        return json.dumps(response, indent=' '*2)
+        return response
 
-def _get_ports(uuids=[]):
+def _get_ports(uuids=[], port_records=None):
     response = []
-    for uuid in uuids:
-        port = _get_port(uuid)
-        # _get_port should return "{}" if uuid is not a physical port
-        if json.loads(port):
-            response.append(json.loads(port))
-    return json.dumps(response)
-
-def _get_port(uuid):
+    if port_records is None:
+        port_records = _iface_records_helper(uuids)
+    for records in port_records:
+        port = _get_port(records[0]["_uuid"], records)
+        # _get_port returns {} if uuid is not a physical port
+        if port:
+            response.append(port)
+    return response
+
+def _get_port(uuid, records=None):
     response = {}
 
-    port_record, iface_record = _iface_record_helper(uuid)
+    port_record, iface_record = records or _iface_record_helper(uuid)
+    if iface_record is None:
+        return response
 
     if not iface_record["type"] or iface_record["type"] == "system":
         response["name"] = port_record["name"]
-        response["mac"] = _record_to_response(port_record, "mac")
-        response["qos"] = _record_to_response(port_record, "qos")
+        response["mac"] = port_record["mac"]
+        response["qos"] = port_record["qos"]
         response["ofport"] = iface_record["ofport"]
         response["type"] = "phy"
         response["vlan_config"] = {}
         response["vlan_config"]["vlan_mode"] =\
-                _record_to_response(port_record, "vlan_mode")
+                port_record["vlan_mode"]
         response["vlan_config"]["tag"] =\
-                _record_to_response(port_record, "tag")
+                port_record["tag"]
         response["vlan_config"]["trunks"] =\
-                _record_to_response(port_record, "trunks")
+                _collapse(port_record["trunks"])
         response["status"] = {}
         # Status
-        status = ovsdb_map(port_record["status"]).pairs
+        status = port_record["status"]
         response["status"]["stp_port_id"] = status["stp_port_id"]\
                 if "stp_port_id" in status else None 
         response["status"]["stp_state"] = status["stp_state"]\
@@ -915,15 +1570,13 @@ def _get_port(uuid):
                 if "stp_sec_in_state" in status else None 
         response["status"]["stp_role"] = status["stp_role"]\
                 if "stp_role" in status else None 
-        response["admin_state"] = _record_to_response(iface_record,
-                "admin_state")
-        response["link_state"] = _record_to_response(iface_record,\
-                "link_state") 
-        response["duplex"] = _record_to_response(iface_record, "duplex")
-        response["mtu"] = _record_to_response(iface_record, "mtu")
+        response["admin_state"] = iface_record["admin_state"]
+        response["link_state"] = iface_record["link_state"] 
+        response["duplex"] = iface_record["duplex"]
+        response["mtu"] = iface_record["mtu"]
         response["options"] = {}
         # Options
-        options = ovsdb_map(iface_record["options"]).pairs
+        options = iface_record["options"]
         response["options"]["link_speed"] = options["link_speed"]\
                 if "link_speed" in options else None
         # Statistics
@@ -932,7 +1585,7 @@ def _get_port(uuid):
         response["statistics"]["receive_errors"] = {}
         response["statistics"]["transmit_errors"] = {}
         response["statistics"]["stp_counters"] = {}
-        statistics = ovsdb_map(iface_record["statistics"]).pairs
+        statistics = iface_record["statistics"]
 # counter
         response["statistics"]["counters"]["rx_packets"] = \
                 statistics["rx_packets"]
@@ -961,7 +1614,7 @@ def _get_port(uuid):
         response["statistics"]["transmit_errors"]["tx_errors"] = \
                 statistics["tx_errors"]
 # stp counters
-        stp_counter = ovsdb_map(port_record["statistics"]).pairs
+        stp_counter = port_record["statistics"]
         response["statistics"]["stp_counters"]["stp_tx_count"] = \
                 stp_counter["stp_tx_count"] \
                 if "stp_tx_count" in stp_counter else None
@@ -972,71 +1625,82 @@ def _get_port(uuid):
                 stp_counter["stp_error_count"] \
                 if "stp_error_count" in stp_counter else None
 
-    return json.dumps(response)
+    return response
 
-def update_port(brname, data):
+def update_port(brname, data, minimal=False):
     port = json.loads(data)
-    commands = []
-    if port["vlan_config"]["vlan_mode"] == 'access':
-        commands = ['--', 'set', 'Port', port['name'], 'vlan_mode=access',
-                '--', 'set', 'Port', port['name'], 'tag=%d' % \
-                        port['vlan_config']['tag']]
-    elif port["vlan_config"]["vlan_mode"] == 'trunk':
-        commands = ['--', 'set', 'Port', port['name'], 'vlan_mode=trunk',
-                '--', 'set', 'Port', port['name'], 'trunks=%s' % \
-                        str(port['vlan_config']['trunks'])]
+    error = _execute(_update_port_ops, brname, port)
+    _invalidate(brname, "Port")
+    return error or (_one_port(port["name"]) if minimal else get_ports(brname))
+
+def _update_port_ops(txn, brname, port):
+    where = [["name", "==", port['name']]]
+    txn.expect("Port", where)
+    row = _vlan_config(port)
 
     if port["options"]["link_speed"] > 0:
 # TODO, set link speed here
 # options:link_speed=1G
         pass
 
-    if port["qos"]:
-        commands.extend(['--', 'set', 'Port', port['name'], 'qos=%s' %
-            port['qos']])
-    else:
-        commands.extend(['--', 'clear', 'Port', port['name'], 'qos'])
+    row["qos"] = ref(port['qos']) if port["qos"] else oset([])
+    txn.update("Port", where, row)
 
-    ret, err = vsctl.execute(commands)
-    return get_ports(brname)
+def _vlan_config(port):
+    row = {}
+    if port['vlan_config']['vlan_mode'] == 'access':
+        row["vlan_mode"] = "access"
+        row["tag"] = int(port['vlan_config']['tag'])
+    elif port['vlan_config']['vlan_mode'] == 'trunk':
+        row["vlan_mode"] = "trunk"
+        row["trunks"] = oset(_int_set(port['vlan_config']['trunks']))
+    return row
 
-def del_port(brname, data):
+def del_port(brname, data, minimal=False):
     port = json.loads(data)
-    commands = ['del-port', brname, port["name"]]
-    ret, err = vsctl.execute(commands)
-    return get_ports(brname)
-
-def add_port(brname, data):
+    error = _execute(_del_port_ops, brname, port)
+    _invalidate(brname, "Port", "Mirror")
+    return error or (_removed("port", port["name"]) \
+            if minimal else get_ports(brname))
+
+def _del_port_ops(txn, brname, port):
+    uuid = _lookup("Port", [port["name"]])[port["name"]]
+    where = [["name", "==", brname]]
+    # fails if the port is on another bridge, as ovs-vsctl del-port does
+    txn.expect("Bridge", where + [["ports", "includes", oset([ref(uuid)])]])
+    txn.mutate("Bridge", where, [["ports", "delete", oset([ref(uuid)])]])
+
+def add_port(brname, data, minimal=False):
     port = json.loads(data)
-    commands = ['--', 'add-port', brname, port["name"], '--',
-            'set', 'Interface', port["name"], 'type=system']
-
-    vlan_config = []
-
-    if port['vlan_config']['vlan_mode'] == 'access':
-        vlan_config = ['--', 'set', 'Port', port["name"], 'vlan_mode=access',
-                '--', 'set', 'Port', port["name"],
-                'tag=%d' % port['vlan_config']['tag']]
-    elif port['vlan_config']['vlan_mode'] == 'trunk':
-        vlan_config = ['--', 'set', 'Port', port["name"], 'vlan_mode=trunk',
-                '--', 'set', 'Port', port["name"],
-                'trunks=%s' % str(port['vlan_config']['trunks'])]
-    commands.extend(vlan_config)
-    ret, err = vsctl.execute(commands)
-    return get_ports(brname)
+    error = _execute(_add_port_ops, brname, port)
+    _invalidate(brname, "Port")
+    return error or (_one_port(port["name"]) if minimal else get_ports(brname))
+
+def _add_port_ops(txn, brname, port):
+    where = [["name", "==", brname]]
+    txn.expect("Bridge", where)
+    iface = txn.insert("Interface", {"name": port["name"], "type": "system"})
+    row = _vlan_config(port)
+    row["name"] = port["name"]
+    row["interfaces"] = iface
+    new = txn.insert("Port", row)
+    txn.mutate("Bridge", where, [["ports", "insert", oset([new])]])
+    return new
 
 def _get_logical_ports(uuids, type):
     response = []
-    for uuid in uuids:
-        port = _get_logical_port(uuid, type)
-        # _get_port should return "{}" if uuid is not a physical port
-        if json.loads(port):
-            response.append(json.loads(port))
-    return json.dumps(response)
-
-def _get_logical_port(uuid, type):
+    for records in _iface_records_helper(uuids, True):
+        port = _get_logical_port(records[0]["_uuid"], type, records)
+        # _get_port returns {} if uuid is not a physical port
+        if port:
+            response.append(port)
+    return response
+
+def _get_logical_port(uuid, type, records=None):
     response = {}
-    port_record, iface_record = _iface_record_helper(uuid)
+    port_record, iface_record = records or _iface_record_helper(uuid, True)
+    if iface_record is None:
+        return response
 
     if iface_record["type"] == type:
         response["name"] = port_record["name"]
@@ -1044,14 +1708,14 @@ def _get_logical_port(uuid, type):
         response["type"] = type
         response["vlan_config"] = {}
         response["vlan_config"]["vlan_mode"] =\
-                _record_to_response(port_record, "vlan_mode")
+                port_record["vlan_mode"]
         response["vlan_config"]["tag"] =\
-                _record_to_response(port_record, "tag")
+                port_record["tag"]
         response["vlan_config"]["trunks"] =\
-                _record_to_response(port_record, "trunks")
+                _collapse(port_record["trunks"])
         response["options"] = {}
         # Options
-        options = ovsdb_map(iface_record["options"]).pairs
+        options = iface_record["options"]
         response["options"]["lag_type"] = options["lag_type"]\
                 if "lag_type" in options else None
         response["options"]["members"] = options["members"]\
@@ -1086,27 +1750,33 @@ def _get_logical_port(uuid, type):
         response["options"]["egress_port"] = options["egress_port"]\
                 if "egress_port" in options else None
 
-    return json.dumps(response)
+    return response
 
-def _get_all_ports(uuids=[]):
+def _get_all_ports(uuids=[], port_records=None):
     response = {
             "ports" : [],
             "lags" : [],
             "tunnels" : []
             }
 
-    for uuid in uuids:
-        port_record, iface_record = _iface_record_helper(uuid)
+    if port_records is None:
+        port_records = _iface_records_helper(uuids)
+    for records in port_records:
+        uuid = records[0]["_uuid"]
+        port_record, iface_record = records
         if not iface_record["type"] or iface_record["type"] == "system":
-            response["ports"].append(json.loads(_get_port(uuid)))
+            response["ports"].append(_get_port(uuid, records))
         elif iface_record["type"] == "pica8_gre":
-            response["tunnels"].append(json.loads(_get_logical_port(uuid, "pica8_gre")))
+            response["tunnels"].append(_get_logical_port(uuid,
+                "pica8_gre", records))
         elif iface_record["type"] == "pica8_lag":
-            response["lags"].append(json.loads(_get_logical_port(uuid, "pica8_lag")))
+            response["lags"].append(_get_logical_port(uuid,
+                "pica8_lag", records))
 
     return response
 
 
+@cached("sFlow")
 def get_sflow(brname):
     """
     If Bridge brname doesn't have an sflow record, return None.
@@ -1117,97 +1787,78 @@ def get_sflow(brname):
     except dbclient.DatabaseError as e:
         response["ret"] = e.ret
         response["msg"] = e.msg
-        return json.dumps(response)
+        return response
     else:
         try:
             response["ret"] = 0
             response["sflow"] = None
-            transact = '["Open_vSwitch", {"op":"select", "table":"Bridge", \
-                    "where":[["name", "==", "%s"]], "columns":["sflow"]}]' \
-                    % brname
+            transact = _select("Bridge", ["sflow"], [["name", "==", brname]])
             cur = con.cursor()
             cur.execute(transact)
             row = cur.fetchone()
             if row:
                 record = row["sflow"]
-                if record[1]:
-                    response["sflow"] = json.loads(_get_sflow(ovsdb_set(record).elements))
+                if record:
+                    response["sflow"] = _get_sflow([record])
         except dbclient.InterfaceError as e:
             response["ret"] = e.ret
             response["msg"] = e.msg
         except dbclient.ProgrammingError as e:
             response["ret"] = e.ret
             response["msg"] = e.msg
-        return json.dumps(response)
-
-def update_sflow(brname, data):
-    sf = json.loads(data)
-    commands = ['--', 'set', 'sFlow', brname]
-    clear = []
-
-    if sf['agent']:
-        commands.extend(['agent=%s' % sf['agent']])
-    else:
-        clear.extend(['--', 'clear', 'sflow', brname, 'agent'])
-
-    if sf['header']:
-       commands.extend(['header=%d' % sf['header']])
-    else:
-        clear.extend(['--', 'clear', 'sflow', brname, 'header'])
-
-    if sf['polling']:
-       commands.extend(['polling=%d' % sf['polling']])
-    else:
-        clear.extend(['--', 'clear', 'sflow', brname, 'polling'])
-
-    if sf['sampling']:
-       commands.extend(['sampling=%d' % sf['sampling']])
-    else:
-        clear.extend(['--', 'clear', 'sflow', brname, 'sampling'])
-
-    targets = ''
-    for target in sf['targets']:
-        targets += target['ip'] + ':' + str(target['port']) + ','
-    commands.extend(['targets=%s' % ('\"' + targets + '\"')])
-
-    commands.extend(clear)
-
-    ret, err = vsctl.execute(commands)
-    return get_sflow(brname)
-
-def del_sflow(brname, data):
-    sf = json.loads(data)
-    commands = ['clear', 'Bridge', brname, 'sflow']
-    ret, err = vsctl.execute(commands)
-    return get_sflow(brname)
-
-def add_sflow(brname, data):
-    sf = json.loads(data)
-    commands = ['--', 'set', 'Bridge', brname, 'sflow=@sf',
-            '--', '--id=@sf', 'create', 'sFlow']
-
-    if sf['agent']:
-        commands.extend(['agent=%s' % sf['agent']])
-
-    if sf['header']:
-       commands.extend(['header=%d' % sf['header']])
-
-    if sf['polling']:
-       commands.extend(['polling=%d' % sf['polling']])
-
-    if sf['sampling']:
-       commands.extend(['sampling=%d' % sf['sampling']])
-
-    targets = ''
-    for target in sf['targets']:
-        targets += target['ip'] + ':' + str(target['port']) + ','
-    commands.extend(['targets=%s' % ('\"' + targets + '\"')])
-
-    ret, err = vsctl.execute(commands)
-    print ret
-    print err
-    return get_sflow(brname)
-
+        return response
+
+def update_sflow(brname, data, minimal=False):
+    error = _execute(_update_sflow_ops, brname, json.loads(data))
+    _invalidate(brname, "sFlow")
+    return error or (_with_generation(get_sflow(brname)) \
+            if minimal else get_sflow(brname))
+
+def _update_sflow_ops(txn, brname, sf):
+    uuid = _bridge_ref(brname, "sflow")
+    txn.update("sFlow", [["_uuid", "==", ref(uuid)]], _sflow_row(sf))
+
+def _sflow_row(sf):
+    row = {}
+    row["agent"] = sf['agent'] or oset([])
+    row["header"] = sf['header'] or oset([])
+    row["polling"] = sf['polling'] or oset([])
+    row["sampling"] = sf['sampling'] or oset([])
+    row["targets"] = _targets(sf['targets'])
+    return row
+
+def _targets(targets):
+    # stored as a single "ip:port,ip:port," string, see _get_sflow
+    return "".join("%s:%s," % (target['ip'], target['port']) \
+            for target in targets)
+
+def del_sflow(brname, data, minimal=False):
+    error = _execute(_del_sflow_ops, brname)
+    _invalidate(brname, "sFlow")
+    return error or (_with_generation(get_sflow(brname)) \
+            if minimal else get_sflow(brname))
+
+def _del_sflow_ops(txn, brname):
+    where = [["name", "==", brname]]
+    txn.expect("Bridge", where)
+    txn.update("Bridge", where, {"sflow": oset([])})
+
+def add_sflow(brname, data, minimal=False):
+    error = _execute(_add_sflow_ops, brname, json.loads(data))
+    _invalidate(brname, "sFlow")
+    return error or (_with_generation(get_sflow(brname)) \
+            if minimal else get_sflow(brname))
+
+def _add_sflow_ops(txn, brname, sf):
+    where = [["name", "==", brname]]
+    txn.expect("Bridge", where)
+    row = dict((key, value) for key, value in _sflow_row(sf).iteritems() \
+            if value != oset([]))
+    new = txn.insert("sFlow", row)
+    txn.update("Bridge", where, {"sflow": new})
+    return new
+
+@cached("NetFlow")
 def get_netflow(brname):
     """
     If Bridge brname doesn't have an newflow record, return None.
@@ -1218,64 +1869,68 @@ def get_netflow(brname):
     except dbclient.DatabaseError as e:
         response["ret"] = e.ret
         response["msg"] = e.msg
-        return json.dumps(response)
+        return response
     else:
         try:
             response["ret"] = 0
             response["netflow"] = None
-            transact = '["Open_vSwitch", {"op":"select", "table":"Bridge", \
-                    "where":[["name", "==", "%s"]], "columns":["netflow"]}]' \
-                    % brname
+            transact = _select("Bridge", ["netflow"], [["name", "==", brname]])
             cur = con.cursor()
             cur.execute(transact)
             row = cur.fetchone()
             if row:
                 record = row["netflow"]
-                if record[1]:
-                    response["netflow"] = json.loads(_get_netflow(ovsdb_set(record).elements))
+                if record:
+                    response["netflow"] = _get_netflow([record])
         except dbclient.InterfaceError as e:
             response["ret"] = e.ret
             response["msg"] = e.msg
         except dbclient.ProgrammingError as e:
             response["ret"] = e.ret
             response["msg"] = e.msg
-        return json.dumps(response)
-
-def update_netflow(brname, data):
-    nf = json.loads(data)
-    commands = ['--', 'set', 'NetFlow', brname]
-
-    commands.extend(['active_timeout=%d' % nf['active_timeout']])
-
-    targets = ''
-    for target in nf['targets']:
-        targets += target['ip'] + ':' + str(target['port']) + ','
-    commands.extend(['targets=%s' % ('\"' + targets + '\"')])
-
-    ret, err = vsctl.execute(commands)
-    return get_netflow(brname)
-
-def del_netflow(brname, data):
-    nf = json.loads(data)
-    commands = ['clear', 'Bridge', brname, 'netflow']
-    ret, err = vsctl.execute(commands)
-    return get_netflow(brname)
-
-def add_netflow(brname, data):
-    nf = json.loads(data)
-    commands = ['--', 'set', 'Bridge', brname, 'netflow=@nf',
-            '--', '--id=@nf', 'create', 'NetFlow']
-
-    commands.extend(['active_timeout=%d' % nf['active_timeout']])
-
-    targets = ''
-    for target in nf['targets']:
-        targets += target['ip'] + ':' + str(target['port']) + ','
-    commands.extend(['targets=%s' % ('\"' + targets + '\"')])
-
-    ret, err = vsctl.execute(commands)
-    return get_netflow(brname)
-
+        return response
+
+def update_netflow(brname, data, minimal=False):
+    error = _execute(_update_netflow_ops, brname, json.loads(data))
+    _invalidate(brname, "NetFlow")
+    return error or (_with_generation(get_netflow(brname)) \
+            if minimal else get_netflow(brname))
+
+def _update_netflow_ops(txn, brname, nf):
+    uuid = _bridge_ref(brname, "netflow")
+    txn.update("NetFlow", [["_uuid", "==", ref(uuid)]], _netflow_row(nf))
+
+def _netflow_row(nf):
+    row = {}
+    row["active_timeout"] = int(nf['active_timeout'])
+    row["targets"] = _targets(nf['targets'])
+    return row
+
+def del_netflow(brname, data, minimal=False):
+    error = _execute(_del_netflow_ops, brname)
+    _invalidate(brname, "NetFlow")
+    return error or (_with_generation(get_netflow(brname)) \
+            if minimal else get_netflow(brname))
+
+def _del_netflow_ops(txn, brname):
+    where = [["name", "==", brname]]
+    txn.expect("Bridge", where)
+    txn.update("Bridge", where, {"netflow": oset([])})
+
+def add_netflow(brname, data, minimal=False):
+    error = _execute(_add_netflow_ops, brname, json.loads(data))
+    _invalidate(brname, "NetFlow")
+    return error or (_with_generation(get_netflow(brname)) \
+            if minimal else get_netflow(brname))
+
+def _add_netflow_ops(txn, brname, nf):
+    where = [["name", "==", brname]]
+    txn.expect("Bridge", where)
+    new = txn.insert("NetFlow", _netflow_row(nf))
+    txn.update("Bridge", where, {"netflow": new})
+    return new
+
+@cached("Mirror", "Port")
 def get_mirrors(brname):
     """
     If Bridge brname doesn't contain any mirror records, return an empty list.
@@ -1286,27 +1941,25 @@ def get_mirrors(brname):
     except dbclient.DatabaseError as e:
         response["ret"] = e.ret
         response["msg"] = e.msg
-        return json.dumps(response)
+        return response
     else:
         try:
             response["ret"] = 0
             response["mirrors"] = []
-            transact = '["Open_vSwitch", {"op":"select", "table":"Bridge", \
-                    "where":[["name", "==", "%s"]], "columns":["mirrors"]}]' \
-                    % brname
             cur = con.cursor()
-            cur.execute(transact)
-            row = cur.fetchone()
-            if row:
-                records = row["mirrors"]
-                response["mirrors"] = json.loads(_get_mirrors(ovsdb_set(records).elements))
+            bridges, index = _bridge_index(cur, [["name", "==", brname]],
+                    ["mirrors"], _mirror_joins)
+            if bridges:
+                mirrors = bridges[0].resolve("mirrors")
+                response["mirrors"] = _get_mirrors(
+                    _uuids(mirrors), mirrors, index.column("Port", "name"))
         except dbclient.InterfaceError as e:
             response["ret"] = e.ret
             response["msg"] = e.msg
         except dbclient.ProgrammingError as e:
             response["ret"] = e.ret
             response["msg"] = e.msg
-        return json.dumps(response)
+        return response
 
 def get_mirror(brname, mirname):
     """
@@ -1318,27 +1971,20 @@ def get_mirror(brname, mirname):
     except dbclient.DatabaseError as e:
         response["ret"] = e.ret
         response["msg"] = e.msg
-        return json.dumps(response)
+        return response
     else:
         try:
             response["ret"] = 0
             response["mirror"] = None
-            transact = '["Open_vSwitch", {"op":"select", "table":"Bridge", \
-                    "where":[["name", "==", "%s"]], "columns":["mirrors"]}]' \
-                    % brname
             cur = con.cursor()
-            cur.execute(transact)
-            record = cur.fetchone()
-            if record:
-                records = record["mirrors"]
-                for uuid in ovsdb_set(records).elements:
-                    transact = '["Open_vSwitch", {"op":"select", "table":"Mirror", \
-                        "where":[["_uuid", "==", ["uuid", "%s"]], \
-                        ["name", "==", "%s"]]}]' % (uuid, mirname)
-                    cur.execute(transact)
-                    record = cur.fetchone()
-                    if record:
-                        response["mirror"] = json.loads(_get_mirror(uuid))
+            bridges, index = _bridge_index(cur, [["name", "==", brname]],
+                    ["mirrors"], _mirror_joins)
+            if bridges:
+                for record in bridges[0].resolve("mirrors"):
+                    if record["name"] == mirname:
+                        response["mirror"] = _get_mirror(
+                            record["_uuid"], record,
+                            index.column("Port", "name"))
                         break
         except dbclient.InterfaceError as e:
             response["ret"] = e.ret
@@ -1348,167 +1994,232 @@ def get_mirror(brname, mirname):
             response["msg"] = e.msg
         except:
             print "error"
-        return json.dumps(response)
+        return response
 
-def update_mirror(brname, data):
+def update_mirror(brname, data, minimal=False):
     mirror = json.loads(data)
-    commands = []
+    error = _execute(_update_mirror_ops, brname, mirror)
+    _invalidate(brname, "Mirror")
+    return error or (_one_mirror(mirror["name"]) \
+            if minimal else get_mirrors(brname))
+
+def _update_mirror_ops(txn, brname, mirror):
+    where = [["name", "==", mirror['name']]]
+    txn.expect("Mirror", where)
+    row = _mirror_row(mirror)
     if mirror['output_port']:
-        ids = port_ids(mirror['select_src_port'],
-                mirror['select_dst_port'],
-                mirror['output_port'])
-        commands.extend(ids)
-        if not mirror['select_src_port']:
-            commands.extend([
-                '--', 'clear', 'Mirror', mirror['name'], 'select_src_port'])
-        if not mirror['select_dst_port']:
-            commands.extend([
-                '--', 'clear', 'Mirror', mirror['name'], 'select_dst_port'])
+        row.setdefault("select_src_port", oset([]))
+        row.setdefault("select_dst_port", oset([]))
         # Clear VLAN section
-        commands.extend([
-            '--', 'clear', 'Mirror', mirror['name'], 'select_vlan',
-            '--', 'clear', 'Mirror', mirror['name'], 'output_vlan'])
-        commands.extend([
-            '--', 'set', 'Mirror', mirror['name']])
-        if mirror['select_src_port']:
-            commands.append('select_src_port=%s' %
-                add_prefix(mirror['select_src_port']))
-        if mirror['select_dst_port']:
-            commands.append('select_dst_port=%s' %
-                add_prefix(mirror['select_dst_port']))
-        commands.append('output_port=%s' %
-            add_prefix(mirror['output_port']))
+        row["select_vlan"] = oset([])
+        row["output_vlan"] = oset([])
     elif mirror['output_vlan']:
         # Clear Port section
-        commands.extend([
-            '--', 'clear', 'Mirror', mirror['name'], 'select_src_port',
-            '--', 'clear', 'Mirror', mirror['name'], 'select_dst_port',
-            '--', 'clear', 'Mirror', mirror['name'], 'output_port'])
-        commands.extend([
-            '--', 'set', 'Mirror', mirror['name'],
-            'name=%s' % mirror['name'],
-            'select_vlan=%s' % mirror['select_vlan'],
-            'output_vlan=%s' % mirror['output_vlan']])
-
-    ret, err = vsctl.execute(commands)
-    return get_mirrors(brname)
-
-def del_mirror(brname, data):
-    mirror = json.loads(data)
-    commands = ['--', '--id=@tmp', 'get', 'Mirror', mirror['name'],
-            '--', 'remove', 'Bridge', brname, 'mirrors', '@tmp']
-    ret, err = vsctl.execute(commands)
-    return get_mirrors(brname)
-
-def add_prefix(input):
-    if isinstance(input, str) or isinstance(input, unicode):
-        return ','.join(map(lambda x: '@'+x if x else x, input.split(',')))
-    else:
-        return map(lambda x: '@'+x, input)
-
-def port_ids(*args):
-    ports = set([])
-    for x in args:
-        if x:
-            if isinstance(x, list):
-                ports.update(x)
-            elif isinstance(x, str) or isinstance(x, unicode):
-                ports.update(x.split(','))
-    return reduce(lambda x, y: x + y, map(lambda p: ['--', '--id=@%s' % p, 'get', 'Port', p], ports))
-
-def add_mirror(brname, data):
-    mirror = json.loads(data)
-    commands = ['--', 'add', 'Bridge', brname, 'mirrors', '@tmp']
+        row["select_src_port"] = oset([])
+        row["select_dst_port"] = oset([])
+        row["output_port"] = oset([])
+    txn.update("Mirror", where, row)
+
+def _mirror_row(mirror):
+    row = {}
+    row["name"] = mirror['name']
     if mirror['output_port']:
-        ids = port_ids(mirror['select_src_port'],
-                mirror['select_dst_port'],
-                mirror['output_port'])
-        commands.extend(ids)
-        commands.extend([
-            '--', '--id=@tmp', 'create', 'mirror',
-            'name=%s' % mirror['name']])
-        if mirror['select_src_port']:
-            commands.append('select_src_port=%s' %
-                add_prefix(mirror['select_src_port']))
-        if mirror['select_dst_port']:
-            commands.append('select_dst_port=%s' %
-                add_prefix(mirror['select_dst_port']))
-        commands.append('output_port=%s' %
-            add_prefix(mirror['output_port']))
+        src = _names(mirror['select_src_port'])
+        dst = _names(mirror['select_dst_port'])
+        output = _names(mirror['output_port'])[0]
+        uuids = _lookup("Port", src + dst + [output])
+        if src:
+            row["select_src_port"] = oset(ref(uuids[p]) for p in src)
+        if dst:
+            row["select_dst_port"] = oset(ref(uuids[p]) for p in dst)
+        row["output_port"] = ref(uuids[output])
     elif mirror['output_vlan']:
-        commands.extend([
-            '--', '--id=@tmp', 'create', 'mirror',
-            'name=%s' % mirror['name'],
-            'select_vlan=%s' % mirror['select_vlan'],
-            'output_vlan=%s' % mirror['output_vlan']])
-
-    ret, err = vsctl.execute(commands)
-    return get_mirrors(brname)
-
-def add_bridge(br_name):
-    commands = ['--', 'add-br', br_name, '--', 'set', 'Bridge', \
-            br_name, 'datapath_type=system']
-    ret, err = vsctl.execute(commands)
-    return fast_get_bridges()
-
-def del_bridge(br_name):
-    command = ['--', 'del-br', br_name]
-    ret, err = vsctl.execute(command)
-    return fast_get_bridges()
-
-def add_controller(br_name, data):
-    newctrl = json.loads(data)
+        row["select_vlan"] = oset(_int_set(mirror['select_vlan']))
+        row["output_vlan"] = int(mirror['output_vlan'])
+    return row
 
+def del_mirror(brname, data, minimal=False):
+    mirror = json.loads(data)
+    error = _execute(_del_mirror_ops, brname, mirror)
+    _invalidate(brname, "Mirror")
+    return error or (_removed("mirror", mirror["name"]) \
+            if minimal else get_mirrors(brname))
+
+def _del_mirror_ops(txn, brname, mirror):
+    uuid = _lookup("Mirror", [mirror['name']])[mirror['name']]
+    where = [["name", "==", brname]]
+    txn.expect("Bridge", where + [["mirrors", "includes",
+        oset([ref(uuid)])]])
+    txn.mutate("Bridge", where, [["mirrors", "delete", oset([ref(uuid)])]])
+
+def add_mirror(brname, data, minimal=False):
+    mirror = json.loads(data)
+    error = _execute(_add_mirror_ops, brname, mirror)
+    _invalidate(brname, "Mirror")
+    return error or (_one_mirror(mirror["name"]) \
+            if minimal else get_mirrors(brname))
+
+def _add_mirror_ops(txn, brname, mirror):
+    where = [["name", "==", brname]]
+    txn.expect("Bridge", where)
+    new = txn.insert("Mirror", _mirror_row(mirror))
+    txn.mutate("Bridge", where, [["mirrors", "insert", oset([new])]])
+    return new
+
+def add_bridge(br_name, minimal=False):
+    error = _execute(_add_bridge_ops, br_name)
+    _invalidate(br_name, *_bridge_tables)
+    return error or (_one_bridge(br_name) if minimal else fast_get_bridges())
+
+def _add_bridge_ops(txn, br_name):
+    iface = txn.insert("Interface", {"name": br_name, "type": "internal"})
+    port = txn.insert("Port", {"name": br_name, "interfaces": iface})
+    new = txn.insert("Bridge", {"name": br_name, "ports": port,
+        "datapath_type": "system"})
+    txn.mutate("Open_vSwitch", [], [["bridges", "insert", oset([new])]])
+    return new
+
+def del_bridge(br_name, minimal=False):
+    error = _execute(_del_bridge_ops, br_name)
+    _invalidate(br_name, *_bridge_tables)
+    return error or (_removed("bridge", br_name) \
+            if minimal else fast_get_bridges())
+
+def _del_bridge_ops(txn, br_name):
+    uuid = _lookup("Bridge", [br_name])[br_name]
+    txn.mutate("Open_vSwitch", [], [["bridges", "delete", oset([ref(uuid)])]])
+
+def add_controller(br_name, data, minimal=False):
+    newctrl = json.loads(data)
+    result = _commit(_add_controller_ops, br_name, newctrl)
+    _invalidate(br_name, "Controller")
+    if result["ret"]:
+        return result
+    return _one_controller(result["uuid"]) if minimal \
+            else get_controllers(br_name)
+
+def _add_controller_ops(txn, br_name, newctrl):
+    where = [["name", "==", br_name]]
+    txn.expect("Bridge", where)
+    new = txn.insert("Controller", _controller_row(newctrl))
+    txn.mutate("Bridge", where, [["controller", "insert", oset([new])]])
+    return new
+
+def _controller_row(newctrl):
+    row = {}
     if newctrl["protocol"] == 'tcp' or newctrl["protocol"] == 'ssl':
         # assume newctrl["ip"] is not None
         if not newctrl["port"]:
             newctrl["port"] = 6633
-        target = ":".join([newctrl["protocol"], newctrl["ip"], str(newctrl["port"])])
+        row["target"] = ":".join([newctrl["protocol"], newctrl["ip"], str(newctrl["port"])])
     elif newctrl["protocol"] == 'ptcp' or newctrl["protocol"] == 'pssl':
         if not newctrl["port"]:
             newctrl["port"] = 6633
         # newctrl["ip"] not used
-        target = ":".join([newctrl["protocol"], str(newctrl["port"])])
-    target = 'target=%s' % ('\"' + target + '\"')
-    commands = ['--', 'add', 'Bridge', br_name, 'controller', '@new', '--',\
-            '--id=@new', 'create', 'Controller', target]
+        row["target"] = ":".join([newctrl["protocol"], str(newctrl["port"])])
 
     if newctrl["connection_mode"]:
-        connection_mode = 'connection_mode=%s' % newctrl["connection_mode"]
-        commands.append(connection_mode)
-
-    ret, err = vsctl.execute(commands)
-    return get_controllers(br_name)
+        row["connection_mode"] = newctrl["connection_mode"]
+    return row
 
-def del_controller(br_name, data):
+def del_controller(br_name, data, minimal=False):
     newctrl = json.loads(data)
-    commands = ['--', 'remove', 'Bridge', br_name, 'controller', \
-            newctrl["uuid"]]
-    ret, err = vsctl.execute(commands)
-    return get_controllers(br_name)
-
-def update_controller(br_name, data):
+    error = _execute(_del_controller_ops, br_name, newctrl)
+    _invalidate(br_name, "Controller")
+    return error or (_removed("controller", newctrl["uuid"]) \
+            if minimal else get_controllers(br_name))
+
+def _del_controller_ops(txn, br_name, newctrl):
+    where = [["name", "==", br_name]]
+    txn.expect("Bridge", where + [["controller", "includes",
+        oset([ref(newctrl["uuid"])])]])
+    txn.mutate("Bridge", where,
+            [["controller", "delete", oset([ref(newctrl["uuid"])])]])
+
+def update_controller(br_name, data, minimal=False):
     newctrl = json.loads(data)
-    if newctrl["protocol"] == 'tcp' or newctrl["protocol"] == 'ssl':
-        # assume newctrl["ip"] is not None
-        if not newctrl["port"]:
-            newctrl["port"] = 6633
-        target = ":".join([newctrl["protocol"], newctrl["ip"], str(newctrl["port"])])
-    elif newctrl["protocol"] == 'ptcp' or newctrl["protocol"] == 'pssl':
-        if not newctrl["port"]:
-            newctrl["port"] = 6633
-        # newctrl["ip"] not used
-        target = ":".join([newctrl["protocol"], str(newctrl["port"])])
-    target = 'target=%s' % ('\"' + target + '\"')
+    error = _execute(_update_controller_ops, br_name, newctrl)
+    _invalidate(br_name, "Controller")
+    return error or (_one_controller(newctrl["uuid"]) \
+            if minimal else get_controllers(br_name))
+
+def _update_controller_ops(txn, br_name, newctrl):
+    where = [["_uuid", "==", ref(newctrl["uuid"])]]
+    txn.expect("Controller", where)
+    # TODO: more columns to set
+    txn.update("Controller", where, _controller_row(newctrl))
+
+# what batch() accepts: type -> (takes the bridge name, tables it changes,
+# {op: builder})
+_batch_types = {
+    "port": (True, ("Port", "Mirror"), {"add": _add_port_ops,
+        "update": _update_port_ops, "del": _del_port_ops}),
+    "mirror": (True, ("Mirror",), {"add": _add_mirror_ops,
+        "update": _update_mirror_ops, "del": _del_mirror_ops}),
+    "controller": (True, ("Controller",), {"add": _add_controller_ops,
+        "update": _update_controller_ops, "del": _del_controller_ops}),
+    "queue": (False, ("Queue",), {"add": _add_queue_ops,
+        "update": _update_queue_ops, "del": _del_queue_ops}),
+    "qos": (False, ("QoS",), {"add": _add_qos_ops,
+        "update": _update_qos_ops, "del": _del_qos_ops}),
+    }
+
+def batch(brname, data):
+    """
+    Apply a list of operations on bridge brname as a single transaction:
 
-    commands = ['--', 'set', 'Controller', newctrl["uuid"], target]
+    [{"op": "add" | "update" | "del",
+      "type": "port" | "mirror" | "controller" | "queue" | "qos",
+      "data": what POST /bridges/<br>/<type>/.../<op> takes}, ...]
 
-    if newctrl["connection_mode"]:
-        connection_mode = 'connection_mode=%s' % newctrl["connection_mode"]
-        commands.append(connection_mode)
-    # TODO: more columns to set
-    ret, err = vsctl.execute(commands)
-    return get_controllers(br_name)
+    VLAN config and QoS bindings are port updates. Rows added by the batch
+    cannot be referred to by name from later operations of it.
+
+    Return {"ret": 0, "results": [{"ret": 0, "uuid": ...}, ...],
+    "generation": ...} with one result per operation, uuid being the uuid of
+    the row an add inserted. If any operation fails nothing is applied, and
+    the error response tells which in "op", null when the transaction as a
+    whole was refused.
+    """
+    try:
+        operations = json.loads(data)
+        if not isinstance(operations, list):
+            raise ValueError("expected a list of operations")
+    except ValueError as e:
+        return dict(ret=-2, msg="Malformed batch: %s" % e)
+    txn = transaction.Transaction()
+    starts = []
+    news = []
+    tables = set()
+    for index, operation in enumerate(operations):
+        try:
+            scoped, changes, builders = _batch_types[operation["type"]]
+            build = builders[operation["op"]]
+            args = (brname, operation["data"]) if scoped \
+                    else (operation["data"],)
+            starts.append(len(txn.ops))
+            news.append(build(txn, *args))
+        except dbclient.Error as e:
+            return dict(ret=e.ret, msg="operation %d: %s" % (index, e.msg),
+                    op=index)
+        except (KeyError, TypeError, ValueError) as e:
+            return dict(ret=-2, msg="operation %d: malformed (%s)" \
+                    % (index, e), op=index)
+        tables.update((brname if scoped else None, table) \
+                for table in changes)
+    result = txn.commit()
+    _cache.invalidate(*tables)
+    if result["ret"]:
+        if result.get("op") is not None:
+            result["op"] = bisect.bisect_right(starts, result["op"]) - 1
+        return result
+    results = []
+    for new in news:
+        uuid = None
+        if isinstance(new, list) and new[0] == "named-uuid":
+            uuid = result["uuids"][new[1]]
+        results.append(dict(ret=0, uuid=uuid))
+    return _with_generation(dict(ret=0, results=results))
 
 if __name__ == "__main__":
     print get_bridges()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+Compact records for the tables that have a row per port or per bridge.
+
+A record keeps only the decoded columns the GUI reads, in __slots__, and
+follows references on demand through the index it belongs to. Columns
+read as record.name or, like the rows of the other tables, record["name"].
+"""
+
+def refs(value):
+    """
+    uuids held by a decoded reference column, a list, a uuid or None.
+    """
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+class Record(object):
+    __slots__ = ("_uuid", "_version", "_index")
+    table = None
+    columns = ()
+    # column -> referenced table
+    references = {}
+
+    def __init__(self, row, index=None):
+        self._index = index
+        self._uuid = row.get("_uuid")
+        self._version = row.get("_version")
+        for column in self.columns:
+            setattr(self, column, row.get(column))
+
+    def __getitem__(self, column):
+        try:
+            return getattr(self, column)
+        except AttributeError:
+            raise KeyError(column)
+
+    def get(self, column, default=None):
+        return getattr(self, column, default)
+
+    def __repr__(self):
+        return "<%s %s>" % (self.table, self._uuid)
+
+    def updated(self, changes):
+        """
+        Copy of the record with the columns in changes replaced. Records
+        are shared between threads and never changed in place.
+        """
+        record = object.__new__(type(self))
+        record._index = self._index
+        record._uuid = self._uuid
+        record._version = changes.get("_version", self._version)
+        for column in self.columns:
+            setattr(record, column, changes[column] if column in changes \
+                    else getattr(self, column))
+        return record
+
+    def resolve(self, column):
+        """
+        Records or rows the column refers to, looked up when asked for.
+        """
+        table = self.references[column]
+        rows = (self._index.get(table, uuid) \
+                for uuid in refs(getattr(self, column)))
+        return [row for row in rows if row is not None]
+
+class Bridge(Record):
+    table = "Bridge"
+    columns = ("name", "datapath_id", "fail_mode", "protocols",
+            "flood_vlans", "controller", "ports", "sflow", "netflow",
+            "mirrors", "other_config", "stp_enable", "status")
+    __slots__ = columns
+    references = {"controller": "Controller", "ports": "Port",
+            "sflow": "sFlow", "netflow": "NetFlow", "mirrors": "Mirror"}
+
+class Port(Record):
+    table = "Port"
+    columns = ("name", "mac", "qos", "vlan_mode", "tag", "trunks", "status",
+            "statistics", "interfaces")
+    __slots__ = columns
+    references = {"interfaces": "Interface", "qos": "QoS"}
+
+class Interface(Record):
+    table = "Interface"
+    columns = ("name", "type", "ofport", "admin_state", "link_state",
+            "duplex", "mtu", "options", "statistics")
+    __slots__ = columns
+
+class Controller(Record):
+    table = "Controller"
+    columns = ("target", "connection_mode", "max_backoff",
+            "inactivity_probe", "enable_async_messages",
+            "controller_rate_limit", "controller_burst_limit", "local_ip",
+            "local_netmask", "local_gateway", "is_connected", "role",
+            "status")
+    __slots__ = columns
+
+classes = dict((cls.table, cls) for cls in (Bridge, Port, Interface,
+    Controller))
+
+def wrap(table, row, index=None):
+    """
+    Turn a decoded row of table into a record, if the table has a class.
+    """
+    cls = classes.get(table)
+    if cls is None or isinstance(row, Record):
+        return row
+    return cls(row, index)
@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+import collections
+import threading
+import time
+import traceback
+import jsonrpc
+import clientWrapper as dbclient
+import records
+import schema
+
+dbname = "Open_vSwitch"
+
+tables = ["Open_vSwitch", "Bridge", "Port", "Interface", "Controller",
+        "Mirror", "QoS", "Queue", "sFlow", "NetFlow"]
+
+# seconds of silence before the monitor session is probed with echo
+probe_interval = 15
+
+# seconds to wait before reconnecting after the monitor session failed
+backoff = 2
+
+# row changes kept for changes(), the oldest are dropped first
+journal_size = 4096
+
+# columns ovs-vswitchd rewrites on every counter refresh; a row change
+# touching only these is not journaled, the sampler serves the counters
+volatile = ("statistics",)
+
+def _canon(value):
+    """
+    Turn a decoded column value into a frozenset, so that the scalar 5, the
+    list [5] and, for an empty optional column, None and [] compare equal.
+    """
+    if value is None:
+        return frozenset()
+    if isinstance(value, list):
+        return frozenset(value)
+    if isinstance(value, dict):
+        return frozenset(value.iteritems())
+    return frozenset([value])
+
+def _match(row, condition):
+    column, function, value = condition
+    current = row[column]
+    value = schema.generic(value)
+    if function == "==":
+        return _canon(current) == _canon(value)
+    elif function == "!=":
+        return _canon(current) != _canon(value)
+    elif function == "includes":
+        return _canon(value) <= _canon(current)
+    elif function == "excludes":
+        return not (_canon(value) & _canon(current))
+    elif function == "<":
+        return current < value
+    elif function == "<=":
+        return current <= value
+    elif function == ">":
+        return current > value
+    elif function == ">=":
+        return current >= value
+    raise KeyError(function)
+
+def _changed(old, new):
+    """
+    Whether new changes a column old keeps, other than the volatile ones.
+    """
+    columns = old.columns if isinstance(old, records.Record) else old.keys()
+    for column in columns:
+        if column in new and not column.startswith("_") \
+                and column not in volatile and old[column] != new[column]:
+            return True
+    return False
+
+class Replica(object):
+    """
+    In-memory copy of the tables the GUI reads, kept current through an
+    OVSDB monitor subscription.
+
+    Rows are stored decoded, as records.Record for the tables records.py
+    covers and as dicts otherwise, and every applied update bumps
+    self.generation. Records hold only their columns, so only those are
+    monitored for their tables.
+
+    Monitors do not carry _version, so a row gets the generation of the
+    update that last changed it as its _version instead.
+
+    The last journal_size row changes are journaled with their generation,
+    see changes(), except changes to volatile columns only.
+    """
+    def __init__(self, target=None, tables=tables):
+        self.target = target or dbclient.database
+        self.tables = tables
+        self.data = dict((table, {}) for table in tables)
+        self.schema = None
+        self.generation = 0
+        # (generation, table, uuid, "insert" | "modify" | "delete", row),
+        # row is the deleted row for deletes; every change after generation
+        # journal_start is in it
+        self.journal = collections.deque()
+        self.journal_start = 0
+        self.updated = None
+        self.synced = False
+        self.cond = threading.Condition()
+        self.send_lock = threading.Lock()
+        self.session = None
+        self.barrier = 0
+        self.acked = 0
+        self.thread = None
+        self.stopped = False
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run,
+                    name="ovsdb-replica")
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+        if self.session:
+            self.session.shutdown()
+
+    def run(self):
+        while not self.stopped:
+            try:
+                self.schema = dbclient.get_schema(self.target, dbname)
+                self.session = jsonrpc.Session(self.target, probe_interval)
+                self._send({"method": "monitor", "id": "monitor",
+                    "params": [dbname, "replica", self._requests()]})
+                self._loop()
+            except (jsonrpc.Error, dbclient.Error):
+                pass
+            except Exception:
+                # e.g. an update the replica can not apply, start over
+                traceback.print_exc()
+            finally:
+                with self.cond:
+                    self.synced = False
+                    self.cond.notify_all()
+                if self.session:
+                    self.session.close()
+            if not self.stopped:
+                time.sleep(backoff)
+
+    def _requests(self):
+        requests = {}
+        for table in self.tables:
+            cls = records.classes.get(table)
+            requests[table] = {"columns": list(cls.columns)} if cls else {}
+        return requests
+
+    def _send(self, msg):
+        with self.send_lock:
+            self.session.send(msg)
+
+    def _loop(self):
+        probing = False
+        while True:
+            try:
+                msg = self.session.recv()
+            except jsonrpc.Timeout:
+                if probing:
+                    raise jsonrpc.Error("%s: echo unanswered" % self.target)
+                probing = True
+                self._send({"method": "echo", "params": [], "id": "probe"})
+                continue
+            probing = False
+            method = msg.get("method")
+            if method == "update":
+                self._apply(msg["params"][1])
+            elif method == "echo":
+                self._send({"id": msg["id"], "result": msg["params"],
+                    "error": None})
+            elif msg.get("id") == "monitor":
+                if msg.get("error") is not None:
+                    raise jsonrpc.Error(str(msg["error"]))
+                self._apply(msg["result"], reset=True)
+            elif isinstance(msg.get("id"), int):
+                with self.cond:
+                    self.acked = msg["id"]
+                    self.cond.notify_all()
+
+    def _apply(self, updates, reset=False):
+        with self.cond:
+            generation = self.generation + 1
+            if reset:
+                self.data = dict((table, {}) for table in self.tables)
+                self.journal.clear()
+                self.journal_start = generation
+            version = str(generation)
+            for table, rows in updates.iteritems():
+                data = self.data.setdefault(table, {})
+                for uuid, change in rows.iteritems():
+                    new = change.get("new")
+                    if new is None:
+                        old = data.pop(uuid, None)
+                        if old is not None and not reset:
+                            self._journal(generation, table, uuid, "delete",
+                                    old)
+                        continue
+                    new = self.schema.decode(table, new)
+                    new["_version"] = version
+                    # rows are never changed in place, readers may hold them
+                    old = data.get(uuid)
+                    if not reset and (old is None or _changed(old, new)):
+                        self._journal(generation, table, uuid,
+                                "insert" if old is None else "modify")
+                    if old is None:
+                        new["_uuid"] = uuid
+                        data[uuid] = records.wrap(table, new, self)
+                    elif isinstance(old, records.Record):
+                        data[uuid] = old.updated(new)
+                    else:
+                        row = dict(old)
+                        row.update(new)
+                        data[uuid] = row
+            self.generation = generation
+            self.updated = time.time()
+            if reset:
+                self.synced = True
+            self.cond.notify_all()
+
+    def _journal(self, generation, table, uuid, op, row=None):
+        if len(self.journal) >= journal_size:
+            self.journal_start = self.journal.popleft()[0]
+        self.journal.append((generation, table, uuid, op, row))
+
+    def changes(self, since):
+        """
+        Return (generation, {table: {uuid: (op, row)}}) with the rows
+        changed after generation since, op the net effect of all their
+        changes, "insert", "modify" or "delete", and row the deleted row for
+        deletes. Rows both inserted and deleted since are left out. Return
+        None if the journal no longer reaches back to since, the caller then
+        has to read everything again.
+        """
+        with self.cond:
+            if not self.synced or since < self.journal_start \
+                    or since > self.generation:
+                return None
+            changed = {}
+            for generation, table, uuid, op, row in reversed(self.journal):
+                if generation <= since:
+                    break
+                ops = changed.setdefault(table, {})
+                last = ops.get(uuid)
+                if last is None:
+                    ops[uuid] = (op, row)
+                elif op == "insert":
+                    # inserted since: new to the caller, if still there
+                    if last[0] == "delete":
+                        del ops[uuid]
+                    else:
+                        ops[uuid] = ("insert", None)
+            return self.generation, changed
+
+    def wait(self, generation, timeout):
+        """
+        Block until an update after generation is applied, the replica
+        loses its sync or timeout seconds pass. Return the generation.
+        """
+        deadline = time.time() + timeout
+        with self.cond:
+            while self.synced and self.generation <= generation:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            return self.generation
+
+    def sync(self, timeout=dbclient.timeout):
+        """
+        Wait until every change committed so far has been applied.
+
+        ovsdb-server answers the echo on the monitor session only after the
+        updates queued before it, so the reply works as a barrier. Return
+        False if the replica is not usable; it then resynchronizes.
+        """
+        with self.cond:
+            if not self.synced:
+                return False
+            self.barrier += 1
+            barrier = self.barrier
+        try:
+            self._send({"method": "echo", "params": [], "id": barrier})
+        except jsonrpc.Error:
+            return False
+        deadline = time.time() + timeout
+        with self.cond:
+            while self.synced and self.acked < barrier:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            done = self.synced and self.acked >= barrier
+        if not done:
+            self.session.shutdown()
+        return done
+
+    def transact(self, params):
+        """
+        Answer a transact made only of selects on replicated tables with one
+        list of rows per operation. Return None for anything else, so the
+        caller falls back to ovsdb-server.
+        """
+        if not self.synced or len(params) < 2 or params[0] != dbname:
+            return None
+        for op in params[1:]:
+            if not isinstance(op, dict) or op.get("op") != "select" \
+                    or op.get("table") not in self.tables:
+                return None
+        with self.cond:
+            if not self.synced:
+                return None
+            try:
+                return [self._select(op) for op in params[1:]]
+            except (KeyError, IndexError, TypeError, ValueError,
+                    AttributeError):
+                return None
+
+    def _select(self, op):
+        """
+        Records are returned as they are, they are never changed in place.
+        """
+        data = self.data[op["table"]]
+        where = op.get("where", [])
+        cls = records.classes.get(op["table"])
+        if cls is not None:
+            # a record cannot answer for columns it does not keep
+            known = set(cls.columns + ("_uuid", "_version"))
+            if "columns" not in op or not known.issuperset(op["columns"]) \
+                    or not known.issuperset(c[0] for c in where):
+                raise KeyError(op["table"])
+        if where and where[0][0] == "_uuid" and where[0][1] == "==":
+            row = data.get(schema.generic(where[0][2]))
+            rows = [row] if row else []
+            where = where[1:]
+        else:
+            rows = data.itervalues()
+        rows = [row for row in rows \
+                if all(_match(row, condition) for condition in where)]
+        if cls is not None:
+            return rows
+        if "columns" in op:
+            return [dict((column, row[column]) for column in op["columns"]) \
+                    for row in rows]
+        return [dict(row) for row in rows]
+
+    def get(self, table, uuid):
+        """
+        Row of table by uuid, records resolve their references here.
+        """
+        return self.data.get(table, {}).get(uuid)
+
+    def status(self):
+        return dict(synced=self.synced, generation=self.generation,
+                updated=self.updated, target=self.target)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+import heapq
+import threading
+import time
+import simplejson as json
+import clientWrapper as dbclient
+from records import refs
+
+# seconds between two samples; ovs-vswitchd refreshes Interface.statistics
+# every 5 seconds by default, sampling faster only repeats its values
+interval = 5
+
+# (Interface.statistics counter, rate, factor), rates are per second
+rates = [("rx_packets", "rx_pps", 1), ("tx_packets", "tx_pps", 1),
+        ("rx_bytes", "rx_bps", 8), ("tx_bytes", "tx_bps", 8),
+        ("rx_dropped", "rx_dropped_ps", 1),
+        ("tx_dropped", "tx_dropped_ps", 1),
+        ("rx_errors", "rx_errors_ps", 1), ("tx_errors", "tx_errors_ps", 1)]
+
+# a single transact reads the statistics of every interface, the STP
+# counters of every port and the bridge and port names they belong to
+_transact = json.dumps(["Open_vSwitch",
+    {"op": "select", "table": "Bridge", "where": [],
+        "columns": ["name", "ports"]},
+    {"op": "select", "table": "Port", "where": [],
+        "columns": ["_uuid", "name", "interfaces", "statistics"]},
+    {"op": "select", "table": "Interface", "where": [],
+        "columns": ["_uuid", "statistics"]}])
+
+def _rate(counter, factor, before, counters, elapsed):
+    if counter in counters and counter in before \
+            and counters[counter] >= before[counter]:
+        return factor * (counters[counter] - before[counter]) / elapsed
+    return None
+
+class Sampler(object):
+    """
+    Reads the statistics of all interfaces every interval seconds in one
+    transact, from the replica when one is attached, and keeps the last two
+    samples to derive per-port rates from. However many clients ask for
+    rates, the database is read once per interval.
+
+    A sample is (time, {brname: {portname: counters}}), counters holding the
+    Interface and Port statistics. Every sample is also added to history, a
+    history.History, if one is given.
+    """
+    def __init__(self, target=None, interval=interval,
+            history=None):
+        self.target = target or dbclient.database
+        self.interval = interval
+        self.history = history
+        self.lock = threading.Lock()
+        self.previous = None
+        self.current = None
+        self.samples = 0
+        self.errors = 0
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run,
+                    name="stats-sampler")
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            started = time.time()
+            try:
+                self.sample()
+            except Exception:
+                # whatever went wrong, the next interval samples again
+                with self.lock:
+                    self.errors += 1
+            self.stopped.wait(max(0, self.interval -
+                (time.time() - started)))
+
+    def sample(self):
+        cur = dbclient.connect(self.target).cursor()
+        cur.execute(_transact)
+        bridges = cur.fetchall()
+        cur.nextset()
+        ports = dict((row["_uuid"], row) for row in cur.fetchall())
+        cur.nextset()
+        stats = dict((row["_uuid"], row["statistics"]) \
+                for row in cur.fetchall())
+        now = time.time()
+        data = {}
+        for bridge in bridges:
+            counters = data[bridge["name"]] = {}
+            for uuid in refs(bridge["ports"]):
+                port = ports.get(uuid)
+                # FIXME assuming one-to-one mapping between iface and port
+                ifaces = refs(port["interfaces"]) if port else []
+                if ifaces and ifaces[0] in stats:
+                    port_counters = dict(port["statistics"])
+                    port_counters.update(stats[ifaces[0]])
+                    counters[port["name"]] = port_counters
+        with self.lock:
+            self.previous, self.current = self.current, (now, data)
+            self.samples += 1
+        if self.history is not None:
+            self.history.add(now, data)
+
+    def rates(self, brname):
+        """
+        Return (time, seconds between the samples, {portname: {rate:
+        value}}) for the ports of bridge brname, None before two samples
+        were taken. A rate is None when its counter is missing or went
+        backwards, as it does when an interface is reset.
+        """
+        with self.lock:
+            if self.previous is None:
+                return None
+            (then, old), (now, new) = self.previous, self.current
+        old = old.get(brname, {})
+        elapsed = now - then
+        ports = {}
+        for name, counters in new.get(brname, {}).iteritems():
+            before = old.get(name, {})
+            ports[name] = dict((rate, _rate(counter, factor, before,
+                counters, elapsed)) for counter, rate, factor in rates)
+        return now, elapsed, ports
+
+    def top(self, metric, n, brname=None):
+        """
+        Return (time, [(value, brname, portname)]) for the n ports with the
+        largest value of metric, a rate or a counter, over bridge brname or
+        every bridge, largest first. Ports without a value are left out.
+        Only metric is computed, and a heap picks the n ports without
+        sorting them all. time is None before the samples it needs.
+        """
+        with self.lock:
+            previous, current = self.previous, self.current
+        by_rate = dict((rate, (counter, factor)) \
+                for counter, rate, factor in rates)
+        if current is None or (metric in by_rate and previous is None):
+            return None, []
+        now, new = current
+        bridges = [brname] if brname is not None else list(new)
+        if metric in by_rate:
+            counter, factor = by_rate[metric]
+            then, old = previous
+            values = ((_rate(counter, factor,
+                old.get(br, {}).get(name, {}), counters, now - then), br,
+                name) for br in bridges \
+                for name, counters in new.get(br, {}).iteritems())
+        else:
+            values = ((counters.get(metric), br, name) for br in bridges \
+                for name, counters in new.get(br, {}).iteritems())
+        return now, heapq.nlargest(n, (value for value in values \
+                if value[0] is not None))
+
+    def status(self):
+        with self.lock:
+            return dict(interval=self.interval, samples=self.samples,
+                    errors=self.errors,
+                    updated=self.current[0] if self.current else None)
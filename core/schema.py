@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Row decoders compiled from the database schema.
+
+Every column gets a function chosen once from its type, which turns the
+OVSDB notation of a value straight into the Python value:
+
+  atom                    value, a uuid as its string
+  optional (max 1)        value or None
+  set                     list
+  map                     dict
+
+Columns whose type is unknown are decoded by generic(), which looks at the
+notation of every value instead.
+"""
+
+def _uuid(value):
+    return value[1]
+
+def _atom(base):
+    """
+    Decoder of one atom, None when the atom is used as is.
+    """
+    if base == "uuid" or (isinstance(base, dict) and base["type"] == "uuid"):
+        return _uuid
+    return None
+
+def _optional(atom):
+    def decode(value):
+        if isinstance(value, list) and value[0] == "set":
+            if not value[1]:
+                return None
+            value = value[1][0]
+        return atom(value) if atom else value
+    return decode
+
+def _set(atom):
+    def decode(value):
+        if isinstance(value, list) and value[0] == "set":
+            if atom:
+                return [atom(x) for x in value[1]]
+            return value[1]
+        return [atom(value) if atom else value]
+    return decode
+
+def _map(key, atom):
+    if key is None and atom is None:
+        return lambda value: dict(value[1])
+    key = key or (lambda x: x)
+    atom = atom or (lambda x: x)
+    return lambda value: dict((key(k), atom(v)) for k, v in value[1])
+
+def column_decoder(type):
+    """
+    Return the decoder for a column type of the schema, None if values of
+    the column need no decoding at all.
+    """
+    if not isinstance(type, dict):
+        return _atom(type)
+    key = _atom(type["key"])
+    if "value" in type:
+        return _map(key, _atom(type["value"]))
+    minimum = type.get("min", 1)
+    maximum = type.get("max", 1)
+    if minimum == 1 and maximum == 1:
+        return key
+    if maximum == 1:
+        return _optional(key)
+    return _set(key)
+
+def generic(value):
+    if isinstance(value, list):
+        if value[0] == "uuid":
+            return value[1]
+        if value[0] == "set":
+            return [generic(x) for x in value[1]]
+        if value[0] == "map":
+            return dict((generic(k), generic(v)) for k, v in value[1])
+    return value
+
+class Schema(object):
+    """
+    Decoders for every column of every table of a get_schema reply.
+    """
+    def __init__(self, schema):
+        self.name = schema.get("name")
+        self.version = schema.get("version")
+        self.tables = {}
+        for table, table_schema in schema.get("tables", {}).iteritems():
+            decoders = {"_uuid": _uuid, "_version": _uuid}
+            for column, column_schema \
+                    in table_schema["columns"].iteritems():
+                decoders[column] = column_decoder(column_schema["type"])
+            self.tables[table] = decoders
+
+    def decode(self, table, row):
+        """
+        Decode the columns of row in place and return it.
+        """
+        decoders = self.tables.get(table)
+        if decoders is None:
+            for column, value in row.iteritems():
+                row[column] = generic(value)
+            return row
+        for column, value in row.iteritems():
+            decode = decoders.get(column, generic)
+            if decode is not None:
+                row[column] = decode(value)
+        return row
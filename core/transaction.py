@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+import simplejson as json
+import clientWrapper as dbclient
+import jsonrpc
+
+dbname = "Open_vSwitch"
+
+class TransactionError(dbclient.Error):
+    def __init__(self, ret, msg):
+        self.ret = ret
+        self.msg = msg
+
+def ref(uuid):
+    """
+    uuid is either a uuid string or a reference returned by insert().
+    """
+    return uuid if isinstance(uuid, list) else ["uuid", uuid]
+
+def oset(values):
+    return ["set", list(values)]
+
+def omap(pairs):
+    if isinstance(pairs, dict):
+        pairs = pairs.iteritems()
+    return ["map", [[key, value] for key, value in pairs]]
+
+class Transaction(object):
+    """
+    Collect OVSDB operations and commit them atomically in one transact.
+
+    txn = Transaction()
+    iface = txn.insert("Interface", {"name":"eth1", "type":"system"})
+    port = txn.insert("Port", {"name":"eth1", "interfaces":iface})
+    txn.mutate("Bridge", [["name", "==", "br0"]],
+            [["ports", "insert", oset([port])]])
+    result = txn.commit()
+    """
+    def __init__(self, target=None):
+        self.target = target or dbclient.database
+        self.ops = []
+        self.names = []
+
+    def insert(self, table, row, name=None):
+        """
+        Return a named-uuid reference to the new row, usable in the other
+        operations of this transaction.
+        """
+        if name is None:
+            name = "row%d" % len(self.ops)
+        self.ops.append({"op": "insert", "table": table, "row": row,
+            "uuid-name": name})
+        self.names.append(name)
+        return ["named-uuid", name]
+
+    def update(self, table, where, row):
+        self.ops.append({"op": "update", "table": table, "where": where,
+            "row": row})
+
+    def mutate(self, table, where, mutations):
+        self.ops.append({"op": "mutate", "table": table, "where": where,
+            "mutations": mutations})
+
+    def delete(self, table, where):
+        self.ops.append({"op": "delete", "table": table, "where": where})
+
+    def expect(self, table, where):
+        """
+        Abort the transaction unless a row matches where.
+        """
+        self.ops.append({"op": "wait", "timeout": 0, "table": table,
+            "where": where, "columns": ["_uuid"], "until": "!=", "rows": []})
+
+    def set_keys(self, table, where, column, pairs):
+        """
+        Set keys of a map column, removing the keys whose value is None or
+        empty, like 'set table row column:key=value' and 'remove'.
+        """
+        values = dict((key, value if isinstance(value, basestring) \
+                else str(value)) for key, value in pairs.iteritems() \
+                if value is not None and value != "")
+        mutations = [[column, "delete", oset(pairs.keys())]]
+        if values:
+            mutations.append([column, "insert", omap(values)])
+        self.mutate(table, where, mutations)
+
+    def commit(self):
+        """
+        Return {"ret":0, "uuids":{name:uuid}, "counts":[...]} on success, or
+        {"ret":<0, "msg":..., "op":index} describing the failed operation,
+        index None when the commit as a whole failed, e.g. on a dangling
+        reference.
+        """
+        if not self.ops:
+            return dict(ret=0, uuids={}, counts=[])
+        pool = dbclient.get_pool(self.target)
+        try:
+            session = pool.get()
+        except dbclient.DatabaseError as e:
+            return dict(ret=e.ret, msg=e.msg)
+        broken = True
+        try:
+            results = session.transact([dbname] + self.ops)
+            broken = False
+        except jsonrpc.ReplyError as e:
+            broken = False
+            return dict(ret=-3, msg=e.msg)
+        except jsonrpc.Error as e:
+            return dict(ret=-3, msg=e.msg)
+        except ValueError as e:
+            return dict(ret=-3, msg="%s: %s" % (self.target, e))
+        finally:
+            pool.put(session, broken=broken)
+
+        for index, result in enumerate(results):
+            if result and "error" in result:
+                op = self.ops[index] if index < len(self.ops) else None
+                if op and op["op"] == "wait":
+                    msg = "%s: no row matching %s" % (op["table"],
+                            json.dumps(op["where"]))
+                else:
+                    msg = result["error"]
+                    if result.get("details"):
+                        msg += ": " + result["details"]
+                # ovsdb-server reports commit errors after the results
+                # of all operations
+                return dict(ret=-4, msg=msg, op=index if op else None)
+
+        dbclient.sync_replica()
+        uuids = {}
+        counts = []
+        for op, result in zip(self.ops, results):
+            if op["op"] == "insert":
+                uuids[op["uuid-name"]] = result["uuid"][1]
+            counts.append(result.get("count") if result else None)
+        return dict(ret=0, uuids=uuids, counts=counts)
@@ -0,0 +1,631 @@
+#!/usr/bin/env python
+"""
+A minimal ovsdb-server for tests.
+
+FakeOvsdb listens on a local TCP port and speaks enough OVSDB JSON-RPC for
+clientWrapper, jsonrpc, transaction and replica: get_schema, echo, monitor
+and transact with select, insert, update, mutate, delete, wait and comment.
+Rows live in memory in OVSDB notation. A transact is applied only if every
+operation succeeds and no strong reference dangles; rows of non-root
+tables it leaves unreferenced are then removed, as ovsdb-server does, and
+monitors are told about every change. insert(), update() and delete()
+change rows the way another client or ovs-vswitchd would.
+
+A few knobs make it misbehave the way a real server or network can:
+
+  chunk     send every message in pieces of chunk bytes, one send each
+  probe     send an echo request ahead of every reply, as ovsdb-server
+            probes idle clients; the answers end up in echo_replies
+  hangup    close the connection instead of answering the next n requests
+  garbage   answer the next n requests with a reply that is not JSON
+  delay     wait that many seconds before answering the next request
+
+server = FakeOvsdb(seed())
+cur = clientWrapper.connect(server.target).cursor()
+"""
+import collections
+import copy
+import socket
+import threading
+import time
+import uuid
+import simplejson as json
+
+dbname = "Open_vSwitch"
+
+def _optional(key):
+    return {"key": key, "min": 0, "max": 1}
+
+def _set(key, minimum=0):
+    return {"key": key, "min": minimum, "max": "unlimited"}
+
+def _map(key="string", value="string"):
+    return {"key": key, "value": value, "min": 0, "max": "unlimited"}
+
+def _ref(table, strength="strong"):
+    return {"type": "uuid", "refTable": table, "refType": strength}
+
+# the columns of vswitch.ovsschema ovsdb.py reads and writes
+_tables = {
+    "Open_vSwitch": {"bridges": _set(_ref("Bridge")),
+        "ovs_version": _optional("string"), "external_ids": _map()},
+    "Bridge": {"name": "string", "datapath_type": "string",
+        "datapath_id": _optional("string"),
+        "fail_mode": _optional("string"), "protocols": _set("string"),
+        "flood_vlans": _set("integer"),
+        "controller": _set(_ref("Controller")),
+        "ports": _set(_ref("Port")), "sflow": _optional(_ref("sFlow")),
+        "netflow": _optional(_ref("NetFlow")),
+        "mirrors": _set(_ref("Mirror")), "other_config": _map(),
+        "status": _map(), "stp_enable": "boolean",
+        "external_ids": _map()},
+    "Port": {"name": "string", "interfaces": _set(_ref("Interface"), 1),
+        "mac": _optional("string"), "qos": _optional(_ref("QoS")),
+        "vlan_mode": _optional("string"), "tag": _optional("integer"),
+        "trunks": _set("integer"), "status": _map(),
+        "statistics": _map("string", "integer"), "other_config": _map(),
+        "external_ids": _map()},
+    "Interface": {"name": "string", "type": "string",
+        "ofport": _optional("integer"), "admin_state": _optional("string"),
+        "link_state": _optional("string"), "duplex": _optional("string"),
+        "mtu": _optional("integer"), "options": _map(), "status": _map(),
+        "statistics": _map("string", "integer"), "external_ids": _map()},
+    "Controller": {"target": "string",
+        "connection_mode": _optional("string"),
+        "max_backoff": _optional("integer"),
+        "inactivity_probe": _optional("integer"),
+        "enable_async_messages": _optional("boolean"),
+        "controller_rate_limit": _optional("integer"),
+        "controller_burst_limit": _optional("integer"),
+        "local_ip": _optional("string"), "local_netmask": _optional("string"),
+        "local_gateway": _optional("string"), "is_connected": "boolean",
+        "role": _optional("string"), "status": _map(),
+        "other_config": _map(), "external_ids": _map()},
+    "Mirror": {"name": "string", "select_all": "boolean",
+        "select_src_port": _set(_ref("Port", "weak")),
+        "select_dst_port": _set(_ref("Port", "weak")),
+        "select_vlan": _set("integer"),
+        "output_port": _optional(_ref("Port", "weak")),
+        "output_vlan": _optional("integer"),
+        "statistics": _map("string", "integer"), "external_ids": _map()},
+    "sFlow": {"agent": _optional("string"), "header": _optional("integer"),
+        "polling": _optional("integer"), "sampling": _optional("integer"),
+        "targets": _set("string", 1), "external_ids": _map()},
+    "NetFlow": {"active_timeout": "integer", "targets": _set("string", 1),
+        "engine_id": _optional("integer"),
+        "engine_type": _optional("integer"),
+        "add_id_to_interface": "boolean", "external_ids": _map()},
+    "QoS": {"type": "string", "queues": _map("integer", _ref("Queue")),
+        "other_config": _map(), "external_ids": _map()},
+    "Queue": {"dscp": _optional("integer"), "other_config": _map(),
+        "external_ids": _map()},
+    }
+
+_roots = ("Open_vSwitch", "QoS", "Queue")
+
+schema = {"name": dbname, "version": "7.0.0", "tables": dict((table,
+    {"columns": dict((column, {"type": type}) \
+        for column, type in columns.iteritems()),
+     "isRoot": table in _roots}) for table, columns in _tables.iteritems())}
+
+def counters(packets):
+    """
+    Interface statistics after packets packets of 100 bytes each way.
+    """
+    return ["map", [["rx_packets", packets], ["rx_bytes", 100 * packets],
+        ["tx_packets", packets], ["tx_bytes", 100 * packets]] \
+        + [[name, 0] for name in ("rx_dropped", "tx_dropped", "rx_errors",
+            "tx_errors", "rx_frame_err", "rx_over_err", "rx_crc_err",
+            "collisions")]]
+
+def seed(nports=3):
+    """
+    Rows of a switch with bridge br0: ports eth0 to eth<nports-1> with
+    counters, a LAG, a controller, a mirror, an sFlow agent and a QoS with
+    one queue, in the order FakeOvsdb inserts them.
+    """
+    rows = []
+    ports = []
+    for i in xrange(nports):
+        name = "eth%d" % i
+        iface = "iface%d" % i
+        rows.append(("Interface", iface, {"name": name, "type": "",
+            "ofport": i + 1, "admin_state": "up", "link_state": "up",
+            "duplex": "full", "mtu": 1500,
+            "statistics": counters(10 * i)}))
+        rows.append(("Port", name, {"name": name,
+            "interfaces": ["named-uuid", iface], "vlan_mode": "access",
+            "tag": 10 + i}))
+        ports.append(name)
+    rows.append(("Interface", "ilag", {"name": "lag1", "type": "pica8_lag",
+        "ofport": 100, "options": ["map", [["lag_type", "lacp"]]],
+        "statistics": counters(0)}))
+    rows.append(("Port", "lag1", {"name": "lag1",
+        "interfaces": ["named-uuid", "ilag"], "trunks": ["set", [1, 2]]}))
+    ports.append("lag1")
+    rows.append(("Controller", "ctl", {"target": "tcp:10.0.0.1:6633",
+        "status": ["map", [["state", "BACKOFF"]]]}))
+    rows.append(("Mirror", "m1", {"name": "m1",
+        "select_src_port": ["named-uuid", ports[0]],
+        "output_port": ["named-uuid", ports[-2]]}))
+    rows.append(("sFlow", "sflow", {"agent": "eth0", "polling": 10,
+        "targets": "10.0.0.2:6343"}))
+    rows.append(("Queue", "q0", {"other_config": ["map",
+        [["min-rate", "1000"]]]}))
+    rows.append(("QoS", "qos", {"type": "linux-htb",
+        "queues": ["map", [[0, ["named-uuid", "q0"]]]]}))
+    rows.append(("Bridge", "br0", {"name": "br0",
+        "datapath_id": "0000000000000001", "datapath_type": "system",
+        "controller": ["named-uuid", "ctl"],
+        "ports": ["set", [["named-uuid", name] for name in ports]],
+        "mirrors": ["named-uuid", "m1"], "sflow": ["named-uuid", "sflow"]}))
+    rows.append(("Open_vSwitch", "ovs", {"bridges": ["named-uuid", "br0"],
+        "ovs_version": "1.10"}))
+    return rows
+
+def _default(type):
+    if isinstance(type, dict):
+        if "value" in type:
+            return ["map", []]
+        if type.get("min", 1) == 0:
+            return ["set", []]
+        type = type["key"]
+    if isinstance(type, dict):
+        type = type["type"]
+    return {"string": "", "integer": 0, "real": 0.0,
+            "boolean": False}.get(type, ["set", []])
+
+def _atoms(value):
+    """
+    Set and map values as lists of atoms or pairs, atoms as one-item lists.
+    """
+    if isinstance(value, list) and value and value[0] in ("set", "map"):
+        return value[1]
+    return [value]
+
+def _same(a, b):
+    return sorted(_atoms(a)) == sorted(_atoms(b))
+
+def _refs(type, value):
+    """
+    uuids value holds in a column of type, and whether they are weak.
+    """
+    if not isinstance(type, dict):
+        return [], False
+    for part in ("key", "value"):
+        base = type.get(part)
+        if isinstance(base, dict) and "refTable" in base:
+            atoms = _atoms(value)
+            if "value" in type:
+                atoms = [pair[part == "value"] for pair in atoms]
+            return [atom[1] for atom in atoms \
+                    if isinstance(atom, list) and atom[0] == "uuid"], \
+                    base.get("refType") == "weak"
+    return [], False
+
+def _referenced(tables):
+    """
+    uuids of the rows some row refers to strongly.
+    """
+    referenced = set()
+    for table, rows in tables.iteritems():
+        for row in rows.itervalues():
+            for column, type in _tables[table].iteritems():
+                refs, weak = _refs(type, row[column])
+                if not weak:
+                    referenced.update(refs)
+    return referenced
+
+def _error(error, details):
+    return {"error": error, "details": details}
+
+class _Failed(Exception):
+    def __init__(self, result):
+        Exception.__init__(self, result["error"])
+        self.result = result
+
+class _Connection(object):
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+        # monitor id -> {table: columns}
+        self.monitors = {}
+
+class FakeOvsdb(object):
+    def __init__(self, rows=None, chunk=None, probe=False):
+        """
+        rows is a list of (table, name, row) or a dict of {table: [row]};
+        named-uuid values in rows refer to the names of earlier rows.
+        """
+        self.tables = dict((table, collections.OrderedDict()) \
+                for table in _tables)
+        self.lock = threading.RLock()
+        self.connections = []
+        # uuids of the named rows
+        self.uuids = {}
+        if isinstance(rows, dict):
+            rows = [(table, None, row) for table, table_rows \
+                    in rows.iteritems() for row in table_rows]
+        for table, name, row in rows or []:
+            rowid = self.insert(table, self._named(row, self.uuids))
+            if name is not None:
+                self.uuids[name] = rowid
+        self.chunk = chunk
+        self.probe = probe
+        self.hangup = 0
+        self.garbage = 0
+        self.delay = None
+        # methods of every request received, and every answer to a probe
+        self.requests = []
+        self.echo_replies = []
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(5)
+        self.target = "tcp:127.0.0.1:%d" % self.listener.getsockname()[1]
+        thread = threading.Thread(target=self.serve, name="fake-ovsdb")
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        self.listener.close()
+        with self.lock:
+            connections = list(self.connections)
+        for conn in connections:
+            try:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    # changes made by someone else than the client under test
+
+    def insert(self, table, row):
+        """
+        Add row, in OVSDB notation, to table and return its uuid. Rows
+        inserted this way are not checked nor collected.
+        """
+        rowid = str(uuid.uuid4())
+        full = dict((column, _default(type)) \
+                for column, type in _tables[table].iteritems())
+        full.update(row)
+        full["_uuid"] = ["uuid", rowid]
+        full["_version"] = ["uuid", str(uuid.uuid4())]
+        with self.lock:
+            old = copy.deepcopy(self.tables)
+            self.tables[table][rowid] = full
+            self._notify(old)
+        return rowid
+
+    def update(self, table, rowid, row):
+        return self.transact([{"op": "update", "table": table,
+            "where": [["_uuid", "==", ["uuid", rowid]]], "row": row}])
+
+    def delete(self, table, rowid):
+        return self.transact([{"op": "delete", "table": table,
+            "where": [["_uuid", "==", ["uuid", rowid]]]}])
+
+    def row(self, table, rowid):
+        return self.tables[table].get(rowid)
+
+    def transact(self, ops):
+        """
+        Apply ops atomically and return their results, one more result
+        holding the error if the commit itself fails.
+        """
+        with self.lock:
+            tables = copy.deepcopy(self.tables)
+            named = dict((op["uuid-name"], str(uuid.uuid4())) for op in ops \
+                    if op.get("op") == "insert" and "uuid-name" in op)
+            results = []
+            try:
+                for op in ops:
+                    results.append(self._operation(tables,
+                        self._named(op, named), named))
+                self._commit(self.tables, tables)
+            except _Failed as e:
+                results.append(e.result)
+                return results
+            old, self.tables = self.tables, tables
+            self._notify(old)
+            return results
+
+    # connections
+
+    def serve(self):
+        while True:
+            try:
+                sock, address = self.listener.accept()
+            except socket.error:
+                return
+            thread = threading.Thread(target=self.handle,
+                    args=(_Connection(sock),))
+            thread.daemon = True
+            thread.start()
+
+    def handle(self, conn):
+        with self.lock:
+            self.connections.append(conn)
+        decoder = json.JSONDecoder()
+        buf = ""
+        try:
+            while True:
+                data = conn.sock.recv(65536)
+                if not data:
+                    return
+                buf += data
+                while True:
+                    buf = buf.lstrip()
+                    try:
+                        msg, end = decoder.raw_decode(buf)
+                    except ValueError:
+                        break
+                    buf = buf[end:]
+                    if not self._handle(conn, msg):
+                        return
+        except socket.error:
+            pass
+        finally:
+            with self.lock:
+                self.connections.remove(conn)
+            conn.sock.close()
+
+    def _handle(self, conn, msg):
+        """
+        Answer one message, return False to hang up.
+        """
+        if "method" not in msg:
+            # the client answering a probe
+            self.echo_replies.append(msg.get("result"))
+            return True
+        with self.lock:
+            self.requests.append(msg["method"])
+            if self.hangup:
+                self.hangup -= 1
+                return False
+            garbage = self.garbage > 0
+            if garbage:
+                self.garbage -= 1
+            delay, self.delay = self.delay, None
+        if delay:
+            time.sleep(delay)
+        if garbage:
+            self._send(conn, '{"id": %s, "result": [1,], "error": null}' \
+                    % json.dumps(msg["id"]))
+            return True
+        if self.probe:
+            self._send(conn, json.dumps({"method": "echo",
+                "params": ["probe"], "id": "probe"}))
+        with self.lock:
+            result, error = self._answer(conn, msg["method"],
+                    msg.get("params"))
+            if msg.get("id") is not None:
+                self._send(conn, json.dumps({"id": msg["id"],
+                    "result": result, "error": error}))
+        return True
+
+    def _send(self, conn, text):
+        with conn.lock:
+            if not self.chunk:
+                conn.sock.sendall(text)
+                return
+            for start in xrange(0, len(text), self.chunk):
+                conn.sock.sendall(text[start:start + self.chunk])
+                # let the client read every piece on its own
+                time.sleep(0.001)
+
+    def _answer(self, conn, method, params):
+        """
+        Return (result, error) of a request.
+        """
+        if method == "echo":
+            return params, None
+        if method == "get_schema":
+            if params != [dbname]:
+                return None, _error("unknown database", json.dumps(params))
+            return schema, None
+        if method in ("transact", "monitor") \
+                and (not params or params[0] != dbname):
+            return None, _error("unknown database", json.dumps(params))
+        if method == "transact":
+            return self.transact(params[1:]), None
+        if method == "monitor":
+            requests = dict((table, request.get("columns") \
+                    or list(_tables[table])) \
+                    for table, request in params[2].iteritems())
+            conn.monitors[json.dumps(params[1])] = requests
+            return self._updates(dict((table, {}) for table in self.tables),
+                    self.tables, requests), None
+        return None, _error("unknown method", method)
+
+    # transactions
+
+    def _named(self, value, named):
+        if isinstance(value, list):
+            if len(value) == 2 and value[0] == "named-uuid":
+                return ["uuid", named[value[1]]]
+            return [self._named(item, named) for item in value]
+        if isinstance(value, dict):
+            return dict((key, self._named(item, named)) \
+                    for key, item in value.iteritems())
+        return value
+
+    def _where(self, table, where):
+        for column, function, value in where:
+            if function not in ("==", "!=", "includes", "excludes"):
+                raise _Failed(_error("not supported", function))
+        def match(row):
+            for column, function, value in where:
+                current = row.get(column)
+                if function == "==" and not _same(current, value) \
+                        or function == "!=" and _same(current, value) \
+                        or function == "includes" and not all(atom \
+                        in _atoms(current) for atom in _atoms(value)) \
+                        or function == "excludes" and any(atom \
+                        in _atoms(current) for atom in _atoms(value)):
+                    return False
+            return True
+        return [rowid for rowid, row in table.iteritems() if match(row)]
+
+    def _operation(self, tables, op, named):
+        table = tables.get(op.get("table"))
+        if table is None and op.get("op") != "comment":
+            raise _Failed(_error("unknown table", op.get("table")))
+        kind = op.get("op")
+        if kind == "comment":
+            return {}
+        if kind == "insert":
+            rowid = named.get(op.get("uuid-name")) or str(uuid.uuid4())
+            row = dict((column, _default(type)) \
+                    for column, type in _tables[op["table"]].iteritems())
+            row.update(op.get("row", {}))
+            row["_uuid"] = ["uuid", rowid]
+            row["_version"] = ["uuid", str(uuid.uuid4())]
+            table[rowid] = row
+            return {"uuid": ["uuid", rowid]}
+        matches = self._where(table, op.get("where", []))
+        if kind == "select":
+            rows = [table[rowid] for rowid in matches]
+            if "columns" in op:
+                rows = [dict((column, row[column]) for column \
+                        in op["columns"] if column in row) for row in rows]
+            return {"rows": copy.deepcopy(rows)}
+        if kind == "update":
+            for rowid in matches:
+                table[rowid].update(op["row"])
+            return {"count": len(matches)}
+        if kind == "mutate":
+            for rowid in matches:
+                for column, mutator, value in op["mutations"]:
+                    self._mutate(op["table"], table[rowid], column, mutator,
+                            value)
+            return {"count": len(matches)}
+        if kind == "delete":
+            for rowid in matches:
+                del table[rowid]
+            return {"count": len(matches)}
+        if kind == "wait":
+            rows = [dict((column, table[rowid].get(column)) \
+                    for column in op.get("columns", [])) \
+                    for rowid in matches]
+            equal = len(rows) == len(op["rows"]) and all(all(_same(a.get(c),
+                b.get(c)) for c in op.get("columns", [])) \
+                for a, b in zip(rows, op["rows"]))
+            if equal != (op["until"] == "=="):
+                raise _Failed(_error("timed out", "wait"))
+            return {}
+        raise _Failed(_error("not supported", kind))
+
+    def _mutate(self, table, row, column, mutator, value):
+        type = _tables[table][column]
+        if mutator in ("+=", "-="):
+            row[column] += value if mutator == "+=" else -value
+            return
+        current = list(_atoms(row[column]))
+        if isinstance(type, dict) and "value" in type:
+            if mutator == "insert":
+                keys = [pair[0] for pair in current]
+                current += [pair for pair in _atoms(value) \
+                        if pair[0] not in keys]
+            elif isinstance(value, list) and value[0] == "map":
+                current = [pair for pair in current \
+                        if pair not in _atoms(value)]
+            else:
+                current = [pair for pair in current \
+                        if pair[0] not in _atoms(value)]
+            row[column] = ["map", current]
+            return
+        if mutator == "insert":
+            current += [atom for atom in _atoms(value) if atom not in current]
+        else:
+            current = [atom for atom in current if atom not in _atoms(value)]
+        row[column] = ["set", current]
+
+    def _commit(self, old, tables):
+        """
+        Check strong references, collect the rows of non-root tables the
+        transaction left unreferenced and drop weak references to missing
+        rows. Like ovsdb-server, rows nothing referred to before, e.g. rows
+        insert() added, are left alone.
+        """
+        for table, rows in tables.iteritems():
+            for rowid, row in rows.iteritems():
+                for column, type in _tables[table].iteritems():
+                    refs, weak = _refs(type, row[column])
+                    for ref in refs:
+                        if not weak and not any(ref in other \
+                                for other in tables.itervalues()):
+                            raise _Failed(_error(
+                                "referential integrity violation",
+                                "%s row %s refers to missing row %s" \
+                                % (table, rowid, ref)))
+        before = _referenced(old)
+        spared = set(rowid for table, rows in old.iteritems() \
+                for rowid in rows if rowid not in before)
+        while True:
+            referenced = _referenced(tables)
+            garbage = [(table, rowid) for table, rows in tables.iteritems() \
+                    if table not in _roots for rowid in rows \
+                    if rowid not in referenced and rowid not in spared]
+            if not garbage:
+                break
+            for table, rowid in garbage:
+                del tables[table][rowid]
+        for table, rows in tables.iteritems():
+            for row in rows.itervalues():
+                for column, type in _tables[table].iteritems():
+                    refs, weak = _refs(type, row[column])
+                    missing = [ref for ref in refs if weak and not any(ref \
+                            in other for other in tables.itervalues())]
+                    if missing:
+                        row[column] = ["set", [atom for atom \
+                                in _atoms(row[column]) if not (isinstance(
+                                atom, list) and atom[1] in missing)]]
+
+    # monitors
+
+    def _notify(self, old):
+        for table, rows in self.tables.iteritems():
+            for rowid, row in rows.iteritems():
+                before = old[table].get(rowid)
+                if before is not None and any(not _same(before.get(column),
+                        row.get(column)) for column in _tables[table]):
+                    row["_version"] = ["uuid", str(uuid.uuid4())]
+        for conn in list(self.connections):
+            for monitor, requests in conn.monitors.items():
+                updates = self._updates(old, self.tables, requests)
+                if updates:
+                    try:
+                        self._send(conn, json.dumps({"method": "update",
+                            "params": [json.loads(monitor), updates],
+                            "id": None}))
+                    except socket.error:
+                        pass
+
+    def _updates(self, old, new, requests):
+        """
+        The table-updates a monitor with requests gets for going from the
+        rows in old to those in new.
+        """
+        updates = {}
+        for table, columns in requests.iteritems():
+            changes = {}
+            before, after = old.get(table, {}), new.get(table, {})
+            for rowid in set(before) | set(after):
+                a, b = before.get(rowid), after.get(rowid)
+                if a is None:
+                    changes[rowid] = {"new": dict((column, b[column]) \
+                            for column in columns)}
+                elif b is None:
+                    changes[rowid] = {"old": dict((column, a[column]) \
+                            for column in columns)}
+                else:
+                    modified = [column for column in columns \
+                            if not _same(a[column], b[column])]
+                    if modified:
+                        changes[rowid] = {"old": dict((column, a[column]) \
+                                for column in modified),
+                                "new": dict((column, b[column]) \
+                                for column in columns)}
+            if changes:
+                updates[table] = changes
+        return updates
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+A minimal OpenFlow switch for tests.
+
+FakeSwitch listens on a local TCP port and answers like a switch speaking
+version: hello, echo, and flow stats requests with the canned reply bodies
+in replies, one message each, the last without the "more" flag. NXST_FLOW
+requests get the bodies in nicira the same way, or an error when nicira is
+None, as from a switch that is not Open vSwitch. With probe set, it sends
+an echo request after reply part probe, in the middle of the dump; the
+answers end up in echo_replies.
+
+switch = FakeSwitch(OFP10, [body])
+flows = Connection(switch.target).dump_flows()
+"""
+import socket
+import struct
+import threading
+from openflow import (OFP10, OFPT_HELLO, OFPT_ERROR, OFPT_ECHO_REQUEST,
+        OFPT_ECHO_REPLY, OFPST_FLOW, OFPST_VENDOR, OFPSF_REPLY_MORE,
+        NX_VENDOR_ID, NXST_FLOW, _header, _stats_request, _stats_reply)
+
+class FakeSwitch(object):
+    def __init__(self, version, replies, probe=None, nicira=None):
+        self.version = version
+        self.replies = replies
+        self.probe = probe
+        self.nicira = nicira
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(5)
+        self.target = "tcp:127.0.0.1:%d" % self.listener.getsockname()[1]
+        self.requests = 0
+        self.echo_replies = []
+        thread = threading.Thread(target=self.serve, name="fake-switch")
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        self.listener.close()
+
+    def serve(self):
+        while True:
+            try:
+                sock, address = self.listener.accept()
+            except socket.error:
+                return
+            thread = threading.Thread(target=self.handle, args=(sock,))
+            thread.daemon = True
+            thread.start()
+
+    def _read(self, sock, n):
+        data = ""
+        while len(data) < n:
+            chunk = sock.recv(n - len(data))
+            if not chunk:
+                raise socket.error("closed")
+            data += chunk
+        return data
+
+    def handle(self, sock):
+        v = self.version
+        sock.sendall(struct.pack("!BBHIHHI", v, OFPT_HELLO, 16, 0, 1, 8,
+            1 << v))
+        try:
+            while True:
+                header = self._read(sock, 8)
+                version, type, length, xid = _header.unpack(header)
+                body = self._read(sock, length - 8)
+                if type == OFPT_ECHO_REQUEST:
+                    sock.sendall(_header.pack(v, OFPT_ECHO_REPLY, length,
+                        xid) + body)
+                elif type == OFPT_ECHO_REPLY:
+                    self.echo_replies.append((xid, body))
+                elif type == _stats_request[v] \
+                        and struct.unpack("!H", body[:2])[0] == OFPST_VENDOR:
+                    self._reply_nicira(sock, xid, body)
+                elif type == _stats_request[v]:
+                    self.requests += 1
+                    self._reply(sock, xid, self.replies)
+        except socket.error:
+            sock.close()
+
+    def _reply_nicira(self, sock, xid, body):
+        v = self.version
+        vendor, subtype = struct.unpack_from("!II", body,
+                4 if v == OFP10 else 8)
+        if self.nicira is None or (vendor, subtype) \
+                != (NX_VENDOR_ID, NXST_FLOW):
+            # OFPET_BAD_REQUEST, OFPBRC_BAD_VENDOR
+            error = struct.pack("!HH", 1, 3) + body[:64]
+            sock.sendall(_header.pack(v, OFPT_ERROR, 8 + len(error), xid)
+                    + error)
+            return
+        self.requests += 1
+        head = struct.pack("!II4x" if v == OFP10 else "!II", NX_VENDOR_ID,
+                NXST_FLOW)
+        self._reply(sock, xid, [head + reply for reply in self.nicira],
+                OFPST_VENDOR)
+
+    def _reply(self, sock, xid, replies, stats=OFPST_FLOW):
+        v = self.version
+        for i, reply in enumerate(replies):
+            flags = 0 if i == len(replies) - 1 else OFPSF_REPLY_MORE
+            part = struct.pack("!HH", stats, flags) \
+                    + ("" if v == OFP10 else "\0" * 4) + reply
+            sock.sendall(_header.pack(v, _stats_reply[v], 8 + len(part),
+                xid) + part)
+            if i == self.probe:
+                sock.sendall(_header.pack(v, OFPT_ECHO_REQUEST, 12,
+                    0xabcdef) + "ping")
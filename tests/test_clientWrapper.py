@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import unittest
+import simplejson as json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir, "core"))
+
+import clientWrapper as dbclient
+import jsonrpc
+import records
+from fakeovsdb import FakeOvsdb, dbname
+
+bridges = [{"name": "br0", "datapath_id": "0000000000000001",
+        "ports": ["set", []]},
+    {"name": "br1", "datapath_id": ["set", []], "ports": ["set", []]}]
+
+def transact(*ops):
+    return json.dumps([dbname] + list(ops))
+
+def select(table, where=[], columns=None):
+    op = {"op": "select", "table": table, "where": where}
+    if columns is not None:
+        op["columns"] = columns
+    return op
+
+def wait_for(condition, timeout=2):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+class ServerTest(unittest.TestCase):
+    """
+    A fresh FakeOvsdb per test, so every test gets its own pool and schema.
+    """
+    options = {}
+
+    def setUp(self):
+        self.server = FakeOvsdb({"Bridge": bridges}, **self.options)
+        self.pool = dbclient.get_pool(self.server.target)
+
+    def tearDown(self):
+        self.server.close()
+
+    def cursor(self):
+        return dbclient.connect(self.server.target).cursor()
+
+    def names(self, rows):
+        return [row["name"] for row in rows]
+
+class CursorTest(ServerTest):
+    def test_select(self):
+        cur = self.cursor()
+        cur.execute(transact(select("Bridge", [["name", "==", "br0"]])))
+        rows = cur.fetchall()
+        self.assertEqual(self.names(rows), ["br0"])
+        self.assertTrue(isinstance(rows[0], records.Bridge))
+        self.assertEqual(rows[0].datapath_id, "0000000000000001")
+        self.assertEqual(rows[0].ports, [])
+
+    def test_result_sets(self):
+        cur = self.cursor()
+        cur.execute(transact(select("Bridge", columns=["name"]),
+            select("Bridge", [["name", "!=", "br0"]], ["name",
+                "datapath_id"])))
+        self.assertEqual(self.names(cur.fetchall()), ["br0", "br1"])
+        self.assertTrue(cur.nextset())
+        rows = cur.fetchall()
+        self.assertEqual(self.names(rows), ["br1"])
+        self.assertEqual(rows[0].datapath_id, None)
+        self.assertEqual(cur.nextset(), None)
+
+    def test_transact(self):
+        cur = self.cursor()
+        cur.execute(transact({"op": "insert", "table": "Port",
+            "row": {"name": "eth0", "tag": 10}},
+            select("Port", [["name", "==", "eth0"]])))
+        self.assertEqual(cur.fetchall(), [])
+        cur.nextset()
+        rows = cur.fetchall()
+        self.assertEqual([(row.name, row.tag) for row in rows],
+                [("eth0", 10)])
+        self.assertEqual(self.pool.stats()["idle"], 1)
+
+    def test_executemany(self):
+        cur = self.cursor()
+        cur.executemany(transact(select("Bridge",
+            [["name", "==", "%s"]])), ["br1", "br0"])
+        self.assertEqual(self.names(cur.fetchall()), ["br1"])
+        cur.nextset()
+        self.assertEqual(self.names(cur.fetchall()), ["br0"])
+
+    def test_malformed(self):
+        cur = self.cursor()
+        with self.assertRaises(dbclient.ProgrammingError) as raised:
+            cur.execute('["Open_vSwitch", {')
+        self.assertEqual(raised.exception.ret, -2)
+
+class EchoTest(ServerTest):
+    options = {"probe": True}
+
+    def test_probe_answered(self):
+        cur = self.cursor()
+        cur.execute(transact(select("Bridge", columns=["name"])))
+        self.assertEqual(self.names(cur.fetchall()), ["br0", "br1"])
+        # one probe ahead of get_schema, one ahead of the transact
+        self.assertTrue(wait_for(
+            lambda: len(self.server.echo_replies) == 2))
+        self.assertEqual(self.server.echo_replies, [["probe"], ["probe"]])
+
+    def test_echo(self):
+        session = jsonrpc.Session(self.server.target, 2)
+        try:
+            self.assertEqual(session.echo(), [])
+        finally:
+            session.close()
+
+class FramingTest(ServerTest):
+    options = {"chunk": 7}
+
+    def test_split_replies(self):
+        cur = self.cursor()
+        cur.execute(transact(select("Bridge")))
+        rows = cur.fetchall()
+        self.assertEqual(self.names(rows), ["br0", "br1"])
+        self.assertEqual(rows[0].datapath_id, "0000000000000001")
+
+    def test_parser_split_anywhere(self):
+        text = '{"id":1,"result":["a\\"}{[","b"],"error":null}' \
+                '{"id":2,"result":[],"error":null}'
+        for split in xrange(len(text) + 1):
+            parser = jsonrpc.Parser()
+            messages = []
+            for data in (text[:split], text[split:]):
+                while data:
+                    message, data = parser.feed(data)
+                    if message is not None:
+                        messages.append(json.loads(message))
+            self.assertEqual([message["id"] for message in messages],
+                    [1, 2], split)
+            self.assertEqual(messages[0]["result"], ['a"}{[', "b"])
+
+class ErrorTest(ServerTest):
+    def test_error_reply(self):
+        with self.assertRaises(dbclient.InterfaceError) as raised:
+            dbclient.get_schema(self.server.target, "nodb")
+        self.assertEqual(raised.exception.ret, -3)
+        self.assertTrue("unknown database" in raised.exception.msg)
+
+    def test_operation_error(self):
+        cur = self.cursor()
+        with self.assertRaises(dbclient.InterfaceError) as raised:
+            cur.execute(transact(select("Nope")))
+        self.assertTrue("unknown table" in raised.exception.msg)
+
+    def test_client_error_reply(self):
+        client = jsonrpc.Client(self.server.target)
+        try:
+            with self.assertRaises(jsonrpc.ReplyError):
+                client.call("frobnicate", [], 2)
+            self.assertEqual(client.call("echo", ["x"], 2), ["x"])
+        finally:
+            client.close()
+
+class MemoTest(ServerTest):
+    def setUp(self):
+        ServerTest.setUp(self)
+        dbclient.begin_request()
+        self.addCleanup(dbclient.end_request)
+
+    def execute(self, *ops):
+        cur = self.cursor()
+        cur.execute(transact(*ops))
+        return cur
+
+    def transacts(self):
+        return self.server.requests.count("transact")
+
+    def test_streamed_then_remembered(self):
+        cur = self.execute(select("Bridge"), select("Port"))
+        # the reply is streamed, not parsed whole
+        self.assertTrue(cur.scanner is not None)
+        self.assertEqual(self.names(cur.fetchall()), ["br0", "br1"])
+        cur.nextset()
+        self.assertEqual(cur.fetchall(), [])
+        self.assertEqual(self.pool.stats()["idle"], 1)
+        sent = self.transacts()
+        cur = self.execute(select("Bridge"), select("Port"))
+        self.assertEqual(cur.scanner, None)
+        self.assertEqual(self.names(cur.fetchall()), ["br0", "br1"])
+        self.assertEqual(self.transacts(), sent)
+
+    def test_rows_left_unread(self):
+        cur = self.execute(select("Bridge"))
+        self.assertEqual(self.names([cur.fetchone()]), ["br0"])
+        cur.close()
+        cur = self.execute(select("Bridge"))
+        self.assertTrue(cur.scanner is not None)
+        self.assertEqual(self.names(cur.fetchall()), ["br0", "br1"])
+
+    def test_write_forgets(self):
+        self.execute(select("Bridge")).fetchall()
+        dbclient.sync_replica()
+        cur = self.execute(select("Bridge"))
+        self.assertTrue(cur.scanner is not None)
+
+class StaleReplyTest(ServerTest):
+    def setUp(self):
+        ServerTest.setUp(self)
+        self.session = jsonrpc.Session(self.server.target, 0.4)
+        self.addCleanup(self.session.close)
+        # the first reply comes after the session gave up on it
+        self.server.delay = 0.5
+
+    def test_scanner_drops_stale_reply(self):
+        with self.assertRaises(jsonrpc.Timeout):
+            list(self.session.transact_rows([dbname, select("Bridge")]))
+        scanner = self.session.transact_rows([dbname, select("Bridge",
+            [["name", "==", "br1"]], ["name"])])
+        self.assertEqual([json.loads(text)["name"] for index, text \
+                in scanner], ["br1"])
+        self.assertEqual(scanner.reply["id"], scanner.rid)
+        self.assertEqual(self.session.unanswered, [])
+
+    def test_request_drops_stale_reply(self):
+        with self.assertRaises(jsonrpc.Timeout):
+            self.session.request("echo", ["first"])
+        self.assertEqual(self.session.request("echo", ["second"]),
+                ["second"])
+        self.assertEqual(self.session.unanswered, [])
+
+    def test_reply_out_of_order(self):
+        self.server.delay = None
+        # a reply to a request the session does not know about
+        self.session.unanswered.append(0)
+        scanner = self.session.transact_rows([dbname, select("Bridge")])
+        with self.assertRaises(jsonrpc.Error):
+            list(scanner)
+        self.assertEqual(self.session.sock, None)
+
+class PoolTest(ServerTest):
+    def test_hangup_evicts(self):
+        dbclient.get_schema(self.server.target)
+        cur = self.cursor()
+        self.server.hangup = 1
+        with self.assertRaises(dbclient.InterfaceError):
+            cur.execute(transact(select("Bridge")))
+        stats = self.pool.stats()
+        self.assertEqual((stats["evicted"], stats["size"]), (1, 0))
+        cur.execute(transact(select("Bridge")))
+        self.assertEqual(len(cur.fetchall()), 2)
+        self.assertEqual(self.pool.stats()["created"], 2)
+
+    def test_error_reply_keeps_session(self):
+        for attempt in (0, 1):
+            with self.assertRaises(dbclient.InterfaceError):
+                dbclient.get_schema(self.server.target, "nodb")
+        cur = self.cursor()
+        with self.assertRaises(dbclient.InterfaceError):
+            cur.execute(transact(select("Nope")))
+        cur.execute(transact(select("Bridge")))
+        self.assertEqual(len(cur.fetchall()), 2)
+        stats = self.pool.stats()
+        self.assertEqual((stats["created"], stats["evicted"], stats["idle"]),
+                (1, 0, 1))
+
+    def test_garbage_returns_slot(self):
+        self.server.garbage = 1
+        with self.assertRaises(dbclient.InterfaceError):
+            dbclient.get_schema(self.server.target)
+        stats = self.pool.stats()
+        self.assertEqual((stats["evicted"], stats["size"]), (1, 0))
+        self.assertEqual(dbclient.get_schema(self.server.target).name,
+                dbname)
+
+    def test_idle_session_probed(self):
+        idle_check = dbclient.idle_check
+        dbclient.idle_check = 0
+        try:
+            self.pool.put(self.pool.get())
+            self.server.hangup = 1
+            session = self.pool.get()
+            self.assertEqual(session.echo(), [])
+            self.pool.put(session)
+        finally:
+            dbclient.idle_check = idle_check
+        stats = self.pool.stats()
+        self.assertEqual((stats["created"], stats["evicted"], stats["size"]),
+                (2, 1, 1))
+
+if __name__ == "__main__":
+    unittest.main()
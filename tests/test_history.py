@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir, "core"))
+
+import history
+
+def sample(packets):
+    return {"br0": {"eth0": {"rx_packets": packets,
+        "rx_bytes": 100 * packets}}}
+
+class HistoryTest(unittest.TestCase):
+    def setUp(self):
+        # a sample every 5 seconds from 1000 to 1595
+        self.history = history.History(history.tiers_for(5))
+        for i in xrange(120):
+            self.history.add(1000 + 5 * i, sample(i))
+
+    def test_tiers_for(self):
+        self.assertEqual(history.tiers_for(5),
+                [(5, 60), (60, 360), (3600, 168)])
+        self.assertEqual(self.history.ports[("br0", "eth0")][0].size, 60)
+
+    def test_finest_tier(self):
+        step, start, values = self.history.query("br0", "eth0",
+                "rx_packets", 1500, 1520)
+        self.assertEqual((step, start), (5, 1500))
+        self.assertEqual(values, [100, 101, 102, 103, 104])
+
+    def test_coarser_tier(self):
+        step, start, values = self.history.query("br0", "eth0", "rx_bytes",
+                1000, 1200, 60)
+        self.assertEqual((step, start), (60, 960))
+        # the last value seen in each minute
+        self.assertEqual(values, [300, 1500, 2700, 3900, 5100])
+
+    def test_range_clamped(self):
+        # a range of ten years asks for 30 million slots of the finest tier,
+        # only the 60 it holds come back
+        step, start, values = self.history.query("br0", "eth0",
+                "rx_packets", 0, 315360000, 5)
+        self.assertEqual((step, start), (5, 1300))
+        self.assertEqual(values, range(60, 120))
+
+    def test_range_not_held(self):
+        self.assertEqual(self.history.query("br0", "eth0", "rx_packets",
+            2000, 3000, 5), (5, None, []))
+        self.assertEqual(self.history.query("br0", "eth0", "rx_packets",
+            1200, 1100, 5), (5, None, []))
+
+    def test_gap(self):
+        self.history.add(1620, sample(200))
+        step, start, values = self.history.query("br0", "eth0",
+                "rx_packets", 1590, 1620)
+        self.assertEqual(values, [118, 119, None, None, None, None, 200])
+
+    def test_unknown(self):
+        self.assertEqual(self.history.query("br0", "eth9", "rx_packets",
+            1000, 1100), None)
+        with self.assertRaises(KeyError):
+            self.history.query("br0", "eth0", "nope", 1000, 1100)
+        with self.assertRaises(KeyError):
+            self.history.query("br0", "eth0", "rx_packets", 1000, 1100, 7)
+
+    def test_port_dropped(self):
+        self.history.add(1600, {"br0": {}})
+        self.assertEqual(self.history.query("br0", "eth0", "rx_packets",
+            1000, 1100), None)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+import os
+import socket
+import struct
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir, "core"))
+
+import openflow
+from openflow import OFP10, OFP13
+from fakeswitch import FakeSwitch
+
+def wait_for(condition, timeout=2):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+# priority=100,ip,in_port=1,dl_vlan=9,nw_dst=10.0.0.0/24,
+# actions=mod_vlan_vid:5,output:2
+def flow10(table=0, priority=100, packets=3):
+    match = openflow._match10.pack(((1 << 22) - 1) & ~(1 | 2 | 16) \
+            & ~(0x3f << 8) & ~(0x3f << 14) | (32 << 8) | (8 << 14), 1,
+            "\0" * 6, "\0" * 6, 9, 0, 0x0800, 0, 0, 0, 0x0a000000, 0, 0)
+    actions = struct.pack("!HHH2x", 1, 8, 5) \
+            + struct.pack("!HHHH", 0, 8, 2, 0)
+    return struct.pack("!HBx", openflow._flow10.size + len(actions), table) \
+            + match + struct.pack("!IIHHH6xQQQ", 42, 455000000, priority, 0,
+            0, 0, packets, 60 * packets) + actions
+
+expected10 = {"table": "0", "priority": 100, "cookie": "0x0",
+        "duration": "42.455s", "counters": {"packets": "3", "bytes": "180"},
+        "match_fields": {"in_port": "1", "vlan_vid": "9",
+            "eth_type": "0x0800", "ipv4_dst": "10.0.0.0/24"},
+        "actions": "mod_vlan_vid:5,output:2"}
+
+def oxm(field, value, mask=None, oxm_class=0x8000):
+    return struct.pack("!I", (oxm_class << 16) | (field << 9) \
+            | ((mask is not None) << 8) \
+            | (len(value) + len(mask or ""))) + value + (mask or "")
+
+def pad8(data):
+    return data + "\0" * (-len(data) % 8)
+
+def vid(value, mask=None):
+    return oxm(6, struct.pack("!H", value),
+            None if mask is None else struct.pack("!H", mask))
+
+# in_port=LOCAL,dl_vlan=9,nw_dst=10.1.0.0/255.255.0.0,idle_timeout=30,
+# actions=set_field:5->vlan_vid,output:3,CONTROLLER:128,goto_table:2
+def flow13(table=0, priority=10, cookie=1, vlan=vid(0x1009)):
+    fields = oxm(0, struct.pack("!I", 0xfffffffe)) + vlan \
+            + oxm(12, socket.inet_aton("10.1.0.0"),
+                socket.inet_aton("255.255.0.0"))
+    match = pad8(struct.pack("!HH", 1, 4 + len(fields)) + fields)
+    set_field = vid(0x1005)
+    actions = pad8(struct.pack("!HH", 25, len(pad8("\0" * 4 + set_field)))
+            + set_field) + struct.pack("!HHIH6x", 0, 16, 3, 0) \
+            + struct.pack("!HHIH6x", 0, 16, 0xfffffffd, 128)
+    instructions = struct.pack("!HH4x", 4, 8 + len(actions)) + actions \
+            + struct.pack("!HHB3x", 1, 8, 2)
+    body = struct.pack("!IIHHHH4xQQQ", 7, 1000000, priority, 30, 0, 0,
+            cookie, 10, 1000) + match + instructions
+    return struct.pack("!HBx", 4 + len(body), table) + body
+
+expected13 = {"table": "0", "priority": 10, "cookie": "0x1",
+        "duration": "7.001s", "counters": {"packets": "10", "bytes": "1000"},
+        "match_fields": {"in_port": "LOCAL", "vlan_vid": "9",
+            "ipv4_dst": "10.1.0.0/255.255.0.0", "idle_timeout": "30"},
+        "actions": "set_field:5->vlan_vid,output:3,CONTROLLER:128,"
+            "goto_table:2"}
+
+# the flow of flow10() as NXST_FLOW reports it, idle for 5s and modified
+# 30s ago
+def nx_flow(table=0, priority=100, idle_age=6, hard_age=31,
+        tci=struct.pack("!H", 0x1009), tci_mask=struct.pack("!H", 0x1fff),
+        actions=struct.pack("!HHH2x", 1, 8, 5) \
+            + struct.pack("!HHHH", 0, 8, 2, 0)):
+    match = oxm(0, struct.pack("!H", 1), oxm_class=0) \
+            + oxm(4, tci, tci_mask, oxm_class=0) \
+            + oxm(3, struct.pack("!H", 0x0800), oxm_class=0) \
+            + oxm(8, socket.inet_aton("10.0.0.0"),
+                socket.inet_aton("255.255.255.0"), oxm_class=0)
+    body = struct.pack("!IIHHHHHHQQQ", 42, 455000000, priority, 0, 0,
+            len(match), idle_age, hard_age, 0, 3, 180) + pad8(match) \
+            + actions
+    return struct.pack("!HBx", 4 + len(body), table) + body
+
+expected_nx = dict(expected10, idle_age="5", hard_age="30",
+        match_fields={"in_port": "1", "vlan_vid": "9", "eth_type": "0x0800",
+            "ipv4_dst": "10.0.0.0/255.255.255.0"})
+
+class DumpTest(unittest.TestCase):
+    def dump(self, version, replies, probe=None, table=None, nicira=None):
+        self.switch = FakeSwitch(version, replies, probe, nicira)
+        self.addCleanup(self.switch.close)
+        self.conn = openflow.Connection(self.switch.target, timeout=2)
+        self.addCleanup(self.conn.close)
+        flows = self.conn.dump_flows(table)
+        self.assertEqual(self.conn.version, version)
+        return flows
+
+    def keys(self, flows):
+        return [(flow["table"], flow["priority"]) for flow in flows]
+
+class OpenFlow10Test(DumpTest):
+    def test_single_reply(self):
+        self.assertEqual(self.dump(OFP10, [flow10()]), [expected10])
+
+    def test_more(self):
+        flows = self.dump(OFP10, [flow10(0, 1) + flow10(0, 2),
+            flow10(1, 3), flow10(2, 4) * 3])
+        self.assertEqual(self.keys(flows), [("0", 1), ("0", 2), ("1", 3)] \
+                + [("2", 4)] * 3)
+        self.assertEqual(self.switch.requests, 1)
+
+    def test_echo_mid_dump(self):
+        flows = self.dump(OFP10, [flow10(0, 1), flow10(0, 2)], probe=0)
+        self.assertEqual(self.keys(flows), [("0", 1), ("0", 2)])
+        self.assertTrue(wait_for(lambda: self.switch.echo_replies))
+        self.assertEqual(self.switch.echo_replies, [(0xabcdef, "ping")])
+
+    def test_large_parts(self):
+        # parts larger than the receive buffer, crossing its end
+        flows = self.dump(OFP10, [flow10(0, 1) * 600, flow10(1, 2) * 600])
+        self.assertEqual(len(flows), 1200)
+        self.assertEqual(flows[-1]["table"], "1")
+
+    def test_reconnect(self):
+        self.dump(OFP10, [flow10()])
+        self.conn.sock.shutdown(socket.SHUT_RDWR)
+        self.assertEqual(self.conn.dump_flows(), [expected10])
+        self.assertEqual(self.switch.requests, 2)
+
+    def test_unreachable(self):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        target = "tcp:127.0.0.1:%d" % listener.getsockname()[1]
+        listener.close()
+        with self.assertRaises(openflow.Error):
+            openflow.Connection(target, timeout=2).dump_flows()
+
+class OpenFlow13Test(DumpTest):
+    def test_single_reply(self):
+        self.assertEqual(self.dump(OFP13, [flow13()]), [expected13])
+
+    def test_more_with_echo(self):
+        flows = self.dump(OFP13, [flow13(0, 10) + flow13(1, 20),
+            flow13(2, 30, 0xabc), flow13(3, 40)], probe=1)
+        self.assertEqual(self.keys(flows), [("0", 10), ("1", 20), ("2", 30),
+            ("3", 40)])
+        self.assertEqual(flows[2]["cookie"], "0xabc")
+        self.assertTrue(wait_for(lambda: self.switch.echo_replies))
+        self.assertEqual(self.switch.echo_replies, [(0xabcdef, "ping")])
+
+    def test_vlan_vid(self):
+        flows = self.dump(OFP13, [flow13(vlan=vid(0)),
+            flow13(vlan=vid(0x1000, 0x1000)),
+            flow13(vlan=vid(0x1005, 0x1fff))])
+        self.assertEqual([flow["match_fields"]["vlan_vid"] for flow in flows],
+                ["0xffff", "0x1000/0x1000", "0x1005/0x1fff"])
+
+class NiciraTest(DumpTest):
+    def test_ages(self):
+        self.assertEqual(self.dump(OFP10, [], nicira=[nx_flow()]),
+                [expected_nx])
+        self.assertTrue(self.conn.nicira)
+
+    def test_ages_13(self):
+        flows = self.dump(OFP13, [], nicira=[nx_flow(1, 20) + nx_flow(2, 30,
+            actions=struct.pack("!HHIH6x", 0, 16, 3, 0))])
+        self.assertEqual(self.keys(flows), [("1", 20), ("2", 30)])
+        self.assertEqual(flows[1]["actions"], "output:3")
+        self.assertEqual((flows[1]["idle_age"], flows[1]["hard_age"]),
+                ("5", "30"))
+
+    def test_unknown_ages(self):
+        # no idle_age when unknown, no hard_age equal to the duration
+        flow = self.dump(OFP10, [], nicira=[nx_flow(idle_age=0,
+            hard_age=43)])[0]
+        self.assertFalse("idle_age" in flow or "hard_age" in flow)
+
+    def test_vlan_tci(self):
+        flows = self.dump(OFP10, [], nicira=[nx_flow(tci="\0\0",
+            tci_mask=None), nx_flow(tci=struct.pack("!H", 0xb009),
+            tci_mask=None), nx_flow(tci=struct.pack("!H", 0x1000),
+            tci_mask=struct.pack("!H", 0x1000))])
+        self.assertEqual([dict((key, value) for key, value \
+                in flow["match_fields"].iteritems() if "vlan" in key) \
+                for flow in flows], [{"vlan_vid": "0xffff"},
+                    {"vlan_vid": "9", "vlan_pcp": "5"},
+                    {"vlan_tci": "0x1000/0x1000"}])
+
+    def test_not_open_vswitch(self):
+        # the switch refuses NXST_FLOW, standard flow stats answer
+        self.assertEqual(self.dump(OFP10, [flow10()]), [expected10])
+        self.assertEqual(self.conn.nicira, False)
+        self.assertEqual(self.conn.dump_flows(), [expected10])
+        self.assertEqual(self.switch.requests, 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+import os
+import sys
+import unittest
+import uuid
+import simplejson as json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir, "core"))
+
+import clientWrapper as dbclient
+import ovsdb
+from fakeovsdb import FakeOvsdb, counters, seed
+
+class OvsdbTest(unittest.TestCase):
+    """
+    ovsdb.py against a fresh FakeOvsdb holding seed() per test.
+    """
+    def setUp(self):
+        self.server = FakeOvsdb(seed())
+        self.addCleanup(self.server.close)
+        self.addCleanup(setattr, dbclient, "database", dbclient.database)
+        dbclient.database = self.server.target
+        ovsdb._cache.clear()
+        self.addCleanup(ovsdb._cache.clear)
+
+    def names(self, ports):
+        return sorted(port["name"] for port in ports)
+
+def access(name, tag, qos=None):
+    return {"name": name, "vlan_config": {"vlan_mode": "access", "tag": tag},
+            "options": {"link_speed": 0}, "qos": qos}
+
+class CacheTest(OvsdbTest):
+    def tags(self, response):
+        return dict((port["name"], port["vlan_config"]["tag"]) \
+                for port in response["ports"])
+
+    def test_cached(self):
+        first = ovsdb.get_ports("br0")
+        self.assertTrue(ovsdb.get_ports("br0") is first)
+        # changes made through ovsdb.py drop what they touch
+        ovsdb.batch("br0", json.dumps([{"op": "update", "type": "port",
+            "data": access("eth0", 20)}]))
+        self.assertEqual(self.tags(ovsdb.get_ports("br0"))["eth0"], 20)
+
+    def test_etag(self):
+        tag = ovsdb.etag(ovsdb.get_ports, "br0")
+        self.assertEqual(ovsdb.etag(ovsdb.get_ports, "br0"), tag)
+        self.assertNotEqual(ovsdb.etag(ovsdb.get_ports, "br0", limit=1), tag)
+        self.server.update("Port", self.server.uuids["eth1"], {"tag": 30})
+        self.assertNotEqual(ovsdb.etag(ovsdb.get_ports, "br0"), tag)
+
+    def test_external_change_within_ttl(self):
+        tag = ovsdb.etag(ovsdb.get_ports, "br0")
+        self.assertEqual(self.tags(ovsdb.get_ports("br0", etag=tag))["eth0"],
+                10)
+        self.assertEqual(self.tags(ovsdb.get_ports("br0"))["eth0"], 10)
+        # another client changes eth0, nothing tells the cache
+        self.server.update("Port", self.server.uuids["eth0"], {"tag": 99})
+        self.assertEqual(self.tags(ovsdb.get_ports("br0"))["eth0"], 10)
+        changed = ovsdb.etag(ovsdb.get_ports, "br0")
+        self.assertNotEqual(changed, tag)
+        self.assertEqual(self.tags(ovsdb.get_ports("br0",
+            etag=changed))["eth0"], 99)
+
+    def test_tag_filter(self):
+        tag = ovsdb.etag(ovsdb.get_ports, "br0", tag="11")
+        response = ovsdb.get_ports("br0", tag="11", etag=tag)
+        self.assertEqual([port["name"] for port in response["ports"]],
+                ["eth1"])
+
+class PagingTest(OvsdbTest):
+    def setUp(self):
+        OvsdbTest.setUp(self)
+        for name, tag in (("eth3", 11), ("ge-1", 12), ("ge-2", 10)):
+            self.assertEqual(ovsdb.batch("br0", json.dumps([{"op": "add",
+                "type": "port", "data": access(name, tag)}]))["ret"], 0)
+        # ovs-vswitchd fills in the counters of new interfaces
+        for rowid, row in self.server.tables["Interface"].items():
+            if row["statistics"] == ["map", []]:
+                self.server.update("Interface", rowid,
+                        {"statistics": counters(0)})
+
+    def test_pages(self):
+        names = []
+        cursor = None
+        while True:
+            page = ovsdb.get_ports("br0", limit=2, cursor=cursor)
+            self.assertEqual(page["ret"], 0)
+            self.assertEqual(page["total"], 6)
+            names += [port["name"] for port in page["ports"]]
+            cursor = page["next"]
+            if cursor is None:
+                break
+        self.assertEqual(names, ["eth0", "eth1", "eth2", "eth3", "ge-1",
+            "ge-2"])
+
+    def test_filters(self):
+        page = ovsdb.get_ports("br0", name_prefix="ge-", sort="-tag")
+        self.assertEqual([(port["name"], port["vlan_config"]["tag"]) \
+                for port in page["ports"]], [("ge-1", 12), ("ge-2", 10)])
+        page = ovsdb.get_ports("br0", tag="10", sort="tag")
+        self.assertEqual([port["name"] for port in page["ports"]],
+                ["eth0", "ge-2"])
+        page = ovsdb.get_ports("br0", type="pica8_lag")
+        self.assertEqual([port["name"] for port in page["ports"]], ["lag1"])
+
+    def test_malformed(self):
+        for query in ({"limit": "0"}, {"sort": "mtu"}, {"cursor": "%%"},
+                {"type": "tap"}, {"tag": "x"}):
+            self.assertEqual(ovsdb.get_ports("br0", **query)["ret"], -2,
+                    query)
+
+    def test_deleted_within_ttl(self):
+        self.assertEqual(ovsdb.get_ports("br0", limit=1)["ret"], 0)
+        # another client deletes eth1 while the port index is cached
+        self.server.transact([{"op": "mutate", "table": "Bridge",
+            "where": [], "mutations": [["ports", "delete",
+                ["uuid", self.server.uuids["eth1"]]]]}])
+        self.assertEqual(self.server.row("Port", self.server.uuids["eth1"]),
+                None)
+        page = ovsdb.get_ports("br0", limit=10)
+        self.assertEqual(page["ret"], 0)
+        self.assertEqual([port["name"] for port in page["ports"]],
+                ["eth0", "eth2", "eth3", "ge-1", "ge-2"])
+        page = ovsdb.get_ports("br0", type="pica8_lag", limit=10)
+        self.assertEqual([port["name"] for port in page["ports"]], ["lag1"])
+
+class BatchTest(OvsdbTest):
+    def batch(self, *operations):
+        return ovsdb.batch("br0", json.dumps([dict(zip(("op", "type",
+            "data"), operation)) for operation in operations]))
+
+    def test_applied(self):
+        result = self.batch(("add", "port", access("eth9", 9)),
+                ("update", "port", access("eth0", 20)))
+        self.assertEqual(result["ret"], 0)
+        self.assertEqual(len(result["results"]), 2)
+        self.assertEqual(self.server.row("Port",
+            result["results"][0]["uuid"])["tag"], 9)
+        self.assertEqual(self.server.row("Port",
+            self.server.uuids["eth0"])["tag"], 20)
+
+    def test_failed_operation(self):
+        result = self.batch(("add", "port", access("eth9", 9)),
+                ("update", "port", access("nope", 20)),
+                ("update", "port", access("eth0", 20)))
+        self.assertEqual((result["ret"], result["op"]), (-4, 1))
+        self.assertEqual(self.server.row("Port",
+            self.server.uuids["eth0"])["tag"], 10)
+
+    def test_failed_commit(self):
+        # a dangling QoS reference fails the commit, not an operation
+        result = self.batch(("add", "port", access("eth9", 9)),
+                ("update", "port", access("eth0", 20, str(uuid.uuid4()))))
+        self.assertEqual(result["ret"], -4)
+        self.assertTrue("referential integrity" in result["msg"])
+        self.assertEqual(result["op"], None)
+
+    def test_malformed(self):
+        result = self.batch(("add", "port", access("eth9", 9)),
+                ("frob", "port", {}))
+        self.assertEqual((result["ret"], result["op"]), (-2, 1))
+
+class MinimalTest(OvsdbTest):
+    def test_changed_row(self):
+        response = ovsdb.update_port("br0", json.dumps(access("eth0", 20)),
+                minimal=True)
+        self.assertEqual(response["ret"], 0)
+        self.assertEqual(response["port"]["vlan_config"]["tag"], 20)
+        self.assertEqual(response["generation"], None)
+
+    def test_missing_row(self):
+        response = ovsdb._one_port("nope")
+        self.assertEqual((response["ret"], response["port"]), (0, None))
+
+    def test_view_error(self):
+        def view(record):
+            # a view reading more, from a table the database does not have
+            cur = dbclient.connect().cursor()
+            cur.execute(json.dumps(["Open_vSwitch", {"op": "select",
+                "table": "Nope", "where": []}]))
+            return cur.fetchall()
+        response = ovsdb._one("port", "Port", ["_uuid"],
+                [["name", "==", "eth0"]], view)
+        self.assertTrue(response["ret"] < 0)
+        self.assertTrue("Nope" in response["msg"])
+        self.assertFalse("port" in response)
+
+if __name__ == "__main__":
+    unittest.main()
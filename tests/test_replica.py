@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir, "core"))
+
+import clientWrapper as dbclient
+import replica
+from fakeovsdb import FakeOvsdb, counters, seed
+
+class ReplicaTest(unittest.TestCase):
+    """
+    A Replica monitoring a fresh FakeOvsdb holding seed() per test, changed
+    behind its back through the server.
+    """
+    def setUp(self):
+        self.server = FakeOvsdb(seed())
+        self.addCleanup(self.server.close)
+        self.addCleanup(setattr, dbclient, "database", dbclient.database)
+        dbclient.database = self.server.target
+        self.replica = replica.Replica()
+        self.replica.start()
+        self.addCleanup(self.replica.stop)
+        deadline = time.time() + 5
+        with self.replica.cond:
+            while not self.replica.synced and time.time() < deadline:
+                self.replica.cond.wait(deadline - time.time())
+        self.assertTrue(self.replica.synced)
+
+    def port(self, name):
+        for row in self.replica.data["Port"].itervalues():
+            if row.name == name:
+                return row
+
+    def change(self, ops):
+        generation = self.replica.generation
+        self.server.transact(ops)
+        self.assertTrue(self.replica.sync())
+        return generation
+
+    def test_initial_sync(self):
+        self.assertEqual(self.replica.target, self.server.target)
+        self.assertEqual(sorted(row.name for row \
+                in self.replica.data["Port"].itervalues()),
+                ["eth0", "eth1", "eth2", "lag1"])
+        eth0 = self.port("eth0")
+        self.assertEqual(eth0._uuid, self.server.uuids["eth0"])
+        self.assertEqual(eth0.tag, 10)
+        self.assertEqual(eth0.resolve("interfaces")[0].name, "eth0")
+        self.assertEqual(self.replica.changes(self.replica.generation),
+                (self.replica.generation, {}))
+        self.assertEqual(self.replica.changes(0), None)
+
+    def test_changes(self):
+        uuids = self.server.uuids
+        since = self.change([{"op": "update", "table": "Port",
+            "where": [["_uuid", "==", ["uuid", uuids["eth0"]]]],
+            "row": {"tag": 99}}])
+        self.change([{"op": "mutate", "table": "Bridge", "where": [],
+            "mutations": [["ports", "delete", ["uuid", uuids["eth1"]]]]}])
+        generation, changed = self.replica.changes(since)
+        self.assertEqual(generation, self.replica.generation)
+        self.assertEqual(changed["Port"][uuids["eth0"]], ("modify", None))
+        op, row = changed["Port"][uuids["eth1"]]
+        self.assertEqual((op, row.name), ("delete", "eth1"))
+        self.assertEqual(changed["Interface"][uuids["iface1"]][0], "delete")
+        self.assertEqual(changed["Bridge"][uuids["br0"]], ("modify", None))
+        self.assertEqual(self.port("eth0").tag, 99)
+        self.assertEqual(self.port("eth1"), None)
+        # only what came after since
+        self.assertEqual(sorted(self.replica.changes(since + 1)[1]["Port"]),
+                [uuids["eth1"]])
+
+    def test_inserted_and_deleted(self):
+        since = self.replica.generation
+        rowid = self.server.insert("Port", {"name": "tmp"})
+        self.assertTrue(self.replica.sync())
+        self.assertEqual(self.replica.changes(since)[1]["Port"],
+                {rowid: ("insert", None)})
+        self.change([{"op": "delete", "table": "Port",
+            "where": [["_uuid", "==", ["uuid", rowid]]]}])
+        self.assertFalse(self.replica.changes(since)[1].get("Port"))
+
+    def test_volatile_not_journaled(self):
+        iface = self.server.uuids["iface0"]
+        since = self.change([{"op": "update", "table": "Interface",
+            "where": [["_uuid", "==", ["uuid", iface]]],
+            "row": {"statistics": counters(1000)}}])
+        self.assertTrue(self.replica.generation > since)
+        self.assertEqual(self.replica.changes(since),
+                (self.replica.generation, {}))
+        # the row itself is current
+        record = self.replica.get("Interface", iface)
+        self.assertEqual(record.statistics["rx_packets"], 1000)
+        self.assertEqual(record._version, str(self.replica.generation))
+
+    def test_journal_overflow(self):
+        self.addCleanup(setattr, replica, "journal_size",
+                replica.journal_size)
+        replica.journal_size = 2
+        since = self.replica.generation
+        for tag in (20, 21, 22):
+            self.change([{"op": "update", "table": "Port",
+                "where": [["name", "==", "eth0"]], "row": {"tag": tag}}])
+        # the first change fell out of the journal
+        self.assertEqual(self.replica.changes(since), None)
+        self.assertEqual(self.replica.changes(since + 1)[1].keys(), ["Port"])
+
+    def test_wait(self):
+        generation = self.replica.generation
+        started = time.time()
+        self.assertEqual(self.replica.wait(generation, 0.2), generation)
+        self.assertTrue(time.time() - started >= 0.2)
+        timer = threading.Timer(0.1, self.server.update, ("Port",
+            self.server.uuids["eth2"], {"tag": 40}))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        self.assertTrue(self.replica.wait(generation, 5) > generation)
+        self.assertEqual(self.port("eth2").tag, 40)
+
+    def test_wait_unsynced(self):
+        self.replica.stop()
+        deadline = time.time() + 5
+        while self.replica.synced and time.time() < deadline:
+            time.sleep(0.01)
+        started = time.time()
+        self.replica.wait(self.replica.generation, 5)
+        self.assertTrue(time.time() - started < 1)
+        self.assertEqual(self.replica.changes(self.replica.generation), None)
+
+    def test_transact(self):
+        rows = self.replica.transact(["Open_vSwitch", {"op": "select",
+            "table": "Port", "where": [["tag", "==", 11]],
+            "columns": ["name", "tag"]}])
+        self.assertEqual([row.name for row in rows[0]], ["eth1"])
+        # anything but selects of columns the replica keeps goes to the server
+        self.assertEqual(self.replica.transact(["Open_vSwitch",
+            {"op": "select", "table": "Port", "where": [],
+                "columns": ["external_ids"]}]), None)
+        self.assertEqual(self.replica.transact(["Open_vSwitch",
+            {"op": "delete", "table": "Port", "where": []}]), None)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir, "core"))
+
+import clientWrapper as dbclient
+import history
+import sampler
+from fakeovsdb import FakeOvsdb, counters, seed
+
+class SamplerTest(unittest.TestCase):
+    """
+    A Sampler reading a fresh FakeOvsdb holding seed() per test, whose
+    counters are moved on through the server as ovs-vswitchd would.
+    """
+    def setUp(self):
+        self.server = FakeOvsdb(seed())
+        self.addCleanup(self.server.close)
+        self.addCleanup(setattr, dbclient, "database", dbclient.database)
+        dbclient.database = self.server.target
+        self.history = history.History(history.tiers_for(5))
+        self.sampler = sampler.Sampler(history=self.history)
+
+    def count(self, iface, packets):
+        self.server.update("Interface", self.server.uuids[iface],
+                {"statistics": counters(packets)})
+
+    def test_sample(self):
+        self.assertEqual(self.sampler.target, self.server.target)
+        self.sampler.sample()
+        now, data = self.sampler.current
+        self.assertEqual(sorted(data["br0"]),
+                ["eth0", "eth1", "eth2", "lag1"])
+        self.assertEqual(data["br0"]["eth1"]["rx_packets"], 10)
+        self.assertEqual(data["br0"]["eth2"]["tx_bytes"], 2000)
+        # one sample is not enough for rates
+        self.assertEqual(self.sampler.rates("br0"), None)
+        self.assertEqual(self.sampler.top("rx_pps", 2), (None, []))
+        self.assertEqual(self.sampler.top("rx_packets", 2),
+                (now, [(20, "br0", "eth2"), (10, "br0", "eth1")]))
+        status = self.sampler.status()
+        self.assertEqual((status["samples"], status["errors"],
+            status["updated"]), (1, 0, now))
+
+    def test_rates(self):
+        self.sampler.sample()
+        time.sleep(0.05)
+        self.count("iface0", 100)
+        self.count("iface1", 5)
+        self.sampler.sample()
+        now, elapsed, ports = self.sampler.rates("br0")
+        self.assertEqual(now, self.sampler.current[0])
+        self.assertTrue(elapsed >= 0.05)
+        self.assertAlmostEqual(ports["eth0"]["rx_pps"], 100 / elapsed)
+        self.assertAlmostEqual(ports["eth0"]["tx_bps"], 8 * 10000 / elapsed)
+        self.assertEqual(ports["eth2"]["rx_pps"], 0)
+        self.assertEqual(ports["lag1"]["rx_errors_ps"], 0)
+        # eth1 was reset, its counters went backwards
+        self.assertEqual(ports["eth1"]["rx_pps"], None)
+        top = self.sampler.top("rx_pps", 1)
+        self.assertEqual(top[1], [(ports["eth0"]["rx_pps"], "br0", "eth0")])
+        self.assertEqual(self.sampler.rates("br1"), (now, elapsed, {}))
+
+    def test_history(self):
+        self.sampler.sample()
+        now = self.sampler.current[0]
+        step, start, values = self.history.query("br0", "eth1",
+                "rx_packets", now, now)
+        self.assertEqual((step, values), (5, [10]))
+        # a port deleted from the bridge is dropped with its history
+        self.server.transact([{"op": "mutate", "table": "Bridge",
+            "where": [], "mutations": [["ports", "delete",
+                ["uuid", self.server.uuids["eth1"]]]]}])
+        self.sampler.sample()
+        self.assertEqual(self.history.query("br0", "eth1", "rx_packets",
+            now, now), None)
+
+    def test_errors(self):
+        sample = self.sampler.sample
+        calls = []
+        def failing():
+            calls.append(None)
+            if len(calls) == 1:
+                raise KeyError("statistics")
+            sample()
+        self.sampler.sample = failing
+        self.sampler.interval = 0.01
+        self.sampler.start()
+        self.addCleanup(self.sampler.stop)
+        deadline = time.time() + 5
+        while self.sampler.status()["samples"] < 2 \
+                and time.time() < deadline:
+            time.sleep(0.01)
+        status = self.sampler.status()
+        # the error was counted and sampling went on
+        self.assertEqual(status["errors"], 1)
+        self.assertTrue(status["samples"] >= 2)
+        self.assertTrue(self.sampler.rates("br0") is not None)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -11,6 +11,45 @@ function nullify(strut) {
     })
 }
 
+/* Apply the inserted, modified and deleted rows of a /changes answer to
+ * list in place, matching rows on key. */
+function apply_changes(list, changes, key) {
+    if (!list || !changes)
+        return;
+    var find = function(id) {
+        for (var i = 0; i < list.length; i++) {
+            if (list[i][key] == id)
+                return i;
+        }
+        return -1;
+    };
+    changes.deleted.forEach(function(id) {
+        var index = find(id);
+        if (index >= 0)
+            list.splice(index, 1);
+    });
+    changes.inserted.concat(changes.modified).forEach(function(row) {
+        var index = find(row[key]);
+        if (index >= 0)
+            angular.copy(row, list[index]);
+        else
+            list.push(row);
+    });
+}
+
+/* Replace the contents of dst with those of src, keeping the arrays dst
+ * holds, so scopes that took them keep seeing the current rows. */
+function refill(dst, src) {
+    Object.keys(src).forEach(function(key) {
+        if (angular.isArray(dst[key]) && angular.isArray(src[key])) {
+            dst[key].length = 0;
+            Array.prototype.push.apply(dst[key], src[key]);
+        } else {
+            dst[key] = src[key];
+        }
+    });
+}
+
 function BridgeListCtrl($scope, $http) {
     var promise = $http.get('/bridges');
 
@@ -33,7 +72,8 @@ function BridgeListCtrl($scope, $http) {
     }
 }
 
-function BridgeDetailCtrl($scope, $routeParams, $http, $location) {
+function BridgeDetailCtrl($scope, $routeParams, $http, $location,
+        $timeout) {
     $scope.brname = $routeParams.bridgeId;
 
     var templates =
@@ -56,12 +96,83 @@ function BridgeDetailCtrl($scope, $routeParams, $http, $location) {
     }
 
     $scope.br = null;
-    var promise = $http.get('/bridges/'+$scope.brname);
+    var since = null;
+    var polling = true;
+
+    /* Long-poll the changes of the bridge and apply them in place. */
+    var apply = function(data) {
+        var br = $scope.br;
+        if (br) {
+            ['ports', 'lags', 'tunnels'].forEach(function(kind) {
+                apply_changes(br[kind], {
+                    inserted: data.ports.inserted[kind],
+                    modified: data.ports.modified[kind],
+                    deleted: data.ports.deleted}, 'name');
+            });
+            apply_changes(br.Mirrors, data.mirrors, 'name');
+            apply_changes(br.controller, data.controllers, 'uuid');
+        }
+        $scope.$broadcast('changes', data);
+    };
 
-    promise.then(function(response) {
-        $scope.br = response.data.bridge;
+    var poll = function() {
+        $http.get('/bridges/'+$scope.brname+'/changes',
+                {params: {since: since, wait: 25}}).
+            success(function(data) {
+                if (!polling)
+                    return;
+                if (data.resync) {
+                    // no replica on the server, stay with manual reloads
+                    if (data.generation == null)
+                        return;
+                    // missed too much: read the bridge again and go on
+                    // from the generation of this answer
+                    since = data.generation;
+                    load();
+                    return;
+                }
+                apply(data);
+                since = data.generation;
+                poll();
+            }).
+            error(function() {
+                if (polling)
+                    $timeout(poll, 5000);
+            });
+    };
+
+    $scope.$on('$destroy', function() {
+        polling = false;
     });
 
+    var load = function() {
+        $http.get('/bridges/'+$scope.brname).
+            success(function(data) {
+                if (!polling)
+                    return;
+                if ($scope.br && data.bridge) {
+                    refill($scope.br, data.bridge);
+                    $scope.$broadcast('resync');
+                } else {
+                    $scope.br = data.bridge;
+                }
+                if (since != null)
+                    poll();
+            }).
+            error(function() {
+                if (polling && since != null)
+                    $timeout(load, 5000);
+            });
+    };
+
+    // take the generation before the bridge, so no change falls in between
+    $http.get('/bridges/'+$scope.brname+'/changes').
+        success(function(data) {
+            since = data.generation;
+            load();
+        }).
+        error(load);
+
     $scope.goback = function() {
         $location.path('/bridges');
     };
@@ -276,6 +387,16 @@ function QueueCtrl($scope, $http) {
         $scope.queues = response.data.queues;
     });
 
+    $scope.$on('changes', function(event, data) {
+        apply_changes($scope.queues, data.queues, 'uuid');
+    });
+
+    $scope.$on('resync', function() {
+        $http.get('/bridges/'+$scope.brname+'/queues').success(function(data) {
+            $scope.queues = data.queues;
+        });
+    });
+
     $scope.update_queue = function(record) {
         var promise = $http.post('/bridges/'+$scope.brname+'/queues/'+record.uuid.slice(0,8)+'/update', record);
         promise.then(function(response) {
@@ -322,6 +443,16 @@ function QoSCtrl($scope, $http) {
         $scope.qoses = response.data.qoses;
     });
 
+    $scope.$on('changes', function(event, data) {
+        apply_changes($scope.qoses, data.qoses, 'uuid');
+    });
+
+    $scope.$on('resync', function() {
+        $http.get('/bridges/'+$scope.brname+'/qos').success(function(data) {
+            $scope.qoses = data.qoses;
+        });
+    });
+
     $scope.update_qos = function(record, cnt) {
         record.queues = record.queues.slice(0, cnt);
         var promise = $http.post('/bridges/'+$scope.brname+'/qos/'+record.uuid.slice(0,8)+'/update', record);